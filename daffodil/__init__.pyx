@@ -1,6 +1,13 @@
 from .parser import Daffodil, TimeStamp
-from .predicate import DictionaryPredicateDelegate
+from .predicate import DictionaryPredicateDelegate, ConditionPool
 from .hstore_predicate import HStoreQueryDelegate
+from .jsonb_predicate import JSONBQueryDelegate
+from .sqlite_predicate import SQLiteQueryDelegate
 from .pretty_print import PrettyPrintDelegate
 from .key_expectation_delegate import KeyExpectationDelegate
 from .simulation_delegate import SimulationMatchingDelegate
+from .cache import DaffodilCache, daffodil_cache
+from .daffodil_set import DaffodilSet
+from .index_advisor import IndexAdvisor
+from .segments import HStoreSegments
+from .indexed_dataset import IndexedDataset, IndexedDatasetDelegate
@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_MAX_SOURCE_CHARS = 32 * 1024 * 1024
+
+
+class _CacheEntry(object):
+    __slots__ = ("parse_result", "keys", "predicate", "expires", "size")
+
+    def __init__(self, parse_result, keys, predicate, expires, size):
+        self.parse_result = parse_result
+        self.keys = keys
+        self.predicate = predicate
+        self.expires = expires
+        self.size = size
+
+
+class DaffodilCache(object):
+    """
+    Thread-safe LRU cache of built Daffodils.
+
+    Entries are keyed on the daffodil source plus the delegate's
+    ``cache_key()`` so that delegates configured differently (eg. two
+    HStoreQueryDelegates pointing at different fields) never share a
+    predicate. The cache is bounded both by the number of entries and by the
+    total length of the cached sources, in characters. That's a proxy for the
+    memory held: the parse result and predicate of a source grow with it, but
+    by a factor depending on the delegate.
+
+    Daffodils built from the same source share the cached predicate, so it
+    may hold no state beyond memos of pure conversions. Delegates whose
+    predicates learn or count (eg. adaptive or instrumented
+    DictionaryPredicateDelegates) return None from ``cache_key()`` and are
+    never cached.
+
+    Daffodils using ``timestamp(CURRENT_*)`` bake the current date into their
+    predicate, so they expire as soon as the day/week/month/year boundary
+    they depend on passes.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_source_chars=DEFAULT_MAX_SOURCE_CHARS, clock=time.time):
+        self.max_entries = max_entries
+        self.max_source_chars = max_source_chars
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._source_chars = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires is not None and self.clock() >= entry.expires:
+                self._discard(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, parse_result, keys, predicate, expires=None):
+        size = len(key[0])
+        if size > self.max_source_chars or self.max_entries <= 0:
+            return
+
+        entry = _CacheEntry(parse_result, keys, predicate, expires, size)
+
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+
+            self._entries[key] = entry
+            self._source_chars += size
+
+            while len(self._entries) > self.max_entries or self._source_chars > self.max_source_chars:
+                oldest_key = next(iter(self._entries))
+                self._discard(oldest_key)
+                self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key)
+        self._source_chars -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._source_chars = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "source_chars": self._source_chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by every Daffodil unless another cache (or None) is passed in
+daffodil_cache = DaffodilCache()
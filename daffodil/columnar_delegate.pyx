@@ -0,0 +1,255 @@
+import numpy as np
+
+from .parser cimport Token, BaseDaffodilDelegate
+from .predicate cimport CMPFunctionHandler, _mk_cmp_handler
+
+
+# Sentinal to indicate a comment in the daffodil
+COMMENT = object()
+
+# Python compares ints and floats exactly, numpy goes through float64
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+COMPARISONS = {
+    "=": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+
+class _Columns(object):
+    """
+    The columns a predicate is evaluated against, split into values and
+    validity masks the first time each key is used.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.n_rows = len(next(iter(columns.values()))) if columns else 0
+        self._split = {}
+
+    def get(self, key):
+        """
+        Returns (values, valid) where valid is a boolean array or None when
+        every row has a value. Keys without a column are missing from every
+        row, so values is None.
+        """
+        try:
+            return self._split[key]
+        except KeyError:
+            pass
+
+        column = self.columns.get(key)
+        if column is None:
+            values, valid = None, np.zeros(self.n_rows, dtype=bool)
+        elif isinstance(column, np.ma.MaskedArray):
+            values, valid = column.data, ~np.ma.getmaskarray(column)
+        else:
+            values, valid = np.asarray(column), None
+
+        if values is not None and values.dtype.kind == "f":
+            nan = np.isnan(values)
+            if nan.any():
+                valid = ~nan if valid is None else valid & ~nan
+
+        split = values, valid
+        self._split[key] = split
+        return split
+
+
+def _distinct_objects(values):
+    """
+    The distinct values of an object column and each row's index among
+    them. Values are told apart by type too: 1 and True (or 0 and False)
+    are equal but coerce differently, which np.unique would conflate.
+    Unhashable values are evaluated once per row.
+    """
+    index = {}
+    distinct = []
+    inverse = np.empty(len(values), dtype=np.intp)
+    values = values.tolist()
+    for i, val in enumerate(values):
+        try:
+            j = index.setdefault((type(val), val), len(distinct))
+        except TypeError:
+            return values, None
+        if j == len(distinct):
+            distinct.append(val)
+        inverse[i] = j
+    return distinct, inverse
+
+
+def _is_number(val):
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+
+cdef class ColumnarPredicateDelegate(BaseDaffodilDelegate):
+    """
+    Evaluates a daffodil against whole columns at once.
+
+    The predicate takes a dict mapping each key to a numpy array (one entry
+    per row) and returns a boolean mask of matching rows. Missing values are
+    NaN in float columns or masked entries of a numpy.ma.MaskedArray; keys
+    without a column are missing from every row.
+
+    Results are identical to DictionaryPredicateDelegate on the equivalent
+    list of dicts, including its missing key and type coercion rules, with
+    the rows' missing values left out of their dict. So a NaN counts as a
+    missing key (``c ?= true`` is false, ``c != 1`` true), not as the
+    ``float("nan")`` ``column.tolist()`` would give. Comparisons that can't
+    be expressed as plain array operations are evaluated once per distinct
+    value in the column.
+    """
+    def _mk_group(self, children, combine, empty, negate):
+        children = [c for c in children if c is not COMMENT]
+
+        def pred(columns):
+            result = np.full(columns.n_rows, empty, dtype=bool)
+            for child in children:
+                combine(result, child(columns), out=result)
+            if negate:
+                np.logical_not(result, out=result)
+            return result
+
+        return pred
+
+    def mk_any(self, children):
+        return self._mk_group(children, np.logical_or, False, False)
+
+    def mk_all(self, children):
+        return self._mk_group(children, np.logical_and, True, False)
+
+    def mk_not_any(self, children):
+        return self._mk_group(children, np.logical_or, False, True)
+
+    def mk_not_all(self, children):
+        return self._mk_group(children, np.logical_and, True, True)
+
+    def mk_comment(self, comment, is_inline):
+        return COMMENT
+
+    def mk_test(self, test_str):
+        return test_str
+
+    cdef mk_cmp(self, Token key, Token test, Token val):
+        return self._mk_cmp(
+            key.content,
+            val.content,
+            self.mk_test(test.content)
+        )
+
+    def _mk_cmp(self, str key, object val, str test):
+        cdef CMPFunctionHandler handler = _mk_cmp_handler(key, test, val)
+        err_ret_val = handler.match({})
+
+        if test == "?=":
+            def pred(columns):
+                values, valid = columns.get(key)
+                if valid is None:
+                    return np.full(columns.n_rows, bool(val), dtype=bool)
+                return valid.copy() if val else ~valid
+            return pred
+
+        def pred(columns):
+            values, valid = columns.get(key)
+            if values is None:
+                return np.full(columns.n_rows, err_ret_val, dtype=bool)
+
+            result = self._vectorized_cmp(values, test, val)
+            if result is None:
+                return self._cmp_by_value(handler, key, values, valid, err_ret_val)
+
+            if valid is not None:
+                result[~valid] = err_ret_val
+            return result
+
+        return pred
+
+    def _vectorized_cmp(self, values, test, val):
+        """
+        Plain array comparison for the cases where it agrees exactly with
+        the python comparison in CMPFunctionHandler, None otherwise.
+        """
+        kind = values.dtype.kind
+
+        if test in ("in", "!in"):
+            if not isinstance(val, list):
+                return None
+            if kind in "iuf" and all(_is_number(v) for v in val):
+                if not self._exact_as_float(values, val):
+                    return None
+            elif not (kind == "U" and all(isinstance(v, str) for v in val)):
+                return None
+            return np.isin(values, val, invert=(test == "!in"))
+
+        if kind in "iuf":
+            if isinstance(val, str):
+                # the string gets coerced to a float, or fails to match at all
+                try:
+                    val = float(val)
+                except ValueError:
+                    return None
+            elif not _is_number(val):
+                return None
+
+            if not self._exact_as_float(values, [val]):
+                return None
+        elif kind == "U":
+            if not isinstance(val, str):
+                return None
+        else:
+            return None
+
+        return COMPARISONS[test](values, val)
+
+    def _exact_as_float(self, values, vals):
+        if any(isinstance(v, int) and abs(v) > MAX_EXACT_FLOAT_INT for v in vals):
+            return False
+        if values.dtype.kind in "iu" and any(isinstance(v, float) for v in vals):
+            return not len(values) or np.abs(values).max() <= MAX_EXACT_FLOAT_INT
+        return True
+
+    def _cmp_by_value(self, CMPFunctionHandler handler, key, values, valid, err_ret_val):
+        """
+        Runs the regular comparison once per distinct value and broadcasts
+        the results, or once per row if the values can't be sorted.
+        """
+        result = np.full(len(values), err_ret_val, dtype=bool)
+        if valid is not None:
+            values = values[valid]
+
+        if values.dtype.kind == "O":
+            distinct, inverse = _distinct_objects(values)
+        else:
+            try:
+                distinct, inverse = np.unique(values, return_inverse=True)
+            except TypeError:
+                distinct, inverse = values, None
+            distinct = distinct.tolist()
+
+        matches = np.fromiter(
+            (handler.match({key: v}) for v in distinct),
+            dtype=bool, count=len(distinct)
+        )
+        if inverse is not None:
+            matches = matches[inverse.reshape(-1)]
+
+        if valid is None:
+            result[:] = matches
+        else:
+            result[valid] = matches
+        return result
+
+    def finalize(self, predicate):
+        return lambda columns: predicate(_Columns(columns))
+
+    def call(self, predicate, columns):
+        return predicate(columns)
+
+    def optimizable(self):
+        return True
+
+    def cache_key(self):
+        return (type(self),)
@@ -0,0 +1,514 @@
+from .parser cimport Token, BaseDaffodilDelegate
+from .parser import Daffodil
+from .predicate import DictionaryPredicateDelegate, ConditionPool
+
+
+INF = float("inf")
+
+# Sentinal to indicate a comment in the daffodil
+COMMENT = object()
+
+
+class KeyConstraint(object):
+    """
+    Necessary conditions on one key for a filter to match: the key is
+    present, its value is one of ``values`` (as index keys, see
+    ``value_index_keys``) when that isn't None, and its numeric value lies
+    within the interval when ``has_interval`` is set.
+    """
+    __slots__ = ("values", "has_interval", "lo", "lo_inc", "hi", "hi_inc")
+
+    def __init__(self, values=None, has_interval=False, lo=-INF, lo_inc=True, hi=INF, hi_inc=True):
+        self.values = values
+        self.has_interval = has_interval
+        self.lo = lo
+        self.lo_inc = lo_inc
+        self.hi = hi
+        self.hi_inc = hi_inc
+
+    def copy(self):
+        return KeyConstraint(self.values, self.has_interval, self.lo, self.lo_inc, self.hi, self.hi_inc)
+
+    def intersect(self, other):
+        """
+        Both constraints hold.
+        """
+        if other.values is not None and (self.values is None or len(other.values) < len(self.values)):
+            self.values = other.values
+
+        if other.has_interval:
+            self.has_interval = True
+            if other.lo > self.lo or (other.lo == self.lo and not other.lo_inc):
+                self.lo, self.lo_inc = other.lo, other.lo_inc
+            if other.hi < self.hi or (other.hi == self.hi and not other.hi_inc):
+                self.hi, self.hi_inc = other.hi, other.hi_inc
+
+    def union(self, other):
+        """
+        At least one of the constraints holds.
+        """
+        if self.values is not None and other.values is not None:
+            self.values = self.values | other.values
+        else:
+            self.values = None
+
+        if self.has_interval and other.has_interval:
+            if other.lo < self.lo or (other.lo == self.lo and other.lo_inc):
+                self.lo, self.lo_inc = other.lo, other.lo_inc
+            if other.hi > self.hi or (other.hi == self.hi and other.hi_inc):
+                self.hi, self.hi_inc = other.hi, other.hi_inc
+        else:
+            self.has_interval = False
+            self.lo, self.lo_inc, self.hi, self.hi_inc = -INF, True, INF, True
+
+    def has_usable_interval(self):
+        """
+        Set and non-empty, contradictory ranges are left to the predicate.
+        """
+        if not self.has_interval:
+            return False
+        return self.lo < self.hi or (self.lo == self.hi and self.lo_inc and self.hi_inc)
+
+    def contains(self, x):
+        if x < self.lo or (x == self.lo and not self.lo_inc):
+            return False
+        if x > self.hi or (x == self.hi and not self.hi_inc):
+            return False
+        return True
+
+
+def _is_number(val):
+    return (type(val) is int or type(val) is float)
+
+
+def value_index_keys(val):
+    """
+    The keys a comparison value is indexed under. Numbers are indexed as
+    themselves and strings as themselves plus their float value, mirroring
+    the coercion DictionaryPredicateDelegate applies when comparing strings
+    with numbers.
+    """
+    if _is_number(val):
+        return {val}
+    try:
+        return {val, float(val)}
+    except ValueError:
+        return {val}
+
+
+cdef class ConstraintDelegate(BaseDaffodilDelegate):
+    """
+    Derives the conditions every matching data point must satisfy.
+
+    The result is a dict of key to KeyConstraint (every key in it must be
+    present), or None when the daffodil can never match. The analysis is
+    conservative: anything it can't reason about (negated groups, "!=",
+    comparisons against booleans) adds no constraint.
+    """
+    def _mk_all(self, children):
+        constraints = {}
+        for child in children:
+            if child is COMMENT:
+                continue
+            if child is None:
+                return None
+            for key, constraint in child.items():
+                if key in constraints:
+                    constraints[key].intersect(constraint)
+                else:
+                    constraints[key] = constraint.copy()
+        return constraints
+
+    def _mk_any(self, children):
+        children = [c for c in children if c is not COMMENT and c is not None]
+        if not children:
+            return None
+
+        constraints = {}
+        for key, constraint in children[0].items():
+            if all(key in child for child in children[1:]):
+                constraint = constraint.copy()
+                for child in children[1:]:
+                    constraint.union(child[key])
+                constraints[key] = constraint
+        return constraints
+
+    def mk_any(self, children):
+        return self._mk_any(children)
+
+    def mk_all(self, children):
+        return self._mk_all(children)
+
+    def mk_not_any(self, children):
+        return {}
+
+    def mk_not_all(self, children):
+        # "!{}" never matches, anything else negated is beyond this analysis
+        if all(c is COMMENT for c in children):
+            return None
+        return {}
+
+    def mk_comment(self, comment, is_inline):
+        return COMMENT
+
+    def mk_test(self, test_str):
+        return test_str
+
+    cdef mk_cmp(self, Token key, Token test, Token val):
+        return self._mk_cmp(
+            key.content,
+            val.content,
+            self.mk_test(test.content)
+        )
+
+    def _mk_cmp(self, key, val, test):
+        if test in ("!=", "!in"):
+            return {}
+        if test == "?=":
+            return {key: KeyConstraint()} if val else {}
+
+        if test == "=":
+            if _is_number(val) or isinstance(val, str):
+                return {key: KeyConstraint(values=frozenset(value_index_keys(val)))}
+        elif test == "in":
+            if isinstance(val, list) and all(_is_number(v) or isinstance(v, str) for v in val):
+                values = set()
+                for v in val:
+                    values |= value_index_keys(v)
+                return {key: KeyConstraint(values=frozenset(values))}
+        elif _is_number(val):
+            # a string compared to a number is compared as a float, or fails
+            if test == "<":
+                return {key: KeyConstraint(has_interval=True, hi=val, hi_inc=False)}
+            if test == "<=":
+                return {key: KeyConstraint(has_interval=True, hi=val)}
+            if test == ">":
+                return {key: KeyConstraint(has_interval=True, lo=val, lo_inc=False)}
+            if test == ">=":
+                return {key: KeyConstraint(has_interval=True, lo=val)}
+
+        return {key: KeyConstraint()}
+
+    def cache_key(self):
+        return (type(self),)
+
+
+class _IntervalTree(object):
+    """
+    Static centered interval tree over (constraint, filter_id) pairs,
+    answering which intervals contain a point.
+    """
+    __slots__ = ("center", "by_lo", "by_hi", "left", "right")
+
+    def __init__(self, entries):
+        endpoints = sorted(
+            [c.lo for c, _ in entries if c.lo != -INF] + [c.hi for c, _ in entries if c.hi != INF]
+        )
+        self.center = endpoints[len(endpoints) // 2] if endpoints else 0
+
+        here, left, right = [], [], []
+        for entry in entries:
+            constraint = entry[0]
+            if constraint.hi < self.center:
+                left.append(entry)
+            elif constraint.lo > self.center:
+                right.append(entry)
+            else:
+                here.append(entry)
+
+        self.by_lo = sorted(here, key=lambda e: e[0].lo)
+        self.by_hi = sorted(here, key=lambda e: e[0].hi, reverse=True)
+        # the center is one of the endpoints, so "here" is never empty and
+        # each side holds fewer entries than this node
+        self.left = _IntervalTree(left) if left else None
+        self.right = _IntervalTree(right) if right else None
+
+    def query(self, x, out):
+        node = self
+        while node is not None:
+            if x < node.center:
+                for constraint, filter_id in node.by_lo:
+                    if constraint.lo > x:
+                        break
+                    if constraint.contains(x):
+                        out.append(filter_id)
+                node = node.left
+            elif x > node.center:
+                for constraint, filter_id in node.by_hi:
+                    if constraint.hi < x:
+                        break
+                    if constraint.contains(x):
+                        out.append(filter_id)
+                node = node.right
+            else:
+                for constraint, filter_id in node.by_lo:
+                    if constraint.contains(x):
+                        out.append(filter_id)
+                return
+
+
+class _KeyIndex(object):
+    """
+    Filters routed through one key: by value, by interval, or only by the
+    key being present.
+    """
+    def __init__(self):
+        self.by_value = {}
+        self.value_filters = set()
+        self.intervals = {}
+        self.present = set()
+        self._tree = None
+
+    def __len__(self):
+        return len(self.value_filters) + len(self.intervals) + len(self.present)
+
+    def add_values(self, filter_id, values):
+        for value in values:
+            self.by_value.setdefault(value, set()).add(filter_id)
+        self.value_filters.add(filter_id)
+
+    def add_interval(self, filter_id, constraint):
+        self.intervals[filter_id] = constraint
+        self._tree = None
+
+    def remove(self, filter_id, constraint):
+        if filter_id in self.value_filters:
+            self.value_filters.discard(filter_id)
+            for value in constraint.values:
+                postings = self.by_value[value]
+                postings.discard(filter_id)
+                if not postings:
+                    del self.by_value[value]
+        elif filter_id in self.intervals:
+            del self.intervals[filter_id]
+            self._tree = None
+        else:
+            self.present.discard(filter_id)
+
+    def collect(self, value, out):
+        out.extend(self.present)
+
+        value_type = type(value)
+        if value_type is str:
+            postings = self.by_value.get(value)
+            if postings:
+                out.extend(postings)
+            try:
+                number = float(value)
+            except ValueError:
+                return
+        elif value_type is int or value_type is float:
+            number = value
+        else:
+            # other types (bools, None, lists...) compare in ways the index
+            # doesn't model, so every filter on this key is a candidate
+            out.extend(self.value_filters)
+            out.extend(self.intervals)
+            return
+
+        postings = self.by_value.get(number)
+        if postings:
+            out.extend(postings)
+
+        if self.intervals:
+            if self._tree is None:
+                self._tree = _IntervalTree([(c, f) for f, c in self.intervals.items()])
+            self._tree.query(number, out)
+
+
+class _IndexedFilter(object):
+    __slots__ = ("daffodil", "predicate", "required", "route")
+
+    def __init__(self, daffodil, required, route):
+        self.daffodil = daffodil
+        self.predicate = daffodil.predicate
+        self.required = required
+        self.route = route
+
+
+class DaffodilSet(object):
+    """
+    Matches one data point against many daffodils at once.
+
+    Each filter is analysed (see ConstraintDelegate) for the keys a
+    matching data point must have and the values or numeric ranges those
+    keys must take. The filter is then indexed under its most selective
+    condition: a value for "=" / "in", an interval for range comparisons,
+    or just a required key. ``match`` only evaluates the filters the data
+    point's keys and values route to, and only when all of their required
+    keys are present. Results are identical to evaluating every filter.
+
+    With ``share_conditions`` (the default) filters are built on one
+    ConditionPool, so a condition used by many filters is evaluated once per
+    data point. ``stats()["conditions"]`` reports the pool's statistics.
+    """
+    def __init__(self, filters=None, share_conditions=True):
+        self._filters = {}
+        self._by_key = {}
+        self._always = set()
+
+        self.pool = ConditionPool() if share_conditions else None
+        self._delegate = DictionaryPredicateDelegate(pool=self.pool)
+
+        if filters:
+            for filter_id, daffodil in filters.items():
+                self.add(filter_id, daffodil)
+
+    def __len__(self):
+        return len(self._filters)
+
+    def __contains__(self, filter_id):
+        return filter_id in self._filters
+
+    def add(self, filter_id, daffodil):
+        """
+        Adds (or replaces) a filter, given as daffodil source or as a
+        Daffodil using DictionaryPredicateDelegate.
+        """
+        if filter_id in self._filters:
+            self.remove(filter_id)
+
+        if not isinstance(daffodil, Daffodil):
+            daffodil = Daffodil(daffodil)
+        elif not isinstance(daffodil.delegate, DictionaryPredicateDelegate):
+            raise TypeError("DaffodilSet needs Daffodils using DictionaryPredicateDelegate")
+
+        if self.pool is not None:
+            daffodil = Daffodil(daffodil.parse_result, self._delegate)
+
+        constraints = daffodil.lower(ConstraintDelegate())
+        if constraints is None:
+            route = None
+            required = frozenset()
+        else:
+            route = self._choose_route(constraints)
+            required = frozenset(constraints)
+
+        entry = _IndexedFilter(daffodil, required, route)
+        self._filters[filter_id] = entry
+
+        if route is None:
+            return
+        if route == ():
+            self._always.add(filter_id)
+            return
+
+        key, constraint = route
+        index = self._by_key.get(key)
+        if index is None:
+            index = self._by_key[key] = _KeyIndex()
+
+        if constraint.values is not None:
+            index.add_values(filter_id, constraint.values)
+        elif constraint.has_interval:
+            index.add_interval(filter_id, constraint)
+        else:
+            index.present.add(filter_id)
+
+    def _choose_route(self, constraints):
+        """
+        The (key, constraint) to index a filter under, or () when it has no
+        required keys and must be evaluated for every data point.
+        """
+        if not constraints:
+            return ()
+
+        # values before intervals before bare keys, then whichever route
+        # currently has the fewest filters behind it, which spreads filters
+        # away from low cardinality keys
+        def rank(item):
+            key, constraint = item
+            index = self._by_key.get(key)
+            if constraint.values is not None:
+                by_value = index.by_value if index is not None else {}
+                return (0, sum([len(by_value.get(v, ())) + 1 for v in constraint.values]))
+            if constraint.has_usable_interval():
+                bounded = (constraint.lo != -INF) + (constraint.hi != INF)
+                return (1, -bounded, len(index.intervals) if index is not None else 0)
+            return (2, len(index.present) if index is not None else 0)
+
+        key, constraint = min(constraints.items(), key=rank)
+        if constraint.values is None and not constraint.has_usable_interval():
+            constraint = KeyConstraint()
+        return key, constraint
+
+    def remove(self, filter_id):
+        entry = self._filters.pop(filter_id)
+        if entry.route is None:
+            return
+        if entry.route == ():
+            self._always.discard(filter_id)
+            return
+
+        key, constraint = entry.route
+        index = self._by_key[key]
+        index.remove(filter_id, constraint)
+        if not len(index):
+            del self._by_key[key]
+
+    def candidates(self, data_point):
+        """
+        Ids of the filters which may match the data point, a superset of
+        the ones which do.
+        """
+        if data_point is None:
+            return set(self._filters)
+
+        out = list(self._always)
+        by_key = self._by_key
+        for key, value in data_point.items():
+            index = by_key.get(key)
+            if index is not None:
+                index.collect(value, out)
+        return set(out)
+
+    def match(self, data_point):
+        """
+        Set of ids of the filters matching the data point.
+        """
+        matches = set()
+        filters = self._filters
+        candidates = self.candidates(data_point)
+
+        if self.pool is not None:
+            self.pool.begin(data_point)
+        try:
+            for filter_id in candidates:
+                entry = filters[filter_id]
+                if data_point is not None:
+                    if not all([key in data_point for key in entry.required]):
+                        continue
+                if entry.predicate(data_point):
+                    matches.add(filter_id)
+        finally:
+            if self.pool is not None:
+                self.pool.end()
+        return matches
+
+    def stats(self):
+        """
+        How the filters are indexed.
+        """
+        by_value = by_interval = by_key = never = 0
+        for entry in self._filters.values():
+            if entry.route is None:
+                never += 1
+            elif entry.route != ():
+                constraint = entry.route[1]
+                if constraint.values is not None:
+                    by_value += 1
+                elif constraint.has_interval:
+                    by_interval += 1
+                else:
+                    by_key += 1
+
+        return {
+            "filters": len(self._filters),
+            "keys": len(self._by_key),
+            "by_value": by_value,
+            "by_interval": by_interval,
+            "by_key": by_key,
+            "always": len(self._always),
+            "never": never,
+            "conditions": self.pool.stats() if self.pool is not None else None,
+        }
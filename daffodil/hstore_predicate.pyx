@@ -1,3 +1,5 @@
+import json
+import re
 from collections import UserString
 from .parser cimport Token, BaseDaffodilDelegate
 
@@ -11,10 +13,102 @@ class ExpressionStr(UserString):
     """
     Subclass of str() that allows annotations based on which key and
     test are being used.
+
+    Comparisons which check the key exists (and holds a number, for numeric
+    values) also keep that guard, the comparison itself and whether the
+    guard must pass (POSITIVE) or fail (NEGATIVE) apart, so that conditions
+    on the same key can share a guard (see group_by_key).
     """
     daff_key = ''
     daff_test = ''
     daff_val = ''
+    daff_guard = None
+    daff_cmp = None
+    daff_family = None
+    daff_cast_expr = None
+    daff_sql_val = None
+
+
+POSITIVE = "positive"
+NEGATIVE = "negative"
+
+# Tests whose conditions on a key are merged under a single guard. Equalities
+# are left to optimize_equality_and.
+GROUPED_TESTS = frozenset(("in", "<", "<=", ">", ">=", "!=", "!in"))
+
+
+def group_by_key(children, is_all):
+    """
+    Merges the guarded comparisons on the same key of an all/any group into
+    one expression, so the existence test and type check regex run once per
+    row instead of once per comparison:
+
+        (h?'age') AND <regex> AND (h->'age')::numeric >= 18
+        (h?'age') AND <regex> AND (h->'age')::numeric <= 35
+
+    become ``(h?'age') AND <regex> AND ((h->'age')::numeric BETWEEN 18 AND 35)``.
+    Merged expressions take the place of the first comparison on their key.
+    """
+    groups = {}
+    for child_exp in children:
+        if isinstance(child_exp, ExpressionStr) and child_exp.daff_family and child_exp.daff_test in GROUPED_TESTS:
+            groups.setdefault((child_exp.daff_key, child_exp.daff_family, child_exp.daff_guard), []).append(child_exp)
+
+    if all(len(group) == 1 for group in groups.values()):
+        return children
+
+    grouped = []
+    for child_exp in children:
+        if not isinstance(child_exp, ExpressionStr) or child_exp.daff_test not in GROUPED_TESTS:
+            grouped.append(child_exp)
+            continue
+
+        group = groups.pop((child_exp.daff_key, child_exp.daff_family, child_exp.daff_guard), None)
+        if group is None:
+            # merged into an earlier expression
+            continue
+        grouped.append(group[0] if len(group) == 1 else merge_comparisons(group, is_all))
+
+    return grouped
+
+
+def merge_comparisons(group, is_all):
+    first = group[0]
+    cmps = [child_exp.daff_cmp for child_exp in group]
+
+    if is_all and first.daff_family == POSITIVE:
+        lower = [child_exp for child_exp in group if child_exp.daff_test == ">="]
+        upper = [child_exp for child_exp in group if child_exp.daff_test == "<="]
+        if len(lower) == 1 and len(upper) == 1:
+            between = "{} BETWEEN {} AND {}".format(
+                lower[0].daff_cast_expr, lower[0].daff_sql_val, upper[0].daff_sql_val
+            )
+            cmps = [between if cmp == lower[0].daff_cmp else cmp for cmp in cmps if cmp != upper[0].daff_cmp]
+
+    if first.daff_family == POSITIVE:
+        # the key must exist for any of the comparisons to pass
+        sql = "{} AND ({})".format(first.daff_guard, (" AND " if is_all else " OR ").join(cmps))
+    else:
+        # a missing key passes every one of them
+        sql = "{} OR ({})".format(first.daff_guard, (" AND " if is_all else " OR ").join(cmps))
+
+    expr = ExpressionStr(sql)
+    expr.daff_key = first.daff_key
+    expr.daff_test = first.daff_test
+    expr.daff_val = None
+    expr.daff_family = first.daff_family
+    return expr
+
+
+# Checks the value of a key compared to a number is one before casting it,
+# formatted with the field and key
+NUMERIC_TYPE_CHECK = [
+        "({0}->'{1}') ~ E'^(?=.+)(?:[0-9]\\\d*|0)?(?:\\\.\\\d+)?$'",
+        " AND "
+]
+
+# Column alias of the sliced hstore, see HStoreQueryDelegate.sliced
+SLICE_ALIAS = "daffodil_slice"
 
 
 def forces_existence_optimizer(children):
@@ -73,11 +167,68 @@ def make_sql_array(*strings):
         ",".join(escape_string_sql(s) for s in strings)
     )
 
+
+# In parameterized mode values are embedded in the SQL as markers while it's
+# built, and swapped for placeholders by finalize(). NUL can't be part of a
+# daffodil (the source is cleaned of non printable characters) nor of json.
+PARAM_MARKER_RE = re.compile("\x00([^\x00]*)\x00")
+
+def param_marker(val):
+    return "\x00{}\x00".format(json.dumps(val))
+
+def extract_params(sql):
+    """
+    Replaces the parameter markers in ``sql`` by "%s" placeholders, returning
+    the SQL and its parameters. Any other "%" is doubled for the DB-API.
+    """
+    params = []
+    chunks = PARAM_MARKER_RE.split(sql)
+    for i in range(1, len(chunks), 2):
+        params.append(json.loads(chunks[i]))
+        chunks[i] = "%s"
+    for i in range(0, len(chunks), 2):
+        chunks[i] = chunks[i].replace("%", "%%")
+    return "".join(chunks), params
+
+
 cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
+    """
+    Builds the SQL condition matching a Daffodil on an hstore column.
+
+    With ``parameterized=True`` the predicate is a ``(sql, params)`` pair
+    with "%s" placeholders for the values, keys being escaped and kept in
+    the SQL. Filters differing only in their values give identical SQL, so
+    the database can reuse plans, and arrays are passed as a single array
+    parameter so their length doesn't change the SQL either.
+
+    With ``group_by_key=True`` comparisons on the same key share a single
+    existence test and type check (see ``group_by_key``). It's off until
+    EXPLAIN ANALYZE timings show it pays off, and that plans don't get
+    worse (test/benchmarks/bench_hstore_grouping.py measures both).
+
+    ``indexed_keys`` are keys with a partial index on ``field ? key`` (see
+    daffodil.index_advisor). Groups testing them for existence aren't
+    folded into ``?&`` / ``?|``, which the planner can't match against
+    those indexes' predicates.
+    """
     cdef public str field
+    cdef public bint parameterized
+    cdef public bint group_by_key
+    cdef public frozenset indexed_keys
 
-    def __cinit__(self, hstore_field_name):
+    def __cinit__(self, hstore_field_name, parameterized=False, group_by_key=False, indexed_keys=None):
         self.field = hstore_field_name
+        self.parameterized = parameterized
+        self.group_by_key = group_by_key
+        self.indexed_keys = frozenset(indexed_keys or ())
+
+    def quote(self, s):
+        if self.parameterized:
+            s = s.replace("'", "''")
+        return escape_string_sql(s)
+
+    def sql_array(self, strings):
+        return "ARRAY[{}]".format(",".join(self.quote(s) for s in strings))
 
     def mk_any(self, children):
         if not children or not any(children):
@@ -85,6 +236,8 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
 
         if isinstance(children, list):
             children = [c for c in children if c]
+        if self.group_by_key:
+            children = group_by_key(children, False)
 
         sql_expr = " OR ".join(f"({child_exp})" for child_exp in children)
 
@@ -97,7 +250,14 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
         if len(keys) <= 1:
             return sql_expr
 
-        keys = make_sql_array(*keys)
+        if self.indexed_keys and any(
+            child_exp.daff_test == "?=" and child_exp.daff_key in self.indexed_keys
+            for child_exp in children
+        ):
+            return sql_expr
+
+        # sorted, so the same filter always gives the same SQL
+        keys = self.sql_array(sorted(keys))
         optimization_expr = f"{self.field} {hstore_oper} {keys}"
 
         sql_expr = f" {logical_oper} ".join(
@@ -117,11 +277,16 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
         if len(unique_keys) < 2 or len(keys) != len(unique_keys):
             return sql_expr
 
-        keys_and_values = ", ".join(
-            f'"{child_exp.daff_key}"=>"{child_exp.daff_val}"'
-            for child_exp in to_optimize
-        )
-        sql_optimized = f"{self.field} @> '{keys_and_values}'"
+        if self.parameterized:
+            keys = self.sql_array([child_exp.daff_key for child_exp in to_optimize])
+            values = ",".join(param_marker(str(child_exp.daff_val)) for child_exp in to_optimize)
+            sql_optimized = f"{self.field} @> hstore({keys}, ARRAY[{values}])"
+        else:
+            keys_and_values = ", ".join(
+                f'"{child_exp.daff_key}"=>"{child_exp.daff_val}"'
+                for child_exp in to_optimize
+            )
+            sql_optimized = f"{self.field} @> '{keys_and_values}'"
 
         remaining_children = [child_exp for child_exp in children if child_exp.daff_test != "="]
         if not len(remaining_children):
@@ -146,6 +311,8 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
 
         if isinstance(children, list):
             children = [c for c in children if c]
+        if self.group_by_key:
+            children = group_by_key(children, True)
 
         sql_expr = " AND ".join(f"({child_exp})" for child_exp in children if child_exp)
 
@@ -201,6 +368,10 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
         daff_test = test.test_str
         daff_val = val
 
+        if self.parameterized:
+            key = key.replace("'", "''")
+
+        family = guard = None
         if getattr(test, "is_datapoint_test", False):
             # here we cover:
             # [NOT] hstore_col ? '1ukmoviestudios - Disney'
@@ -211,6 +382,10 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
         else:
             is_eq_test = getattr(test, "is_EQ_test", False)
             _type, cast, val, type_check = self.cond_cast(val)
+            if self.parameterized:
+                val = param_marker(daff_val)
+                if _type == list and daff_test in {"in", "!in"}:
+                    test = self.mk_array_test(daff_test, cast)
             test_ignores_missing_data = (
                 daff_test in {"=", "in", "<", "<=", ">", ">="}
             )
@@ -222,6 +397,9 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
                 # if its cast - exclude those not matching type
                 key_format = key_format % (" NOT " + type_check[0] + " OR " if cast else "")
 
+                family = NEGATIVE
+                guard = "NOT ({0}?'{1}')" + (" OR NOT " + type_check[0] if cast else "")
+
             elif is_eq_test and _type == str:
                 # here we convert '=' to '@>'
                 # instead of:
@@ -235,16 +413,27 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
                 # hs_answers?'industries - luxury' AND hs_answers->'industries - luxury' = 'yes'
                 key_format = "({0}?'{1}') AND {3} ({0}->'{1}'){2}"
 
+                family = POSITIVE
+                guard = "({0}?'{1}')" + (" AND " + type_check[0] if cast else "")
+
             else:
                 key_format = "{3} ({0}->'{1}'){2} "
 
-            key = key_format.format(self.field, key, cast, "".join(type_check)).format(self.field, key)
+            sql_key = key
+            key = key_format.format(self.field, sql_key, cast, "".join(type_check)).format(self.field, sql_key)
 
         expr = ExpressionStr(test(key, val, _type))
         expr.daff_key = daff_key
         expr.daff_test = daff_test
         expr.daff_val = daff_val
 
+        if family is not None:
+            expr.daff_family = family
+            expr.daff_guard = guard.format(self.field, sql_key)
+            expr.daff_cast_expr = "({0}->'{1}'){2}".format(self.field, sql_key, cast)
+            expr.daff_sql_val = val
+            expr.daff_cmp = test(expr.daff_cast_expr, val, _type)
+
         return expr
 
     def cond_cast(self, val):
@@ -269,10 +458,6 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
 
                     return [m["type"]] + [m[a](val) for a in ["cast", "value", "type_check"]]
 
-        NUMERIC_TYPE_CHECK = [
-                "({0}->'{1}') ~ E'^(?=.+)(?:[0-9]\\\d*|0)?(?:\\\.\\\d+)?$'",
-                " AND "
-        ]
         CAST_AND_TYPE_MAP = [
             {
                 "type": int,
@@ -303,5 +488,52 @@ cdef class HStoreQueryDelegate(BaseDaffodilDelegate):
         return get_cast_attr(val)
 
 
+    def mk_array_test(self, daff_test_str, cast):
+        # a single array parameter instead of one placeholder per value
+        array_type = "numeric[]" if cast else "text[]"
+        if daff_test_str == "in":
+            test_fn = lambda k, v, t: "{0} = ANY({1}::{2})".format(k, v, array_type)
+        else:
+            test_fn = lambda k, v, t: "{0} <> ALL({1}::{2})".format(k, v, array_type)
+        test_fn.is_IN_test = daff_test_str == "in"
+        test_fn.is_NOT_IN_test = daff_test_str == "!in"
+        test_fn.test_str = daff_test_str
+        return test_fn
+
+    def finalize(self, predicate):
+        if self.parameterized:
+            return extract_params(str(predicate))
+        return predicate
+
     def call(self, predicate, queryset):
+        if self.parameterized:
+            sql, params = predicate
+            return queryset.extra(where=[sql], params=params) if sql else queryset
         return queryset.extra(where=[predicate]) if predicate else queryset
+
+    def sliced(self, predicate, queryset, keys, chunk_size=2000):
+        """
+        Iterates over ``(pk, data)`` for the rows of ``queryset`` matching
+        ``predicate``, ``data`` holding only the hstore's ``keys`` (those
+        present) instead of the whole column. Rows are fetched
+        ``chunk_size`` at a time through a server-side cursor.
+        """
+        queryset = self.call(predicate, queryset).extra(
+            select={SLICE_ALIAS: "slice({}, %s)".format(self.field)},
+            select_params=[sorted(keys)],
+        )
+        return queryset.values_list("pk", SLICE_ALIAS).iterator(chunk_size=chunk_size)
+
+    def optimizable(self):
+        # Not until the rewritten SQL is checked against Postgres: [a = "x",
+        # a = "y"] loses its GIN-indexable @> tests to an IN, and a key
+        # holding NULL fails both a = "x" and a != "x", so the folded
+        # tautologies aren't true in SQL. Daffodil(..., optimize=True) still
+        # opts in.
+        return False
+
+    def cache_key(self):
+        return (type(self), self.field, self.parameterized, self.group_by_key, self.indexed_keys)
+
+    def __reduce__(self):
+        return (type(self), (self.field, self.parameterized, self.group_by_key, self.indexed_keys))
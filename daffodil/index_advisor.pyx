@@ -0,0 +1,247 @@
+import hashlib
+import re
+from collections import Counter
+
+from .parser cimport Node, Group, Condition, Comment
+from .parser import Daffodil
+from .hstore_predicate import HStoreQueryDelegate, NUMERIC_TYPE_CHECK
+from .daffodil_set import ConstraintDelegate
+
+
+GIN = "gin"
+NUMERIC = "numeric"
+EXISTS = "exists"
+
+# ties are broken in this order
+KIND_ORDER = {GIN: 0, NUMERIC: 1, EXISTS: 2}
+
+# hstore operators a GIN index can answer
+GIN_OPERATORS_RE = re.compile(r"@>|\?[&|]?")
+SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def _is_number(val):
+    return (type(val) is int or type(val) is float)
+
+
+def value_type(val):
+    if isinstance(val, list):
+        return value_type(val[0]) if val else "array"
+    if isinstance(val, bool):
+        return "boolean"
+    if _is_number(val):
+        return "numeric"
+    return "string"
+
+
+def index_name(*parts):
+    raw = "_".join(parts)
+    name = re.sub(r"\W+", "_", raw).strip("_").lower()
+    if name != raw or len(name) > MAX_IDENTIFIER_LENGTH:
+        # keys differing only in what's sanitized or cut off (eg. "a-b",
+        # "a b" and "A_B") would otherwise share the name, and CREATE INDEX
+        # IF NOT EXISTS would skip all but the first
+        digest = hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()[:8]
+        name = "{}_{}".format(name[:MAX_IDENTIFIER_LENGTH - 9], digest)
+    return name
+
+
+def _conditions(Node node):
+    if isinstance(node, Condition):
+        yield node
+    elif isinstance(node, Group):
+        for child in (<Group>node).children:
+            yield from _conditions(child)
+
+
+def _uses_gin(Node node):
+    """
+    Whether every match of ``node`` satisfies a condition which
+    HStoreQueryDelegate turns into SQL a GIN index answers: the ``?``
+    guarding positive comparisons, ``?=`` tests and string equalities
+    (``@>``), in every branch of "any" groups.
+    """
+    cdef Group group
+    if isinstance(node, Condition):
+        test = (<Condition>node).test.content
+        return test not in ("!=", "!in") and not (test == "?=" and not (<Condition>node).val.content)
+
+    group = <Group>node
+    children = [child for child in group.children if not isinstance(child, Comment)]
+    if group.negate or not children:
+        return False
+    if group.is_all:
+        return any(_uses_gin(child) for child in children)
+    return all(_uses_gin(child) for child in children)
+
+
+class _KeyStats(object):
+    __slots__ = ("filters", "conditions", "operators", "value_types", "numeric_filters", "exists_filters")
+
+    def __init__(self):
+        self.filters = 0
+        self.conditions = 0
+        self.operators = Counter()
+        self.value_types = Counter()
+        # filters which can use an index on the key, see IndexAdvisor.add
+        self.numeric_filters = 0
+        self.exists_filters = 0
+
+
+class IndexRecommendation(object):
+    """
+    A ``CREATE INDEX`` statement with the share of the filters (weighted)
+    which can use the index and, for indexes on a key, the statistics of
+    the conditions on that key.
+    """
+    __slots__ = ("kind", "key", "sql", "filters", "share", "conditions", "operators", "value_types")
+
+    def __init__(self, kind, key, sql, filters, share, conditions=0, operators=None, value_types=None):
+        self.kind = kind
+        self.key = key
+        self.sql = sql
+        self.filters = filters
+        self.share = share
+        self.conditions = conditions
+        self.operators = operators or {}
+        self.value_types = value_types or {}
+
+    def as_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def __repr__(self):
+        return "<IndexRecommendation {} {!r} {:.0%}>".format(self.kind, self.key, self.share)
+
+
+class IndexAdvisor(object):
+    """
+    Recommends Postgres indexes for a corpus of Daffodils run against the
+    hstore column ``field`` of ``table``:
+
+    - a GIN index on the column, for filters whose SQL uses ``@>``, ``?``,
+      ``?&`` or ``?|`` (the operators' counts are those of the SQL)
+    - B-tree indexes on ``((field->'key')::numeric)`` for keys compared to
+      numbers. They are partial on the same type check HStoreQueryDelegate
+      emits before casting, so creating them doesn't fail on non numeric
+      values and the planner can prove the delegate's SQL matches them
+    - partial indexes on ``field ? 'key'`` for keys which must be present
+      without a value or range to look up, eg. ``key ?= true``
+
+    Only conditions every match of a filter must satisfy (see
+    ConstraintDelegate) count towards the key indexes, as those inside an
+    "any" group don't let the database skip rows.
+
+        advisor = IndexAdvisor("app_profile", "data")
+        for fltr in stored_filters:
+            advisor.add(fltr.source, weight=fltr.runs_per_day)
+        recommendations = advisor.recommendations()
+        delegate = advisor.delegate(recommendations)
+    """
+    def __init__(self, table, field, pk="id"):
+        self.table = table
+        self.field = field
+        self.pk = pk
+        self.total = 0
+        self.gin_filters = 0
+        self.gin_operators = Counter()
+        self.keys = {}
+        self.sql_delegate = HStoreQueryDelegate(hstore_field_name=field)
+
+    def add(self, daffodil, weight=1):
+        """
+        Adds a Daffodil (or its source) to the corpus, ``weight`` being eg.
+        how often it runs.
+        """
+        if not isinstance(daffodil, Daffodil):
+            daffodil = Daffodil(daffodil, self.sql_delegate)
+
+        self.total += weight
+
+        if _uses_gin(daffodil.parse_result.ast):
+            self.gin_filters += weight
+            sql = SQL_LITERAL_RE.sub("", str(daffodil.lower(self.sql_delegate)))
+            for operator in GIN_OPERATORS_RE.findall(sql):
+                self.gin_operators[operator] += weight
+
+        seen = set()
+        for condition in _conditions(daffodil.parse_result.ast):
+            key = condition.key.content
+            stats = self.keys.get(key)
+            if stats is None:
+                stats = self.keys[key] = _KeyStats()
+            if key not in seen:
+                seen.add(key)
+                stats.filters += weight
+            stats.conditions += weight
+            stats.operators[condition.test.content] += weight
+            stats.value_types[value_type(condition.val.content)] += weight
+
+        constraints = daffodil.lower(ConstraintDelegate())
+        for key, constraint in (constraints or {}).items():
+            stats = self.keys[key]
+            if constraint.has_usable_interval() or (
+                constraint.values is not None and all(_is_number(v) for v in constraint.values)
+            ):
+                stats.numeric_filters += weight
+            elif constraint.values is None and not constraint.has_interval:
+                stats.exists_filters += weight
+
+    def recommendations(self, min_share=0.05):
+        """
+        The indexes usable by at least ``min_share`` of the filters, most
+        used first.
+        """
+        if not self.total:
+            return []
+
+        recommendations = [IndexRecommendation(
+            GIN, None, self.gin_sql(), self.gin_filters, self.gin_filters / self.total,
+            operators=dict(self.gin_operators),
+        )]
+        for key, stats in self.keys.items():
+            for kind, filters, sql in [
+                (NUMERIC, stats.numeric_filters, self.numeric_sql(key)),
+                (EXISTS, stats.exists_filters, self.exists_sql(key)),
+            ]:
+                recommendations.append(IndexRecommendation(
+                    kind, key, sql, filters, filters / self.total,
+                    stats.conditions, dict(stats.operators), dict(stats.value_types),
+                ))
+
+        recommendations = [
+            recommendation for recommendation in recommendations
+            if recommendation.filters and recommendation.share >= min_share
+        ]
+        recommendations.sort(key=lambda r: (-r.filters, KIND_ORDER[r.kind], r.key or ""))
+        return recommendations
+
+    def delegate(self, recommendations, parameterized=False):
+        """
+        An HStoreQueryDelegate writing SQL which targets the recommended
+        indexes.
+        """
+        return HStoreQueryDelegate(
+            hstore_field_name=self.field,
+            parameterized=parameterized,
+            indexed_keys=[r.key for r in recommendations if r.kind == EXISTS],
+        )
+
+    def gin_sql(self):
+        return "CREATE INDEX IF NOT EXISTS {} ON {} USING GIN ({})".format(
+            index_name(self.table, self.field, GIN), self.table, self.field,
+        )
+
+    def numeric_sql(self, key):
+        sql_key = key.replace("'", "''")
+        return "CREATE INDEX IF NOT EXISTS {} ON {} ((({}->'{}')::numeric)) WHERE {}".format(
+            index_name(self.table, self.field, key, NUMERIC), self.table, self.field, sql_key,
+            NUMERIC_TYPE_CHECK[0].format(self.field, sql_key),
+        )
+
+    def exists_sql(self, key):
+        return "CREATE INDEX IF NOT EXISTS {} ON {} ({}) WHERE {} ? '{}'".format(
+            index_name(self.table, self.field, key, EXISTS), self.table, self.pk, self.field,
+            key.replace("'", "''"),
+        )
@@ -0,0 +1,514 @@
+from bisect import bisect_left, bisect_right
+
+from .parser cimport Token, BaseDaffodilDelegate
+from .predicate cimport CMPFunctionHandler, _mk_cmp_handler
+
+
+# Sentinal to indicate a comment in the daffodil
+COMMENT = object()
+
+
+############################################################
+# Bitmaps
+############################################################
+# Row sets are python ints used as bitmaps (bit n set = row n matches), so
+# and/or/not over millions of rows run in C.
+
+cdef object bitmap_from_rows(rows, Py_ssize_t n_rows):
+    cdef bytearray buf = bytearray((n_rows >> 3) + 1)
+    cdef unsigned char[:] view = buf
+    cdef Py_ssize_t row
+
+    for row in rows:
+        view[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(buf, "little")
+
+
+cdef list rows_from_bitmap(object bitmap):
+    cdef bytes buf = bitmap.to_bytes((bitmap.bit_length() >> 3) + 1, "little")
+    cdef const unsigned char[:] view = buf
+    cdef Py_ssize_t i, bit
+    cdef unsigned char byte
+    cdef list rows = []
+
+    for i in range(len(buf)):
+        byte = view[i]
+        if byte:
+            for bit in range(8):
+                if byte & (1 << bit):
+                    rows.append((i << 3) | bit)
+    return rows
+
+
+cdef bint _is_number(object val):
+    return type(val) is int or type(val) is float
+
+
+cdef object _float_or_none(str val):
+    try:
+        number = float(val)
+    except ValueError:
+        return None
+    # NaN never compares true, it's treated like a non-numeric string
+    return None if number != number else number
+
+
+# Ranges spanning up to this many distinct values are answered by or-ing the
+# cached per-value bitmaps, wider ones from the sorted rows
+MAX_RANGE_VALUE_BITMAPS = 64
+
+
+def _select(values, test, bound):
+    """
+    The slice of sorted ``values`` satisfying ``value <test> bound``.
+    """
+    if test == "<":
+        return slice(0, bisect_left(values, bound))
+    if test == "<=":
+        return slice(0, bisect_right(values, bound))
+    if test == ">":
+        return slice(bisect_right(values, bound), None)
+    return slice(bisect_left(values, bound), None)
+
+
+class _SortedValues(object):
+    """
+    The distinct values of a hash map in sorted order, and every row ordered
+    by its value, for range queries.
+    """
+    __slots__ = ("distinct", "values", "rows")
+
+    def __init__(self, by_value):
+        self.distinct = sorted(by_value)
+        self.values = []
+        self.rows = []
+        for value in self.distinct:
+            rows = by_value[value]
+            self.values.extend([value] * len(rows))
+            self.rows.extend(rows)
+
+
+class _KeyIndex(object):
+    """
+    Everything indexed for one key. Rows are split by the type of their
+    value: strings, numbers and bools are indexed, anything else (None,
+    lists, NaN...) is kept aside and scanned.
+    """
+    def __init__(self):
+        self.present = set()
+        self.str_rows = set()
+        self.num_rows = set()
+        self.bool_rows = set()
+        self.other_rows = set()
+
+        self.by_str = {}
+        # bools share this with ints, they hash and compare the same
+        self.by_num = {}
+        # float value of numeric strings, which is what they're compared
+        # as against numbers
+        self.by_str_num = {}
+
+        self._sorted = {}
+        self._bitmaps = {}
+
+    def add(self, row, value):
+        self.present.add(row)
+        value_type = type(value)
+
+        if value_type is str:
+            self.str_rows.add(row)
+            self.by_str.setdefault(value, set()).add(row)
+            number = _float_or_none(value)
+            if number is not None:
+                self.by_str_num.setdefault(number, set()).add(row)
+        elif value_type is bool:
+            self.bool_rows.add(row)
+            self.by_num.setdefault(value, set()).add(row)
+        elif (value_type is int or value_type is float) and value == value:
+            self.num_rows.add(row)
+            self.by_num.setdefault(value, set()).add(row)
+        else:
+            self.other_rows.add(row)
+
+        self._changed()
+
+    def remove(self, row, value):
+        self.present.discard(row)
+        value_type = type(value)
+
+        if value_type is str:
+            self.str_rows.discard(row)
+            self._discard(self.by_str, value, row)
+            number = _float_or_none(value)
+            if number is not None:
+                self._discard(self.by_str_num, number, row)
+        elif value_type is bool:
+            self.bool_rows.discard(row)
+            self._discard(self.by_num, value, row)
+        elif (value_type is int or value_type is float) and value == value:
+            self.num_rows.discard(row)
+            self._discard(self.by_num, value, row)
+        else:
+            self.other_rows.discard(row)
+
+        self._changed()
+
+    def _discard(self, by_value, value, row):
+        rows = by_value[value]
+        rows.discard(row)
+        if not rows:
+            del by_value[value]
+
+    def _changed(self):
+        if self._sorted:
+            self._sorted = {}
+        if self._bitmaps:
+            self._bitmaps = {}
+
+    def bitmap(self, names, n_rows):
+        """
+        Cached bitmap of the union of some row sets, eg. ("present",).
+        """
+        bitmap = self._bitmaps.get(names)
+        if bitmap is None:
+            bitmap = 0
+            for name in names:
+                bitmap |= bitmap_from_rows(getattr(self, name), n_rows)
+            self._bitmaps[names] = bitmap
+        return bitmap
+
+    def sorted_values(self, name):
+        values = self._sorted.get(name)
+        if values is None:
+            values = self._sorted[name] = _SortedValues(getattr(self, name))
+        return values
+
+    def value_bitmap(self, name, value, n_rows):
+        """
+        Cached bitmap of the rows holding ``value`` in one of the hash maps.
+        """
+        key = (name, value)
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            rows = getattr(self, name).get(value)
+            bitmap = self._bitmaps[key] = bitmap_from_rows(rows, n_rows) if rows else 0
+        return bitmap
+
+    def equal_bitmap(self, val, n_rows):
+        """
+        Rows holding a value equal to ``val`` once coerced the way
+        DictionaryPredicateDelegate does.
+        """
+        if type(val) is str:
+            bitmap = self.value_bitmap("by_str", val, n_rows)
+            number = _float_or_none(val)
+            if number is not None:
+                bitmap |= self.value_bitmap("by_num", number, n_rows)
+            return bitmap
+        if type(val) is bool:
+            return self.value_bitmap("by_num", val, n_rows)
+        return self.value_bitmap("by_num", val, n_rows) | self.value_bitmap("by_str_num", val, n_rows)
+
+    def member_bitmap(self, members, n_rows):
+        bitmap = 0
+        if type(members[0]) is str:
+            for member in members:
+                bitmap |= self.value_bitmap("by_str", member, n_rows)
+
+            # numbers only match when every member can be coerced
+            numbers = [_float_or_none(member) for member in members]
+            if None not in numbers:
+                for number in numbers:
+                    bitmap |= self.value_bitmap("by_num", number, n_rows)
+        else:
+            for member in members:
+                bitmap |= self.value_bitmap("by_num", member, n_rows)
+                bitmap |= self.value_bitmap("by_str_num", member, n_rows)
+        return bitmap
+
+    def range_bitmap(self, test, val, n_rows):
+        if type(val) is str:
+            bitmap = self._range_bitmap("by_str", test, val, n_rows)
+            number = _float_or_none(val)
+            if number is not None:
+                bitmap |= self._range_bitmap("by_num", test, number, n_rows)
+            return bitmap
+        if type(val) is bool:
+            return self._range_bitmap("by_num", test, val, n_rows)
+        return self._range_bitmap("by_num", test, val, n_rows) | self._range_bitmap("by_str_num", test, val, n_rows)
+
+    def _range_bitmap(self, name, test, bound, n_rows):
+        sorted_values = self.sorted_values(name)
+        distinct = sorted_values.distinct[_select(sorted_values.distinct, test, bound)]
+
+        if len(distinct) <= MAX_RANGE_VALUE_BITMAPS:
+            bitmap = 0
+            for value in distinct:
+                bitmap |= self.value_bitmap(name, value, n_rows)
+            return bitmap
+        return bitmap_from_rows(
+            sorted_values.rows[_select(sorted_values.values, test, bound)], n_rows
+        )
+
+
+############################################################
+# Dataset
+############################################################
+
+class IndexedDataset(object):
+    """
+    An in-memory list of dicts, indexed so that daffodils evaluate as
+    bitmap algebra instead of a scan.
+
+    Every key gets a posting list of the rows it's present in, hash maps
+    from values to rows, sorted values for range comparisons and a presence
+    bitmap. Conditions which can't be answered from those (comparisons with
+    booleans, values of other types) only scan the rows they apply to.
+    Results are identical to DictionaryPredicateDelegate over the same dicts.
+
+        dataset = IndexedDataset(records)
+        dataset.filter('age >= 18, country in ("US", "CA")')
+    """
+    def __init__(self, records=()):
+        self.rows = {}
+        self.keys = {}
+        self.n_rows = 0
+        self._universe = None
+
+        for record in records:
+            self.insert(record)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, row):
+        return self.rows[row]
+
+    def insert(self, record):
+        """
+        Indexes a dict and returns its row id.
+        """
+        if not isinstance(record, dict):
+            raise TypeError("IndexedDataset rows must be dicts")
+
+        row = self.n_rows
+        self.n_rows += 1
+        self.rows[row] = record
+
+        for key, value in record.items():
+            index = self.keys.get(key)
+            if index is None:
+                index = self.keys[key] = _KeyIndex()
+            index.add(row, value)
+
+        self._universe = None
+        return row
+
+    def delete(self, row):
+        record = self.rows.pop(row)
+        for key, value in record.items():
+            index = self.keys[key]
+            index.remove(row, value)
+            if not index.present:
+                del self.keys[key]
+
+        self._universe = None
+        return record
+
+    def universe(self):
+        """
+        Bitmap of every live row.
+        """
+        if self._universe is None:
+            self._universe = bitmap_from_rows(self.rows, self.n_rows)
+        return self._universe
+
+    def records(self, bitmap):
+        rows = self.rows
+        return [rows[row] for row in rows_from_bitmap(bitmap)]
+
+    def _daffodil(self, daffodil):
+        from .parser import Daffodil
+
+        if not isinstance(daffodil, Daffodil):
+            daffodil = Daffodil(daffodil, IndexedDatasetDelegate())
+        elif not isinstance(daffodil.delegate, IndexedDatasetDelegate):
+            raise TypeError("IndexedDataset needs Daffodils using IndexedDatasetDelegate")
+        return daffodil
+
+    def filter(self, daffodil):
+        """
+        The matching records, in insertion order. Takes daffodil source or a
+        Daffodil using IndexedDatasetDelegate.
+        """
+        return self.records(self._daffodil(daffodil).predicate(self))
+
+    def row_ids(self, daffodil):
+        return rows_from_bitmap(self._daffodil(daffodil).predicate(self))
+
+    def count(self, daffodil):
+        return bin(self._daffodil(daffodil).predicate(self)).count("1")
+
+
+############################################################
+# Delegate
+############################################################
+
+class _GroupNode(object):
+    __slots__ = ("children", "is_all", "negate")
+
+    def __init__(self, children, is_all, negate):
+        self.children = [c for c in children if c is not COMMENT]
+        self.is_all = is_all
+        self.negate = negate
+
+    def __call__(self, dataset):
+        universe = dataset.universe()
+
+        if self.is_all:
+            result = universe
+            for child in self.children:
+                if not result:
+                    break
+                result &= child(dataset)
+        else:
+            result = 0
+            for child in self.children:
+                if result == universe:
+                    break
+                result |= child(dataset)
+
+        if self.negate:
+            return universe & ~result
+        return result
+
+
+class _CmpNode(object):
+    __slots__ = ("key", "test", "val", "handler", "err_ret_val", "plan")
+
+    def __init__(self, key, test, val, CMPFunctionHandler handler):
+        self.key = key
+        self.test = test
+        self.val = val
+        self.handler = handler
+        self.err_ret_val = handler.match({})
+        self.plan = self._plan()
+
+    def __call__(self, dataset):
+        index = dataset.keys.get(self.key)
+        universe = dataset.universe()
+        n_rows = dataset.n_rows
+
+        if index is None:
+            return universe if self.err_ret_val else 0
+
+        present = index.bitmap(("present",), n_rows)
+        if self.test == "?=":
+            return present if self.val else universe & ~present
+
+        plan = self.plan
+        if plan is None:
+            result = self._scan(dataset, index.present)
+        else:
+            indexed, scanned = plan
+            result = self._indexed(index, indexed, n_rows)
+            for name in scanned:
+                result |= self._scan(dataset, getattr(index, name))
+
+        if self.err_ret_val:
+            result |= universe & ~present
+        return result
+
+    def _plan(self):
+        """
+        Which row sets are answered from the index and which are scanned, or
+        None if the whole condition has to be scanned.
+        """
+        test = self.test
+        val = self.val
+
+        if test in ("in", "!in"):
+            if not isinstance(val, list) or not all([_is_number(v) or type(v) in (str, bool) for v in val]):
+                return None
+            values = val
+        elif _is_number(val) or type(val) is str:
+            values = [val]
+        elif type(val) is bool:
+            # data strings are compared to a bool as bool(string) when they
+            # aren't numbers
+            return ("num_rows", "bool_rows"), ("other_rows", "str_rows")
+        else:
+            return None
+
+        # bool data compares to a string as bool(string) when it isn't a
+        # number, the other types simply don't match
+        if type(values[0]) is str and None in [_float_or_none(v) for v in values]:
+            return ("str_rows", "num_rows"), ("other_rows", "bool_rows")
+        return ("str_rows", "num_rows", "bool_rows"), ("other_rows",)
+
+    def _indexed(self, index, indexed, n_rows):
+        """
+        Matching rows among the ``indexed`` row sets.
+        """
+        cdef str test = self.test
+        val = self.val
+
+        if test in ("=", "!="):
+            rows = index.equal_bitmap(val, n_rows)
+        elif test in ("in", "!in"):
+            rows = index.member_bitmap(val, n_rows)
+        else:
+            rows = index.range_bitmap(test, val, n_rows)
+
+        if test in ("!=", "!in"):
+            return index.bitmap(indexed, n_rows) & ~rows
+        return rows & index.bitmap(indexed, n_rows)
+
+    def _scan(self, dataset, rows):
+        cdef CMPFunctionHandler handler = self.handler
+        records = dataset.rows
+        return bitmap_from_rows(
+            [row for row in rows if handler.match(records[row])], dataset.n_rows
+        )
+
+
+cdef class IndexedDatasetDelegate(BaseDaffodilDelegate):
+    """
+    Builds predicates which take an IndexedDataset and return a bitmap of
+    the matching rows. Calling the Daffodil on a dataset returns the
+    matching records.
+    """
+    def mk_any(self, children):
+        return _GroupNode(children, False, False)
+
+    def mk_all(self, children):
+        return _GroupNode(children, True, False)
+
+    def mk_not_any(self, children):
+        return _GroupNode(children, False, True)
+
+    def mk_not_all(self, children):
+        return _GroupNode(children, True, True)
+
+    def mk_comment(self, comment, is_inline):
+        return COMMENT
+
+    def mk_test(self, test_str):
+        return test_str
+
+    cdef mk_cmp(self, Token key, Token test, Token val):
+        return _CmpNode(
+            key.content,
+            self.mk_test(test.content),
+            val.content,
+            _mk_cmp_handler(key.content, test.content, val.content),
+        )
+
+    def call(self, predicate, dataset):
+        return dataset.records(predicate(dataset))
+
+    def optimizable(self):
+        return True
+
+    def cache_key(self):
+        return (type(self),)
@@ -0,0 +1,255 @@
+import json
+from .parser cimport Token, BaseDaffodilDelegate
+from .hstore_predicate import ExpressionStr, POSITIVE, NEGATIVE
+
+
+# jsonpath operators for the daffodil tests compared inside a filter
+# expression, "in" / "!in" become a chain of "=="
+JSONPATH_OPERATORS = {"<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+def sql_string(s):
+    return "'{}'".format(s.replace("'", "''"))
+
+
+def jsonpath_key(key):
+    # always quoted, keys are free text
+    return "$.{}".format(json.dumps(key, ensure_ascii=False))
+
+
+def jsonpath_value(val):
+    return json.dumps(val, ensure_ascii=False)
+
+
+def annotate(sql, key, test, val, family=None, path_filter=None):
+    expr = ExpressionStr(sql)
+    expr.daff_key = key
+    expr.daff_test = test
+    expr.daff_val = val
+    expr.daff_family = family
+    expr.daff_cmp = path_filter
+    return expr
+
+
+def merge_path_filters(delegate, children, is_all):
+    """
+    Merges the jsonpath filters on the same key into a single ``@?``:
+
+        data @? 'strict $."age" ? (@ >= 18)' AND data @? 'strict $."age" ? (@ <= 35)'
+
+    becomes ``data @? 'strict $."age" ? ((@ >= 18) && (@ <= 35))'``. Negated
+    filters merge the other way round (NOT a AND NOT b is NOT (a OR b)).
+    Merged expressions take the place of the first filter on their key.
+    """
+    groups = {}
+    for child_exp in children:
+        if isinstance(child_exp, ExpressionStr) and child_exp.daff_cmp:
+            groups.setdefault((child_exp.daff_key, child_exp.daff_family), []).append(child_exp)
+
+    if all(len(group) == 1 for group in groups.values()):
+        return children
+
+    merged = []
+    for child_exp in children:
+        if not isinstance(child_exp, ExpressionStr) or not child_exp.daff_cmp:
+            merged.append(child_exp)
+            continue
+
+        group = groups.pop((child_exp.daff_key, child_exp.daff_family), None)
+        if group is None:
+            # merged into an earlier expression
+            continue
+        if len(group) == 1:
+            merged.append(child_exp)
+            continue
+
+        joins_with_and = is_all == (child_exp.daff_family == POSITIVE)
+        path_filter = (" && " if joins_with_and else " || ").join(
+            "({})".format(group_exp.daff_cmp) for group_exp in group
+        )
+        merged.append(delegate.path_filter_expr(
+            child_exp.daff_key, child_exp.daff_test, None, path_filter, child_exp.daff_family
+        ))
+
+    return merged
+
+
+def merge_containment(delegate, children, is_all):
+    """
+    Merges equalities on distinct keys into a single ``@>`` containment
+    (a "jsonb_path_ops" GIN index answers it with one lookup): positive
+    ones in an all group, and negated ones in an any group as NOT (a AND b)
+    is NOT a OR NOT b.
+    """
+    family = POSITIVE if is_all else NEGATIVE
+    doc = {}
+    for child_exp in children:
+        if (
+            isinstance(child_exp, ExpressionStr) and child_exp.daff_test in ("=", "!=") and
+            child_exp.daff_family == family and child_exp.daff_key not in doc
+        ):
+            doc[child_exp.daff_key] = child_exp
+
+    if len(doc) < 2:
+        return children
+
+    merged_exp = delegate.containment_expr(
+        {key: child_exp.daff_val for key, child_exp in doc.items()}, family
+    )
+    merged = []
+    for child_exp in children:
+        if isinstance(child_exp, ExpressionStr) and doc.get(child_exp.daff_key) is child_exp:
+            if merged_exp is not None:
+                merged.append(merged_exp)
+                merged_exp = None
+        else:
+            merged.append(child_exp)
+    return merged
+
+
+def merge_existence(delegate, children, is_all):
+    """
+    Merges existence tests into a single ``?&`` / ``?|``: a AND b is
+    ``?&`` and a OR b ``?|``, while NOT a AND NOT b is NOT ``?|`` and
+    NOT a OR NOT b is NOT ``?&``.
+    """
+    for family in (POSITIVE, NEGATIVE):
+        keys = []
+        for child_exp in children:
+            if (
+                isinstance(child_exp, ExpressionStr) and child_exp.daff_test == "?=" and
+                child_exp.daff_family == family and child_exp.daff_key not in keys
+            ):
+                keys.append(child_exp.daff_key)
+
+        if len(keys) < 2:
+            continue
+
+        sql = "{} {} ARRAY[{}]".format(
+            delegate.field,
+            "?&" if is_all == (family == POSITIVE) else "?|",
+            ",".join(sql_string(key) for key in sorted(keys)),
+        )
+        if family == NEGATIVE:
+            sql = "NOT ({})".format(sql)
+
+        merged = []
+        for child_exp in children:
+            if isinstance(child_exp, ExpressionStr) and child_exp.daff_test == "?=" and child_exp.daff_family == family:
+                if sql is not None:
+                    merged.append(sql)
+                    sql = None
+            else:
+                merged.append(child_exp)
+        children = merged
+
+    return children
+
+
+cdef class JSONBQueryDelegate(BaseDaffodilDelegate):
+    """
+    Builds the SQL condition matching a Daffodil on a jsonb column.
+
+    Equalities become ``@>`` containment and the other comparisons
+    ``@?`` jsonpath filters, which a GIN index with the "jsonb_path_ops"
+    operator class can answer for equalities and "in" tests:
+
+        CREATE INDEX ... ON table USING GIN (column jsonb_path_ops)
+
+    Existence tests use ``?``, ``?|`` and ``?&`` which need the default
+    "jsonb_ops" operator class instead.
+
+    Values are compared with their JSON types, natively: unlike with dicts
+    or hstore, a number stored as a string doesn't match a numeric
+    condition and vice versa. Missing keys behave as with dicts, only the
+    negated tests (!=, !in) pass on them.
+    Arrays are compared as a whole, as a list is with dicts, a condition
+    doesn't match their elements.
+    """
+    cdef public str field
+
+    def __cinit__(self, jsonb_field_name):
+        self.field = jsonb_field_name
+
+    def mk_any(self, children):
+        if not children or not any(children):
+            return "false"
+
+        children = [c for c in children if c]
+        children = merge_path_filters(self, children, False)
+        children = merge_containment(self, children, False)
+        children = merge_existence(self, children, False)
+        return " OR ".join(f"({child_exp})" for child_exp in children)
+
+    def mk_all(self, children):
+        if not children or not any(children):
+            return "true"
+
+        children = [c for c in children if c]
+        children = merge_path_filters(self, children, True)
+        children = merge_containment(self, children, True)
+        children = merge_existence(self, children, True)
+        return " AND ".join(f"({child_exp})" for child_exp in children)
+
+    def mk_not_any(self, children):
+        return " NOT ({0})".format(self.mk_any(children))
+
+    def mk_not_all(self, children):
+        return " NOT ({0})".format(self.mk_all(children))
+
+    def mk_comment(self, comment, is_inline):
+        return ""
+
+    cdef mk_cmp(self, Token key, Token test, Token val):
+        return self._mk_cmp(key.content, test.content, val.content)
+
+    def _mk_cmp(self, key, test, val):
+        if test == "?=":
+            sql = "{} ? {}".format(self.field, sql_string(key))
+            if not val:
+                return annotate("NOT ({})".format(sql), key, test, val, NEGATIVE)
+            return annotate(sql, key, test, val, POSITIVE)
+
+        if test in ("=", "!="):
+            expr = self.containment_expr({key: val}, POSITIVE if test == "=" else NEGATIVE)
+            expr.daff_test = test
+            return expr
+
+        if test in ("in", "!in"):
+            values = val if isinstance(val, list) else [val]
+            path_filter = " || ".join("@ == {}".format(jsonpath_value(v)) for v in values)
+        else:
+            path_filter = "@ {} {}".format(JSONPATH_OPERATORS[test], jsonpath_value(val))
+
+        return self.path_filter_expr(key, test, val, path_filter, NEGATIVE if test == "!in" else POSITIVE)
+
+    def containment_expr(self, doc, family):
+        sql = "{} @> {}".format(self.field, sql_string(json.dumps(doc, ensure_ascii=False)))
+        if family == NEGATIVE:
+            sql = "NOT ({})".format(sql)
+        key, val = next(iter(doc.items()))
+        return annotate(sql, key, "=" if family == POSITIVE else "!=", val, family)
+
+    def path_filter_expr(self, key, test, val, path_filter, family):
+        # strict, as @> doesn't look into arrays either. A missing key is an
+        # error in strict mode which makes @? NULL, the ? test rules it out
+        sql = "{0} ? {1} AND {0} @? {2}".format(
+            self.field, sql_string(key), sql_string("strict {} ? ({})".format(jsonpath_key(key), path_filter))
+        )
+        if family == NEGATIVE:
+            sql = "NOT ({})".format(sql)
+        return annotate(sql, key, test, val, family, path_filter)
+
+    def call(self, predicate, queryset):
+        # extra() SQL goes through the DB-API's parameter formatting
+        return queryset.extra(where=[predicate.replace("%", "%%")]) if predicate else queryset
+
+    def optimizable(self):
+        # off until checked against Postgres, see HStoreQueryDelegate
+        return False
+
+    def cache_key(self):
+        return (type(self), self.field)
+
+    def __reduce__(self):
+        return (type(self), (self.field,))
@@ -39,6 +39,9 @@ cdef class KeyExpectationDelegate(BaseDaffodilDelegate):
     def mk_test(self, test_str):
         return test_str
 
+    def cache_key(self):
+        return (type(self),)
+
     def mk_comment(self, comment, is_inline):
         return set(), set()
 
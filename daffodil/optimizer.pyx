@@ -0,0 +1,466 @@
+from .parser cimport Token, Operator, _ArrayToken, Node, Group, Condition, Comment
+from .predicate cimport _condition_value_key
+
+
+# Operators which are false when the key is missing, so they imply "?= true"
+PRESENCE_TESTS = frozenset(("=", "in", "<", "<=", ">", ">="))
+
+LOWER_BOUND_TESTS = frozenset((">", ">="))
+UPPER_BOUND_TESTS = frozenset(("<", "<="))
+
+# Value kinds the folding rules reason about. Numbers compare with the same
+# coerced data value whatever the operator. Strings only fold with strings
+# which agree on being numbers: data of other types coerces a numeric string
+# with float() but anything else with its own type (eg. bool("x")).
+NUMBER = "number"
+NUMERIC_STRING = "numeric string"
+STRING = "string"
+
+
+cdef object _ident(Node node):
+    """
+    Identifies nodes which are equal, to find duplicates.
+    """
+    cdef Group group
+    cdef Condition cmp
+
+    if isinstance(node, Condition):
+        cmp = node
+        return (cmp.key.content, cmp.test.content, _condition_value_key(cmp.val.content))
+
+    group = node
+    return (group.is_all, group.negate, tuple([_ident(child) for child in group.children]))
+
+
+cdef object _constant_value(Node node):
+    """
+    True/False for an empty group, None otherwise.
+    """
+    cdef Group group
+
+    if not isinstance(node, Group):
+        return None
+
+    group = node
+    if group.children:
+        return None
+    return group.is_all != group.negate
+
+
+cdef Node _at(Node node, Node like):
+    # rewritten nodes keep the source position of the node they replace
+    node.start = like.start
+    node.end = like.end
+    return node
+
+
+cdef Group _constant(bint value):
+    return Group(value, False, ())
+
+
+cdef Condition _cmp(Condition like, str test, list vals):
+    """
+    A condition on the same key as ``like`` against the tokens ``vals``,
+    as a scalar comparison when there's a single one.
+    """
+    cdef _ArrayToken array
+
+    if len(vals) == 1:
+        test = {"in": "=", "!in": "!="}.get(test, test)
+        return _at(Condition(like.key, Operator(test), vals[0]), like)
+
+    array = _ArrayToken([val.content for val in vals])
+    array.raw_content = vals
+    return _at(Condition(like.key, Operator(test), array), like)
+
+
+cdef object _kind(Condition cmp):
+    val = cmp.val.content
+    # "in" against a scalar and comparisons against an array are left alone
+    if isinstance(val, list) != (cmp.test.content in ("in", "!in")):
+        return None
+
+    cdef list values = val if isinstance(val, list) else [val]
+
+    if all([type(v) is int or type(v) is float for v in values]):
+        return NUMBER
+
+    if all([type(v) is str for v in values]):
+        parses = [_parses_as_float(v) for v in values]
+        if all(parses):
+            return NUMERIC_STRING
+        if not any(parses):
+            return STRING
+    return None
+
+
+cdef bint _parses_as_float(str val):
+    try:
+        float(val)
+    except ValueError:
+        return False
+    return True
+
+
+cdef list _val_tokens(Token val):
+    if isinstance(val, _ArrayToken):
+        return list((<_ArrayToken>val).raw_content)
+    return [val]
+
+
+cdef list _unique(list tokens):
+    seen = set()
+    unique = []
+    for token in tokens:
+        if token.content not in seen:
+            seen.add(token.content)
+            unique.append(token)
+    return unique
+
+
+def optimize(Group root):
+    """
+    Rewrites a daffodil's AST into an equivalent, usually smaller, one:
+
+    - nested groups of the same kind are flattened
+    - duplicate conditions and groups are removed
+    - ``[a = 1, a = 2]`` folds into ``a in (1, 2)`` (and ``!=`` into ``!in``)
+    - numeric ranges on a key merge into a single interval
+    - contradictions (``{a = 1, a = 2}``) and tautologies (``[a ?= true,
+      a ?= false]``) fold into constants, which then fold into their groups
+    - empty groups are dropped, comments too
+
+    Rewrites are only made when they hold for any value of the key,
+    including it being missing, so predicates built on the result match
+    exactly the same records. Delegates opt in with ``optimizable()``.
+    """
+    optimized = _optimize(root)
+    if not isinstance(optimized, Group):
+        optimized = _at(Group(True, False, (optimized,)), root)
+    elif (<Group>optimized).start == -1:
+        # a filter folded down to a constant
+        _at(optimized, root)
+    return optimized
+
+
+############################################################
+# Rewrites
+############################################################
+
+cdef object _optimize(Node node):
+    if not isinstance(node, Group):
+        return node
+
+    cdef Group group = node
+    cdef list children = []
+    for child in group.children:
+        # comments don't take part in evaluation
+        if isinstance(child, Comment):
+            continue
+        child = _optimize(child)
+        if isinstance(child, Group) and not child.negate and child.is_all == group.is_all:
+            children.extend(child.children)
+        else:
+            children.append(child)
+
+    # a false child decides an all group, a true one an any group, and
+    # the other constant doesn't change anything
+    cdef list kept = []
+    idents = set()
+    for child in children:
+        value = _constant_value(child)
+        if value is None:
+            ident = _ident(child)
+            if ident not in idents:
+                idents.add(ident)
+                kept.append(child)
+        elif value != group.is_all:
+            return _constant(value != group.negate)
+
+    folded = _fold(group.is_all, kept)
+    if folded is True or folded is False:
+        return _constant(folded != group.negate)
+    if not folded:
+        return _constant(group.is_all != group.negate)
+
+    if len(folded) == 1:
+        child = folded[0]
+        if not group.negate:
+            return child
+        if isinstance(child, Group):
+            return _at(Group(child.is_all, not child.negate, child.children), group)
+
+    return _at(Group(group.is_all, group.negate, tuple(folded)), group)
+
+
+cdef object _fold(bint is_all, list children):
+    """
+    Folds the conditions of a group key by key. Each key's folded conditions
+    take the place of its first condition.
+    """
+    by_key = {}
+    for child in children:
+        if isinstance(child, Condition):
+            by_key.setdefault(child.key.content, []).append(child)
+
+    cdef list folded = []
+    for child in children:
+        if not isinstance(child, Condition):
+            folded.append(child)
+            continue
+
+        cmps = by_key.pop(child.key.content, None)
+        if cmps is None:
+            continue
+        if len(cmps) == 1:
+            folded.append(child)
+            continue
+
+        result = _fold_all_key(cmps) if is_all else _fold_any_key(cmps)
+        if result is not True and result is not False:
+            folded.extend(result)
+        elif result != is_all:
+            return result
+
+    return folded
+
+
+cdef object _fold_all_key(list cmps):
+    """
+    Conditions on one key which must all hold: a list of conditions or a
+    constant.
+    """
+    tests = {cmp.test.content for cmp in cmps}
+    idents = {_ident(cmp) for cmp in cmps}
+
+    for cmp in cmps:
+        test, val_key = _ident(cmp)[1:]
+        if (cmp.key.content, {"=": "!=", "in": "!in"}.get(test), val_key) in idents:
+            return False
+
+    requires_key = bool(tests & PRESENCE_TESTS)
+    checks_key = [cmp.val.content for cmp in cmps if cmp.test.content == "?="]
+    if True in checks_key and False in checks_key:
+        return False
+    if requires_key and False in checks_key:
+        return False
+    if requires_key:
+        cmps = [cmp for cmp in cmps if cmp.test.content != "?="]
+
+    numbers = [cmp for cmp in cmps if _kind(cmp) is NUMBER]
+    rest = [cmp for cmp in cmps if _kind(cmp) is not NUMBER]
+
+    numbers = _intersect_numbers(numbers)
+    if numbers is False:
+        return False
+
+    # != on strings which agree on being numbers fold into one !in
+    return _in_place(cmps, numbers, _merge_members(rest, "!=", "!in"))
+
+
+cdef list _in_place(list cmps, list numbers, list rest):
+    """
+    The folded numeric conditions where the first numeric condition was
+    among the others.
+    """
+    cdef Py_ssize_t position = 0
+    for cmp in cmps:
+        if _kind(cmp) is NUMBER:
+            break
+        position += 1
+    position = min(position, len(rest))
+    return rest[:position] + numbers + rest[position:]
+
+
+cdef object _intersect_numbers(list cmps):
+    """
+    Numeric comparisons on one key which must all hold.
+    """
+    cdef list candidates = None
+    cdef list excluded = []
+    cdef list others = []
+    lower = upper = None
+
+    for cmp in cmps:
+        test = cmp.test.content
+        if test in ("=", "in"):
+            vals = _val_tokens(cmp.val)
+            if candidates is None:
+                candidates = vals
+            else:
+                contents = [val.content for val in vals]
+                candidates = [val for val in candidates if val.content in contents]
+        elif test in ("!=", "!in"):
+            excluded.extend(_val_tokens(cmp.val))
+        elif test in LOWER_BOUND_TESTS:
+            if lower is None or _tighter(cmp, lower, 1):
+                lower = cmp
+        elif test in UPPER_BOUND_TESTS:
+            if upper is None or _tighter(cmp, upper, -1):
+                upper = cmp
+        else:
+            others.append(cmp)
+
+    excluded_vals = {val.content for val in excluded}
+    bounds = [cmp for cmp in (lower, upper) if cmp is not None]
+
+    if candidates is not None:
+        candidates = _unique([
+            val for val in candidates
+            if val.content not in excluded_vals and all([_in_bound(val.content, cmp) for cmp in bounds])
+        ])
+        if not candidates:
+            return False
+        return [_cmp(cmps[0], "in", candidates)] + others
+
+    if lower is not None and upper is not None:
+        lo, hi = lower.val.content, upper.val.content
+        if lo > hi or lo == hi and (lower.test.content == ">" or upper.test.content == "<"):
+            return False
+        if lo == hi:
+            if lo in excluded_vals:
+                return False
+            return [_cmp(lower, "=", [lower.val])] + others
+
+    # excluded values outside the interval are excluded already
+    excluded = _unique([
+        val for val in excluded if all([_in_bound(val.content, cmp) for cmp in bounds])
+    ])
+    if excluded:
+        bounds.append(_cmp(cmps[0], "!in", excluded))
+    return bounds + others
+
+
+cdef bint _tighter(Condition cmp, Condition than, int direction):
+    """
+    Whether a bound is tighter than another in the same direction (1 for
+    lower bounds, -1 for upper).
+    """
+    a, b = cmp.val.content, than.val.content
+    if a == b:
+        return cmp.test.content in (">", "<")
+    return (a > b) if direction == 1 else (a < b)
+
+
+cdef bint _in_bound(object val, Condition bound):
+    test = bound.test.content
+    limit = bound.val.content
+    if test == ">":
+        return val > limit
+    if test == ">=":
+        return val >= limit
+    if test == "<":
+        return val < limit
+    return val <= limit
+
+
+cdef object _fold_any_key(list cmps):
+    """
+    Conditions on one key where any may hold: a list of conditions or a
+    constant.
+    """
+    idents = {_ident(cmp) for cmp in cmps}
+
+    for cmp in cmps:
+        test, val_key = _ident(cmp)[1:]
+        if (cmp.key.content, {"=": "!=", "in": "!in"}.get(test), val_key) in idents:
+            return True
+
+    checks_key = [cmp.val.content for cmp in cmps if cmp.test.content == "?="]
+    if True in checks_key and False in checks_key:
+        return True
+    if True in checks_key:
+        # anything false on a missing key can only match when it's present
+        cmps = [cmp for cmp in cmps if cmp.test.content not in PRESENCE_TESTS]
+    if False in checks_key and any([cmp.test.content in ("!=", "!in") for cmp in cmps]):
+        # anything true on a missing key already matches when it's missing
+        cmps = [cmp for cmp in cmps if cmp.test.content != "?="]
+
+    numbers = [cmp for cmp in cmps if _kind(cmp) is NUMBER]
+    rest = [cmp for cmp in cmps if _kind(cmp) is not NUMBER]
+
+    numbers = _unite_numbers(numbers)
+    if numbers is True:
+        return True
+
+    return _in_place(cmps, numbers, _merge_members(rest, "=", "in"))
+
+
+cdef object _unite_numbers(list cmps):
+    """
+    Numeric comparisons on one key where any may hold.
+    """
+    cdef list members = []
+    cdef list excluded = None
+    cdef list others = []
+    lower = upper = None
+
+    for cmp in cmps:
+        test = cmp.test.content
+        if test in ("=", "in"):
+            members.extend(_val_tokens(cmp.val))
+        elif test in ("!=", "!in"):
+            vals = _val_tokens(cmp.val)
+            if excluded is None:
+                excluded = vals
+            else:
+                contents = [val.content for val in vals]
+                excluded = [val for val in excluded if val.content in contents]
+        elif test in LOWER_BOUND_TESTS:
+            if lower is None or _tighter(lower, cmp, 1):
+                lower = cmp
+        elif test in UPPER_BOUND_TESTS:
+            if upper is None or _tighter(upper, cmp, -1):
+                upper = cmp
+        else:
+            others.append(cmp)
+
+    bounds = [cmp for cmp in (lower, upper) if cmp is not None]
+    member_vals = {val.content for val in members}
+
+    if excluded is not None:
+        # a value which isn't excluded by every negative condition always
+        # matches one of them, as does anything missing or not a number
+        excluded = _unique([
+            val for val in excluded
+            if val.content not in member_vals and not any([_in_bound(val.content, cmp) for cmp in bounds])
+        ])
+        if not excluded:
+            return True
+        return [_cmp(cmps[0], "!in", excluded)] + others
+
+    members = _unique([
+        val for val in members if not any([_in_bound(val.content, cmp) for cmp in bounds])
+    ])
+    if members:
+        bounds.append(_cmp(cmps[0], "in", members))
+    return bounds + others
+
+
+cdef list _merge_members(list cmps, str scalar_test, str array_test):
+    """
+    Folds ``scalar_test``/``array_test`` conditions whose values are of the
+    same kind into a single ``array_test``.
+    """
+    by_kind = {}
+    for cmp in cmps:
+        if cmp.test.content in (scalar_test, array_test):
+            kind = _kind(cmp)
+            if kind is not None:
+                by_kind.setdefault(kind, []).append(cmp)
+
+    cdef list merged = []
+    for cmp in cmps:
+        kind = _kind(cmp)
+        group = by_kind.get(kind) if cmp.test.content in (scalar_test, array_test) else None
+        if group is None:
+            merged.append(cmp)
+        elif group[0] is cmp:
+            if len(group) == 1:
+                merged.append(cmp)
+            else:
+                vals = []
+                for grouped in group:
+                    vals.extend(_val_tokens(grouped.val))
+                merged.append(_cmp(cmp, array_test, _unique(vals)))
+    return merged
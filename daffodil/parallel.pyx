@@ -0,0 +1,84 @@
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .predicate import DictionaryPredicateDelegate
+
+
+DEFAULT_CHUNKSIZE = 1000
+
+# chunks in flight per worker, enough to keep every worker busy without
+# reading the whole iterable into memory up front
+PENDING_CHUNKS_PER_WORKER = 2
+
+# The Daffodil evaluated by this worker process, set once per process
+_worker_daffodil = None
+
+
+def _init_worker(daffodil):
+    global _worker_daffodil
+    _worker_daffodil = daffodil
+
+
+def _match_chunk(records):
+    predicate = _worker_daffodil.predicate
+    return [bool(predicate(record)) for record in records]
+
+
+def strip_record(record, keys):
+    """
+    Copy of the record holding only the given keys, so a record only costs
+    as much to pickle as the filter needs.
+    """
+    if record is None:
+        return None
+    return {key: record[key] for key in keys if key in record}
+
+
+def _chunks(iterable, chunksize):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def filter_parallel(daffodil, iterable, workers=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Same result as ``daffodil(iterable)`` for a DictionaryPredicateDelegate
+    but evaluated in chunks across a pool of worker processes.
+
+    The Daffodil is sent to each worker once and rebuilt from its source
+    there. Records are stripped down to ``daffodil.keys`` before being sent,
+    and the matching records are returned unchanged in their input order.
+    """
+    if not isinstance(daffodil.delegate, DictionaryPredicateDelegate):
+        raise TypeError("filter_parallel needs a Daffodil using DictionaryPredicateDelegate")
+    if chunksize < 1:
+        raise ValueError("chunksize must be at least 1")
+
+    workers = workers or os.cpu_count() or 1
+    keys = tuple(daffodil.keys)
+
+    results = []
+    pending = deque()
+
+    def collect():
+        chunk, future = pending.popleft()
+        results.extend(
+            record for record, matched in zip(chunk, future.result()) if matched
+        )
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(daffodil,)) as pool:
+        for chunk in _chunks(iterable, chunksize):
+            stripped = [strip_record(record, keys) for record in chunk]
+            pending.append((chunk, pool.submit(_match_chunk, stripped)))
+            if len(pending) >= workers * PENDING_CHUNKS_PER_WORKER:
+                collect()
+
+        while pending:
+            collect()
+
+    return results
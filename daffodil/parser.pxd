@@ -1,12 +1,15 @@
 cdef class Token:
     cdef public object content
+    cdef public Py_ssize_t start, end
 
 cdef class TimeStamp(Token):
     cdef public str raw_content
     cdef public bint uses_offset
+    cdef public object expires
 
 cdef class GroupStart(Token): pass
 cdef class GroupEnd(Token): pass
+cdef class Key(Token): pass
 cdef class LineComment(Token): pass
 cdef class TrailingComment(Token): pass
 cdef class Operator(Token): pass
@@ -22,20 +25,49 @@ cdef class _ArrayToken(Token):
 cdef class BaseDaffodilDelegate:
     cdef mk_cmp(self, Token key, Token test, Token val)
 
+cdef class Node:
+    cdef readonly Py_ssize_t start, end
+
+cdef class Group(Node):
+    cdef readonly bint is_all, negate
+    cdef readonly tuple children
+
+cdef class Condition(Node):
+    cdef readonly Token key, test, val
+
+cdef class Comment(Node):
+    cdef readonly str text
+    cdef readonly bint is_inline
+
 cdef class DaffodilParser:
     cdef public str src
     cdef public tokens
+    cdef readonly Group ast
+    cdef readonly frozenset keys
+    cdef object _optimized_ast
     cdef int pos, end
 
     cdef str char(self, int offset=*)
     cdef str chars(self, int n, pos=*)
     cdef consume_whitespace(self, bint newlines=*)
     cdef str read_quoted_string(self)
+    cdef _add(self, Token token, Py_ssize_t start)
+
+
+cdef class _TokenCursor:
+    cdef list tokens
+    cdef Py_ssize_t pos, end
 
+    cdef Token next(self)
+    cdef Token peek(self)
 
-cdef object _read_val(tokens)
+cdef object _read_val(_TokenCursor tokens)
+cdef Group _build_ast(_TokenCursor tokens, GroupStart start)
+cdef object _lower(BaseDaffodilDelegate delegate, Node node)
 
 cdef class Daffodil:
     cdef public DaffodilParser parse_result
     cdef public BaseDaffodilDelegate delegate
     cdef public object keys, predicate
+    cdef public bint optimized
+    cdef dict _lowered
@@ -1,6 +1,11 @@
+import re
 import string
+import warnings
 from datetime import datetime, timezone, timedelta
 from .exceptions import ParseError
+from .cache import daffodil_cache
+from .parallel import filter_parallel, DEFAULT_CHUNKSIZE
+from .optimizer import optimize
 from .predicate cimport DictionaryPredicateDelegate
 from .simulation_delegate cimport SimulationMatchingDelegate
 from .key_expectation_delegate cimport KeyExpectationDelegate
@@ -18,6 +23,15 @@ PAIRS = {
     "[": "]",
 }
 
+# runs of characters which are stripped from the source before parsing
+NON_PRINTABLE_RE = re.compile("[^{}]+".format(re.escape(string.printable)))
+
+# characters which end a chunk of a quoted string (the closing quote or an escape)
+QUOTED_STRING_STOP_RE = {
+    '"': re.compile(r'["\\]'),
+    "'": re.compile(r"['\\]"),
+}
+
 # Evaluated in this order - commonly used ones first helps performance, make
 # sure anything that is a prefix of another op comes AFTER the longer version
 OPERATORS = (
@@ -49,15 +63,18 @@ DEF TS_FORMATS = (
 
 cdef class Token:
     """
-    Base class for all tokens
+    Base class for all tokens. ``start`` and ``end`` are the token's offsets
+    in the parser's source, -1 for tokens which didn't come from it.
     """
     def __cinit__(self, content):
         self.content = content
+        self.start = self.end = -1
 
 
 cdef class TimeStamp(Token):
     def __cinit__(self, str content):
         self.uses_offset = False
+        self.expires = None
 
         content = content.strip()
         self.raw_content = content
@@ -90,12 +107,23 @@ cdef class TimeStamp(Token):
 
         self.uses_offset = bool(offset)
 
-        return int({
-            CURRENT_YEAR: today.replace(month=1, day=1) - relativedelta(years=offset),
-            CURRENT_MONTH: today.replace(day=1) - relativedelta(months=offset),
-            CURRENT_WEEK: today - timedelta(days=today.weekday()) - relativedelta(weeks=offset),
-            CURRENT_DAY: today - relativedelta(days=offset),
-        }[time_unit].timestamp())
+        period_start = {
+            CURRENT_YEAR: today.replace(month=1, day=1),
+            CURRENT_MONTH: today.replace(day=1),
+            CURRENT_WEEK: today - timedelta(days=today.weekday()),
+            CURRENT_DAY: today,
+        }[time_unit]
+        period_length = {
+            CURRENT_YEAR: relativedelta(years=1),
+            CURRENT_MONTH: relativedelta(months=1),
+            CURRENT_WEEK: relativedelta(weeks=1),
+            CURRENT_DAY: relativedelta(days=1),
+        }[time_unit]
+
+        # the value changes as soon as the next period starts
+        self.expires = (period_start + period_length).timestamp()
+
+        return int((period_start - period_length * offset).timestamp())
 
 
 cdef class GroupStart(Token):
@@ -166,6 +194,30 @@ cdef class BaseDaffodilDelegate:
     def call(self, predicate, iterable):
         raise NotImplementedError()
 
+    def finalize(self, predicate):
+        """
+        Called once with the root of the tree built by the mk_* methods,
+        returns the Daffodil's predicate.
+        """
+        return predicate
+
+    def optimizable(self):
+        """
+        Whether Daffodils pass the parse tree through the optimizer (see
+        daffodil.optimizer) before building with this delegate. Only safe
+        for delegates evaluating each record on its own, where a key holds
+        a single value or is missing. SQL delegates leave it off, NULL
+        values don't follow those rules.
+        """
+        return False
+
+    def cache_key(self):
+        """
+        Identifies the delegate's type and configuration for the Daffodil
+        cache. Delegates returning None are never cached.
+        """
+        return None
+
 
 cdef class DaffodilParser:
     def __cinit__(self, str src):
@@ -176,6 +228,22 @@ cdef class DaffodilParser:
         self.tokens = []
         self.main()
 
+        cdef _TokenCursor cursor = _TokenCursor(self.tokens)
+        self.ast = _build_ast(cursor, cursor.next())
+        # the root spans the whole daffodil, not the braces wrapping it
+        self.ast.end = self.end - 3
+        self.keys = frozenset([token.content for token in self.tokens if isinstance(token, Key)])
+        self._optimized_ast = None
+
+    def optimized_ast(self):
+        """
+        The AST rewritten by the optimizer (see daffodil.optimizer), built
+        the first time it's needed.
+        """
+        if self._optimized_ast is None:
+            self._optimized_ast = optimize(self.ast)
+        return self._optimized_ast
+
     ############################################################
     # State machine
     ############################################################
@@ -194,21 +262,21 @@ cdef class DaffodilParser:
                 raise ParseError("Expected a comma, newline or end of block at byte {}".format(self.pos))
             elif c == "!" and self.char(+1) in "{[":
                 token_content = self.chars(2)
-                self.tokens.append(GroupStart(token_content))
                 expected_closers.append(PAIRS[token_content[1]])
                 self.pos += 2
+                self._add(GroupStart(token_content), self.pos - 2)
             elif c in '{[':
-                self.tokens.append(GroupStart(c))
                 expected_closers.append(PAIRS[c])
                 self.pos += 1
+                self._add(GroupStart(c), self.pos - 1)
             elif c in '}]':
                 if not expected_closers:
                     raise ParseError("Found an closing brace \"{}\" without a corresponding opening brace.".format(c))
                 if c != expected_closers[-1]:
                     raise ParseError("Expected a {} but found {} instead".format(expected_closers[-1], c))
-                self.tokens.append(GroupEnd(c))
                 expected_closers.pop()
                 self.pos += 1
+                self._add(GroupEnd(c), self.pos - 1)
                 can_accept_another_expression = self.separator()
             elif c == "#":
                 self.comment(LineComment)
@@ -221,20 +289,15 @@ cdef class DaffodilParser:
             self.consume_whitespace()
 
     def comment(self, token_type):
-        cdef str buffer = ""
-        cdef str c
-        while self.pos < self.end:
-            c = self.char()
-            self.pos += 1
-
-            if c == "\n":
-                break
-            else:
-                buffer += c
+        cdef Py_ssize_t start = self.pos
+        cdef Py_ssize_t line_end = self.src.find("\n", self.pos)
+        if line_end == -1:
+            line_end = self.end
 
-        self.tokens.append(
-            token_type(buffer.strip())
-        )
+        cdef str text = self.src[start:line_end].strip()
+        self.pos = start + len(text)
+        self._add(token_type(text), start)
+        self.pos = min(line_end + 1, self.end)
 
     def condition(self):
         cdef str c = self.char()
@@ -263,20 +326,17 @@ cdef class DaffodilParser:
             return self.separator()
 
     def timestamp(self):
-        cdef int pos = self.pos + len("timestamp(")
-
-        cdef str buffer = ""
-        while pos < self.end:
-            c = self.src[pos]
-            pos += 1
-
-            if c == ")":
-                break
+        cdef Py_ssize_t token_start = self.pos
+        cdef Py_ssize_t start = self.pos + len("timestamp(")
+        cdef Py_ssize_t close = self.src.find(")", start)
 
-            buffer += c
+        if close == -1:
+            close = self.end
+            self.pos = self.end
+        else:
+            self.pos = close + 1
 
-        self.pos = pos
-        self.tokens.append(TimeStamp(buffer))
+        self._add(TimeStamp(self.src[start:close]), token_start)
 
     def value(self):
         cdef str c = self.char()
@@ -295,7 +355,7 @@ cdef class DaffodilParser:
     def array(self):
         # skip over the opening "("
         self.pos += 1
-        self.tokens.append(ArrayStart("("))
+        self._add(ArrayStart("("), self.pos - 1)
 
         self.consume_whitespace()
 
@@ -323,7 +383,7 @@ cdef class DaffodilParser:
             c = self.char()
             if c == ")":
                 self.pos += 1
-                self.tokens.append(ArrayEnd(")"))
+                self._add(ArrayEnd(")"), self.pos - 1)
                 break
 
             if can_accept_another_value:
@@ -340,7 +400,8 @@ cdef class DaffodilParser:
             raise ParseError("Expected to find the end of an array (closing parenthesis) but didn't")
 
     def quoted_string(self):
-        self.tokens.append(String(self.read_quoted_string()))
+        cdef Py_ssize_t start = self.pos
+        self._add(String(self.read_quoted_string()), start)
 
     def number(self):
         cdef int num_start = self.pos
@@ -353,43 +414,40 @@ cdef class DaffodilParser:
         buffer = self.src[num_start:self.pos]
 
         if "." not in buffer:
-            self.tokens.append(Number(int(buffer)))
+            self._add(Number(int(buffer)), num_start)
         else:
-            self.tokens.append(Number(float(buffer)))
+            self._add(Number(float(buffer)), num_start)
 
     def boolean(self):
+        cdef Py_ssize_t start = self.pos
         chunk = self.chars(5).lower()
         if chunk.startswith(("true", "false",)):
             val = (chunk != 'false')
             self.pos += (4 if val else 5)
-            self.tokens.append(Boolean(val))
+            self._add(Boolean(val), start)
         else:
             raise ParseError("Expected Boolean value but found {}".format(chunk))
 
     def quoted_key(self):
-        self.tokens.append(
-            Key(self.read_quoted_string())
-        )
+        cdef Py_ssize_t start = self.pos
+        self._add(Key(self.read_quoted_string()), start)
 
     def bare_key(self):
-        buffer = ""
-        while self.pos < self.end:
-            c = self.char()
+        cdef int key_start = self.pos
 
-            if c not in BARE_KEY_CHARS:
+        while self.pos < self.end:
+            if self.src[self.pos] not in BARE_KEY_CHARS:
                 break
-
             self.pos += 1
-            buffer += c
 
-        self.tokens.append(Key(buffer))
+        self._add(Key(self.src[key_start:self.pos]), key_start)
 
     def operator(self):
         chunk = self.chars(MAX_OP_LENGTH)
         for op in OPERATORS:
             if chunk.startswith(op):
-                self.tokens.append(Operator(op))
                 self.pos += len(op)
+                self._add(Operator(op), self.pos - len(op))
                 break
         else:
             raise ParseError("Expected operator at byte {}".format(self.pos))
@@ -418,6 +476,11 @@ cdef class DaffodilParser:
     # Utility functions
     ############################################################
 
+    cdef _add(self, Token token, Py_ssize_t start):
+        token.start = start
+        token.end = self.pos
+        self.tokens.append(token)
+
     cdef str char(self, int offset=0):
         try:
             return self.src[self.pos + offset]
@@ -449,36 +512,69 @@ cdef class DaffodilParser:
         DOES NOT APPEND A TOKEN. That is the responsibility of the caller.
         """
         quote_char = self.char()
+        stop_re = QUOTED_STRING_STOP_RE[quote_char]
 
         # (pos + 1) because we start after the quote character
         self.pos += 1
 
-        cdef str buffer = ""
+        cdef list chunks = []
+        cdef Py_ssize_t stop
         while self.pos < self.end:
-            c = self.src[self.pos]
-            self.pos += 1
+            match = stop_re.search(self.src, self.pos)
+            if match is None:
+                chunks.append(self.src[self.pos:self.end])
+                self.pos = self.end
+                break
 
-            # Escaped quotes and backslashes
-            if c == "\\" and self.src[self.pos] in "\"\'\\":
-                c = self.src[self.pos]
-                self.pos += 1
-            elif c == quote_char:
+            stop = match.start()
+            chunks.append(self.src[self.pos:stop])
+
+            if self.src[stop] == quote_char:
+                self.pos = stop + 1
                 break
 
-            buffer += c
+            # Escaped quotes and backslashes
+            if stop + 1 < self.end and self.src[stop + 1] in "\"\'\\":
+                chunks.append(self.src[stop + 1])
+                self.pos = stop + 2
+            else:
+                chunks.append("\\")
+                self.pos = stop + 1
+
+        return "".join(chunks)
+
+
+cdef class _TokenCursor:
+    """
+    Walks a token list by index. Popping from the front of the list instead
+    would make building a predicate quadratic in the number of tokens.
+    """
+    def __cinit__(self, list tokens):
+        self.tokens = tokens
+        self.pos = 0
+        self.end = len(tokens)
+
+    cdef Token next(self):
+        cdef Token token = self.peek()
+        self.pos += 1
+        return token
 
-        return buffer
+    cdef Token peek(self):
+        if self.pos >= self.end:
+            raise ValueError("Unexpectedly ran out of tokens")
+        return self.tokens[self.pos]
 
 
-cdef object _read_val(tokens):
+cdef object _read_val(_TokenCursor tokens):
     cdef _ArrayToken array_token
-    cdef Token token = tokens.pop(0)
+    cdef Token token = tokens.next()
 
     if isinstance(token, ArrayStart):
         array_token = _ArrayToken([])
+        array_token.start = token.start
         while True:
-            if isinstance(tokens[0], ArrayEnd):
-                tokens.pop(0)
+            if isinstance(tokens.peek(), ArrayEnd):
+                array_token.end = tokens.next().end
                 array_token.raw_content = array_token.content
                 array_token.content = [
                     token.content
@@ -492,70 +588,280 @@ cdef object _read_val(tokens):
         raise ValueError("Expected Array, String, Number, or Boolean Token. Got {}".format(token))
 
 
+############################################################
+# AST
+############################################################
+
+cdef class Node:
+    """
+    Base class of the nodes of a parsed daffodil. Nodes are immutable so a
+    single tree can be shared by every delegate built from it.
+
+    ``start`` and ``end`` are the node's offsets in the daffodil's source
+    (see ``Daffodil.source()``), -1 for nodes made up by the optimizer.
+    """
+    def __cinit__(self, *args):
+        self.start = self.end = -1
+
+
+cdef class Group(Node):
+    def __cinit__(self, bint is_all, bint negate, children):
+        self.is_all = is_all
+        self.negate = negate
+        self.children = tuple(children)
+
+    def __repr__(self):
+        return "Group({}{}, {!r})".format("!" if self.negate else "", "{" if self.is_all else "[", self.children)
+
+
+cdef class Condition(Node):
+    def __cinit__(self, Token key, Token test, Token val):
+        self.key = key
+        self.test = test
+        self.val = val
+
+    def __repr__(self):
+        return "Condition({!r} {} {!r})".format(self.key.content, self.test.content, self.val.content)
+
+
+cdef class Comment(Node):
+    def __cinit__(self, str text, bint is_inline):
+        self.text = text
+        self.is_inline = is_inline
+
+    def __repr__(self):
+        return "Comment({!r})".format(self.text)
+
+
+cdef Node _spanning(Node node, Py_ssize_t start, Py_ssize_t end):
+    # token offsets are in the parser's source, which wraps the daffodil in
+    # "{" ... "\n}", nodes get offsets in the daffodil itself
+    node.start = max(start - 1, 0)
+    node.end = max(end - 1, 0)
+    return node
+
+
+cdef Group _build_ast(_TokenCursor tokens, GroupStart start):
+    cdef Token token
+    cdef list children = []
+
+    while tokens.pos < tokens.end:
+        token = tokens.next()
+        if start.is_end(token):
+            return _spanning(
+                Group(start.content[-1] == "{", start.content[0] == "!", children),
+                start.start, token.end
+            )
+        elif isinstance(token, Key):
+            condition = Condition(token, tokens.next(), _read_val(tokens))
+            children.append(_spanning(condition, token.start, (<Condition>condition).val.end))
+        elif isinstance(token, LineComment):
+            children.append(_spanning(Comment(token.content, False), token.start, token.end))
+        elif isinstance(token, TrailingComment):
+            children.append(_spanning(Comment(token.content, True), token.start, token.end))
+        elif isinstance(token, GroupStart):
+            children.append(_build_ast(tokens, token))
+        else:
+            raise ValueError("Unexpected token: {}".format(token))
+
+    raise ValueError("Unexpectedly ran out of tokens")
+
+
+def _keys(Node node):
+    if isinstance(node, Condition):
+        yield (<Condition>node).key
+    elif isinstance(node, Group):
+        for child in (<Group>node).children:
+            yield from _keys(child)
+
+
+cdef object _lower(BaseDaffodilDelegate delegate, Node node):
+    cdef Group group
+    cdef Condition condition
+    cdef Comment comment
+
+    if isinstance(node, Condition):
+        condition = node
+        return delegate.mk_cmp(condition.key, condition.test, condition.val)
+
+    if isinstance(node, Comment):
+        comment = node
+        return delegate.mk_comment(comment.text, comment.is_inline)
+
+    group = node
+    children = [_lower(delegate, child) for child in group.children]
+    if group.is_all:
+        return delegate.mk_not_all(children) if group.negate else delegate.mk_all(children)
+    return delegate.mk_not_any(children) if group.negate else delegate.mk_any(children)
+
+
 cdef class Daffodil:
-    def __init__(self, source, BaseDaffodilDelegate delegate=DictionaryPredicateDelegate()):
+    def __init__(self, source, BaseDaffodilDelegate delegate=DictionaryPredicateDelegate(), cache=daffodil_cache,
+                 optimize=None):
+        self.delegate = delegate
+        self.optimized = delegate.optimizable() if optimize is None else optimize
+        self._lowered = {}
+
+        if isinstance(source, str):
+            source = self.clean_input_source(source)
+
+        cache_key = None
+        if cache is not None and isinstance(source, str):
+            delegate_key = delegate.cache_key()
+            if delegate_key is not None:
+                cache_key = (source, delegate_key, self.optimized)
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    self.parse_result = cached.parse_result
+                    self.keys = set(cached.keys)
+                    self.predicate = cached.predicate
+                    self._lowered[self._lowered_key(delegate, self.optimized)] = self.predicate
+                    return
+
         if isinstance(source, DaffodilParser):
             self.parse_result = source
         else:
-            self.parse_result = DaffodilParser(
-                self.clean_input_source(source)
-            )
+            self.parse_result = DaffodilParser(source)
 
-        self.keys = set()
-        self.delegate = delegate
-        self.predicate = self.make_predicate(self.parse_result.tokens)
+        # keys stay those of the source even if the optimizer folds
+        # conditions away
+        self.keys = set(self.parse_result.keys)
+        self.predicate = self.lower(delegate, self.optimized)
+
+        if cache_key is not None:
+            cache.put(cache_key, self.parse_result, frozenset(self.keys), self.predicate, self.expires())
+
+    def expires(self):
+        """
+        Unix timestamp after which the predicate is stale because it uses
+        a timestamp(CURRENT_*) function, or None if it never goes stale.
+        """
+        expirations = [
+            token.expires for token in self.parse_result.tokens
+            if isinstance(token, TimeStamp) and token.expires is not None
+        ]
+        return min(expirations) if expirations else None
 
     def clean_input_source(self, source):
-        return ''.join(
-            filter(string.printable.__contains__, source)
-        )
-
-    def _handle_group(self, parent, children):
-        lookup = {
-            "!{": self.delegate.mk_not_all,
-            "![": self.delegate.mk_not_any,
-            "{": self.delegate.mk_all,
-            "[": self.delegate.mk_any,
-        }
-        return lookup[parent.content](children)
+        return NON_PRINTABLE_RE.sub("", source)
+
+    def lower(self, BaseDaffodilDelegate delegate, optimize=None):
+        """
+        Builds this daffodil with any delegate from the already parsed AST,
+        eg. the hstore SQL or the key expectations of a Daffodil used with
+        dicts. Results are memoized per delegate (per ``cache_key()`` when
+        the delegate has one). ``optimize`` defaults to the delegate's
+        ``optimizable()``.
+        """
+        if optimize is None:
+            optimize = delegate.optimizable()
+
+        key = self._lowered_key(delegate, optimize)
+        if key in self._lowered:
+            return self._lowered[key]
+
+        root = self.parse_result.optimized_ast() if optimize else self.parse_result.ast
+        predicate = self._lowered[key] = delegate.finalize(_lower(delegate, root))
+        return predicate
+
+    def _lowered_key(self, BaseDaffodilDelegate delegate, optimize):
+        delegate_key = delegate.cache_key()
+        return (delegate if delegate_key is None else delegate_key, bool(optimize))
 
     def make_predicate(self, tokens, parent=None):
-        cdef Token key_token, test_token
-
-        if parent is None:
-            parent = tokens[0]
-            return self.make_predicate(tokens[1:], parent)
-
-        children = []
-        while tokens:
-            token = tokens.pop(0)
-            if parent.is_end(token):
-                return self._handle_group(parent, children)
-            elif isinstance(token, Key):
-                self.keys.add(token.content)
-                children.append(
-                    self.delegate.mk_cmp(
-                        token,
-                        tokens.pop(0),
-                        _read_val(tokens),
-                    )
-                )
-            elif isinstance(token, LineComment):
-                children.append(
-                    self.delegate.mk_comment(token.content, False)
-                )
-            elif isinstance(token, TrailingComment):
-                children.append(
-                    self.delegate.mk_comment(token.content, True)
-                )
-            elif isinstance(token, GroupStart):
-                children.append(
-                    self.make_predicate(tokens, token)
-                )
-            else:
-                raise ValueError("Unexpected token: {}".format(token))
+        """
+        Builds a predicate from a token list with this daffodil's delegate,
+        adding its keys to ``keys``. ``parent`` is deprecated: it's the
+        GroupStart the tokens follow, which are then consumed up to its end.
+        """
+        cdef _TokenCursor cursor
+        cdef Group root
+
+        if parent is not None:
+            warnings.warn(
+                "make_predicate()'s parent argument is deprecated, pass the tokens starting with the group",
+                DeprecationWarning, stacklevel=2,
+            )
+
+        cursor = _TokenCursor(list(tokens))
+        root = _build_ast(cursor, cursor.next() if parent is None else parent)
+        if parent is not None:
+            del tokens[:cursor.pos]
 
-        raise ValueError("Unexpectedly ran out of tokens")
+        self.keys.update([token.content for token in _keys(root)])
+        return _lower(self.delegate, root)
 
     def __call__(self, *args):
         return self.delegate.call(self.predicate, *args)
+
+    def report(self):
+        """
+        What an instrumented predicate (eg. built with
+        ``DictionaryPredicateDelegate(instrumented=True)``) has recorded so
+        far, per condition and group, mapped onto this daffodil's source.
+        """
+        root = self.parse_result.optimized_ast() if self.optimized else self.parse_result.ast
+        return self.delegate.report(self.predicate, root, self.source())
+
+    # Streaming evaluation, for delegates which support it (see
+    # DictionaryPredicateDelegate.stream and friends)
+    def stream(self, iterable):
+        return self.delegate.stream(self.predicate, iterable)
+
+    def count(self, iterable):
+        return self.delegate.count(self.predicate, iterable)
+
+    def any_match(self, iterable):
+        return self.delegate.any_match(self.predicate, iterable)
+
+    def first(self, iterable, n=1):
+        return self.delegate.first(self.predicate, iterable, n)
+
+    def partition(self, iterable):
+        return self.delegate.partition(self.predicate, iterable)
+
+    def astream(self, iterable, **kwargs):
+        return self.delegate.astream(self.predicate, iterable, **kwargs)
+
+    def acount(self, iterable, **kwargs):
+        return self.delegate.acount(self.predicate, iterable, **kwargs)
+
+    def aany_match(self, iterable, **kwargs):
+        return self.delegate.aany_match(self.predicate, iterable, **kwargs)
+
+    def afirst(self, iterable, n=1, **kwargs):
+        return self.delegate.afirst(self.predicate, iterable, n, **kwargs)
+
+    def apartition(self, iterable, **kwargs):
+        return self.delegate.apartition(self.predicate, iterable, **kwargs)
+
+    def sliced(self, queryset, extra_keys=(), chunk_size=2000):
+        """
+        Iterates over the matching rows of ``queryset`` as ``(pk, data)``,
+        ``data`` only holding this daffodil's keys and ``extra_keys`` (see
+        HStoreQueryDelegate.sliced).
+        """
+        return self.delegate.sliced(self.predicate, queryset, self.keys | set(extra_keys), chunk_size)
+
+    def filter_parallel(self, iterable, workers=None, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Like calling the Daffodil on an iterable of dicts, but evaluated in
+        chunks across ``workers`` processes. Input order is kept.
+        """
+        return filter_parallel(self, iterable, workers, chunksize)
+
+    def __reduce__(self):
+        # predicates are closures or cdef handler trees, which can't be
+        # pickled, so a Daffodil is pickled as its source and rebuilt
+        # (through the cache) when unpickled
+        return (_rebuild_daffodil, (self.source(), self.delegate, self.optimized))
+
+    def source(self):
+        """
+        The cleaned daffodil source this was built from.
+        """
+        return self.parse_result.src[1:-2]
+
+
+def _rebuild_daffodil(source, delegate, optimize):
+    return Daffodil(source, delegate, optimize=optimize)
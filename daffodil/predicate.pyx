@@ -1,4 +1,10 @@
-from .parser cimport Token, BaseDaffodilDelegate
+cimport cython
+
+import asyncio
+import weakref
+from time import perf_counter_ns
+
+from .parser cimport Token, BaseDaffodilDelegate, Node, Group, Condition, Comment
 
 
 cdef bint _in(a, b):
@@ -49,10 +55,16 @@ cdef class CMPFunctionHandler:
     cdef str key
     cdef object val
     cdef bint err_ret_val
+    # coercion failures answered with err_ret_val instead of raising. Only
+    # counted on those (already slow) paths, see InstrumentedFunctionHandler
+    cdef Py_ssize_t swallowed
 
     def __call__(self, object data_point):
         return self._call(data_point)
 
+    cpdef bint match(self, object data_point):
+        return self._call(data_point)
+
     cdef bint _call(self, object data_point):
         cdef object dp_val
         cdef object cmp_val
@@ -73,6 +85,7 @@ cdef class CMPFunctionHandler:
                     else:
                         dp_val = coerce(dp_val, type(cmp_val))
                 except:
+                    self.swallowed += 1
                     return self.err_ret_val
 
         elif isinstance(cmp_val, str) != isinstance(dp_val, str):
@@ -81,11 +94,13 @@ cdef class CMPFunctionHandler:
                     cmp_val = coerce(cmp_val, type(dp_val))
                 else:
                     dp_val = coerce(dp_val, type(cmp_val))
-            except: return self.err_ret_val
+            except:
+                self.swallowed += 1
+                return self.err_ret_val
 
 
         try: return self.test(dp_val, cmp_val)
-        except: pass
+        except: self.swallowed += 1
 
         try: return self.test(type(cmp_val)(data_point[self.key]), cmp_val)
         except: return self.err_ret_val
@@ -102,6 +117,144 @@ cdef class DPCMPFunctionHandler(CMPFunctionHandler):
             return not data_point.__contains__(self.key)
 
 
+# Marks a value which couldn't be coerced in the coercion memos
+_COERCE_FAILED = object()
+
+# Per handler bound on memoized string to number conversions, and the longest
+# string worth memoizing (numbers stored as strings are short)
+MAX_COERCION_MEMO = 1024
+MAX_COERCION_MEMO_STR_LEN = 32
+
+
+cdef class TypedCMPFunctionHandler(CMPFunctionHandler):
+    """
+    Comparison against a str, int, float or bool value, specialized on the
+    type of the data point.
+
+    Strings, ints, floats and bools in the data take a fast path guarded by
+    an exact type check. Data strings compared to a number are converted
+    through a bounded memo, and a string value compared to numbers is
+    converted once per number type. Any other type goes through the generic
+    CMPFunctionHandler path so results are always identical.
+    """
+    cdef object val_type
+    cdef bint val_is_str
+    cdef dict coerced_vals
+    cdef dict coerced_dps
+
+    cdef bint _call(self, object data_point):
+        cdef object dp_val
+        cdef object dp_type
+        cdef object coerced
+
+        if data_point is None:
+            return self.err_ret_val
+
+        try: dp_val = data_point[self.key]
+        except KeyError: return self.err_ret_val
+
+        dp_type = type(dp_val)
+        if dp_type is str:
+            if self.val_is_str:
+                return self.test(dp_val, self.val)
+            coerced = self._coerced_dp(dp_val)
+            if coerced is _COERCE_FAILED:
+                self.swallowed += 1
+                return self.err_ret_val
+            return self.test(coerced, self.val)
+
+        elif dp_type is int or dp_type is float or dp_type is bool:
+            if not self.val_is_str:
+                return self.test(dp_val, self.val)
+            coerced = self._coerced_val(dp_type)
+            if coerced is _COERCE_FAILED:
+                self.swallowed += 1
+                return self.err_ret_val
+            return self.test(dp_val, coerced)
+
+        return CMPFunctionHandler._call(self, data_point)
+
+    cdef object _coerced_val(self, dp_type):
+        try: return self.coerced_vals[dp_type]
+        except KeyError: pass
+
+        try: coerced = coerce(self.val, dp_type)
+        except: coerced = _COERCE_FAILED
+
+        self.coerced_vals[dp_type] = coerced
+        return coerced
+
+    cdef object _coerced_dp(self, str dp_val):
+        try: return self.coerced_dps[dp_val]
+        except KeyError: pass
+
+        try: coerced = coerce(dp_val, self.val_type)
+        except: coerced = _COERCE_FAILED
+
+        if len(dp_val) <= MAX_COERCION_MEMO_STR_LEN:
+            if len(self.coerced_dps) >= MAX_COERCION_MEMO:
+                self.coerced_dps.clear()
+            self.coerced_dps[dp_val] = coerced
+        return coerced
+
+
+cdef class MembershipCMPFunctionHandler(CMPFunctionHandler):
+    """
+    "in" / "!in" against a frozenset of the array's values.
+
+    When the data and the array disagree on being strings the array is
+    coerced to the data's type once, the first time that type is seen,
+    instead of on every data point.
+    """
+    cdef object members
+    cdef dict coerced_members
+    cdef bint val_is_str
+    cdef bint negate
+
+    cdef bint _call(self, object data_point):
+        cdef object dp_val
+        cdef object members = self.members
+
+        if data_point is None:
+            return self.err_ret_val
+
+        try: dp_val = data_point[self.key]
+        except KeyError: return self.err_ret_val
+
+        if self.val_is_str != isinstance(dp_val, str):
+            if self.val_is_str:
+                members = self._coerced_members(type(dp_val))
+                if members is None:
+                    self.swallowed += 1
+                    return self.err_ret_val
+            else:
+                # a string which isn't a number can never be in a non-string array
+                try: dp_val = float(dp_val)
+                except:
+                    self.swallowed += 1
+                    return self.negate
+
+        try: return (dp_val in members) != self.negate
+        except:
+            self.swallowed += 1
+            return self.err_ret_val
+
+    cdef object _coerced_members(self, fallback_type):
+        try: return self.coerced_members[fallback_type]
+        except KeyError: pass
+
+        try:
+            coerced = coerce_list(self.val, fallback_type)
+        except:
+            members = None
+        else:
+            try: members = frozenset(coerced)
+            except TypeError: members = tuple(coerced)
+
+        self.coerced_members[fallback_type] = members
+        return members
+
+
 def _any(data_point, children):
     for child_p in children:
         if child_p is _do_nothing_predicate:
@@ -111,12 +264,278 @@ def _any(data_point, children):
     return False
 
 
-cdef object _mk_any_all(children, any_all):
-    return lambda data_point: any_all(
-        predicate(data_point)
-        for predicate in children
-        if predicate is not _do_nothing_predicate
-    )
+cdef class GroupFunctionHandler(CMPFunctionHandler):
+    """
+    An any/all group, optionally negated. Children are evaluated through
+    their cdef _call so no python calls happen inside a group.
+    """
+    cdef tuple children
+    cdef bint is_all
+    cdef bint negate
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef bint _call(self, object data_point):
+        cdef Py_ssize_t i
+        cdef bint result = self.is_all
+
+        for i in range(len(self.children)):
+            if (<CMPFunctionHandler>self.children[i])._call(data_point) != self.is_all:
+                result = not self.is_all
+                break
+
+        return result != self.negate
+
+
+# Adaptive groups evaluate every child, timed, on one call in
+# ADAPTIVE_SAMPLE_EVERY and reorder their children after every
+# ADAPTIVE_REORDER_EVERY such samples
+ADAPTIVE_SAMPLE_EVERY = 128
+ADAPTIVE_REORDER_EVERY = 16
+
+
+cdef class AdaptiveGroupFunctionHandler(GroupFunctionHandler):
+    """
+    A group which learns a better evaluation order for its children.
+
+    Most calls are plain GroupFunctionHandler calls. Sampled calls evaluate
+    every child in source order, recording how often each one passes and how
+    long it takes, so the statistics aren't skewed by short circuiting.
+    Children are then ordered by expected cost per short circuit: for "all"
+    groups the ones most likely to fail cheaply go first, for "any" groups
+    the ones most likely to pass cheaply. Children never have side effects,
+    so the order doesn't change the result.
+
+    Statistics decay by half at every reorder so the order follows changes
+    in the data. See ``stats()``.
+    """
+    cdef tuple original
+    cdef list order
+    cdef list evaluations
+    cdef list passes
+    cdef list elapsed_ns
+    cdef Py_ssize_t sample_every
+    cdef Py_ssize_t reorder_every
+    cdef Py_ssize_t calls
+    cdef Py_ssize_t samples
+    cdef Py_ssize_t reorders
+
+    cdef bint _call(self, object data_point):
+        self.calls += 1
+        if self.calls % self.sample_every:
+            return GroupFunctionHandler._call(self, data_point)
+        return self._sampled_call(data_point)
+
+    cdef bint _sampled_call(self, object data_point):
+        cdef Py_ssize_t i
+        cdef bint passed
+        cdef bint result = self.is_all
+
+        for i in range(len(self.original)):
+            start = perf_counter_ns()
+            passed = (<CMPFunctionHandler>self.original[i])._call(data_point)
+            self.elapsed_ns[i] += perf_counter_ns() - start
+            self.evaluations[i] += 1
+            if passed:
+                self.passes[i] += 1
+            if passed != self.is_all:
+                result = not self.is_all
+
+        self.samples += 1
+        if self.samples % self.reorder_every == 0:
+            self._reorder()
+
+        return result != self.negate
+
+    cdef _reorder(self):
+        cdef Py_ssize_t i
+        ranked = []
+
+        for i in range(len(self.original)):
+            decisive = self.evaluations[i] - self.passes[i] if self.is_all else self.passes[i]
+            if decisive > 0:
+                ranked.append((self.elapsed_ns[i] / decisive, i))
+            else:
+                ranked.append((float("inf"), i))
+
+            self.evaluations[i] /= 2
+            self.passes[i] /= 2
+            self.elapsed_ns[i] /= 2
+
+        ranked.sort()
+        self.order = [i for _, i in ranked]
+        self.children = tuple([self.original[i] for i in self.order])
+        self.reorders += 1
+
+    def stats(self):
+        """
+        The learned statistics for this group and any adaptive groups below
+        it. Children are listed in source order; ``order`` holds their
+        current evaluation order as indexes into that list.
+        """
+        children = []
+        for i, child in enumerate(self.original):
+            evaluations = self.evaluations[i]
+            children.append({
+                "pass_rate": self.passes[i] / evaluations if evaluations else None,
+                "mean_ns": self.elapsed_ns[i] / evaluations if evaluations else None,
+                "group": child.stats() if isinstance(child, AdaptiveGroupFunctionHandler) else None,
+            })
+
+        return {
+            "is_all": self.is_all,
+            "negate": self.negate,
+            "calls": self.calls,
+            "samples": self.samples,
+            "reorders": self.reorders,
+            "order": list(self.order),
+            "children": children,
+        }
+
+
+cdef class CallableFunctionHandler(CMPFunctionHandler):
+    """
+    Wraps any other callable predicate so it can sit inside a group.
+    """
+    cdef object predicate
+
+    cdef bint _call(self, object data_point):
+        return self.predicate(data_point)
+
+
+cdef class InstrumentedFunctionHandler(CMPFunctionHandler):
+    """
+    Wraps each node of a predicate built with ``instrumented=True``,
+    counting its calls, how many passed, the coercion failures its
+    condition swallowed and the time spent in it, children included.
+    ``children`` holds the wrappers of a group's children in source order,
+    to map the statistics back onto the AST (see
+    ``DictionaryPredicateDelegate.report``).
+    """
+    cdef CMPFunctionHandler handler
+    # the condition whose swallowed count is tracked, None for groups
+    cdef CMPFunctionHandler condition
+    cdef tuple children
+    cdef Py_ssize_t calls
+    cdef Py_ssize_t passes
+    cdef Py_ssize_t errors
+    cdef long long elapsed_ns
+
+    cdef bint _call(self, object data_point):
+        cdef Py_ssize_t swallowed = 0
+        cdef bint passed
+
+        if self.condition is not None:
+            swallowed = self.condition.swallowed
+
+        start = perf_counter_ns()
+        passed = self.handler._call(data_point)
+        self.elapsed_ns += perf_counter_ns() - start
+
+        self.calls += 1
+        if passed:
+            self.passes += 1
+        if self.condition is not None:
+            self.errors += self.condition.swallowed - swallowed
+        return passed
+
+
+cdef InstrumentedFunctionHandler _instrument(CMPFunctionHandler handler, children=None):
+    cdef InstrumentedFunctionHandler instrumented = InstrumentedFunctionHandler.__new__(InstrumentedFunctionHandler)
+    instrumented.handler = handler
+
+    if children is None:
+        # a shared condition is evaluated by the handler it wraps
+        if isinstance(handler, SharedCMPFunctionHandler):
+            handler = (<SharedCMPFunctionHandler>handler).handler
+        instrumented.condition = handler
+        instrumented.children = ()
+    else:
+        instrumented.children = tuple([child for child in children if isinstance(child, InstrumentedFunctionHandler)])
+    return instrumented
+
+
+GROUP_KINDS = {
+    (True, False): "all",
+    (False, False): "any",
+    (True, True): "not all",
+    (False, True): "not any",
+}
+
+
+cdef Py_ssize_t _report(InstrumentedFunctionHandler instrumented, Node node, str source, int depth, list rows):
+    """
+    Appends the rows for ``node`` and its descendants, returning the errors
+    swallowed under it.
+    """
+    cdef Group group
+    cdef Py_ssize_t errors = instrumented.errors
+
+    row = {
+        "node": "condition",
+        "source": None,
+        "start": node.start,
+        "end": node.end,
+        "line": None,
+        "column": None,
+        "depth": depth,
+        "calls": instrumented.calls,
+        "passed": instrumented.passes,
+        "failed": instrumented.calls - instrumented.passes,
+        "errors": errors,
+        "time_ns": instrumented.elapsed_ns,
+    }
+    if node.start >= 0:
+        row["source"] = source[node.start:node.end]
+        row["line"] = source.count("\n", 0, node.start) + 1
+        row["column"] = node.start - source.rfind("\n", 0, node.start)
+    rows.append(row)
+
+    if isinstance(node, Group):
+        group = node
+        row["node"] = GROUP_KINDS[group.is_all, group.negate]
+        # comments were dropped from the predicate
+        children = [child for child in group.children if not isinstance(child, Comment)]
+        for child, child_node in zip(instrumented.children, children):
+            errors += _report(child, child_node, source, depth + 1, rows)
+        row["errors"] = errors
+
+    return errors
+
+
+cdef GroupFunctionHandler _mk_group(children, bint is_all, bint negate, bint adaptive=False):
+    cdef GroupFunctionHandler group
+    cdef AdaptiveGroupFunctionHandler adaptive_group
+    cdef CallableFunctionHandler wrapped
+    cdef list handlers = []
+
+    # comments are dropped here so they cost nothing when evaluating
+    for child in children:
+        if child is _do_nothing_predicate:
+            continue
+        if not isinstance(child, CMPFunctionHandler):
+            wrapped = CallableFunctionHandler.__new__(CallableFunctionHandler)
+            wrapped.predicate = child
+            child = wrapped
+        handlers.append(child)
+
+    if adaptive:
+        adaptive_group = AdaptiveGroupFunctionHandler.__new__(AdaptiveGroupFunctionHandler)
+        adaptive_group.original = tuple(handlers)
+        adaptive_group.order = list(range(len(handlers)))
+        adaptive_group.evaluations = [0.0] * len(handlers)
+        adaptive_group.passes = [0.0] * len(handlers)
+        adaptive_group.elapsed_ns = [0.0] * len(handlers)
+        adaptive_group.sample_every = ADAPTIVE_SAMPLE_EVERY
+        adaptive_group.reorder_every = ADAPTIVE_REORDER_EVERY
+        group = adaptive_group
+    else:
+        group = GroupFunctionHandler.__new__(GroupFunctionHandler)
+
+    group.children = tuple(handlers)
+    group.is_all = is_all
+    group.negate = negate
+    return group
 
 
 # if only one value is a string try to coerce the string
@@ -131,61 +550,408 @@ cdef coerce_list(val, fallback_type):
     return [coerce(v, fallback_type) for v in val]
 
 
+cdef CMPFunctionHandler _mk_cmp_handler(str key, str test_str, object val):
+    cdef CMPFunctionHandler cmp
+    cdef MembershipCMPFunctionHandler in_cmp
+    cdef TypedCMPFunctionHandler typed_cmp
+
+    if test_str == "?=":
+        cmp = DPCMPFunctionHandler.__new__(DPCMPFunctionHandler)
+        cmp.key = key
+        cmp.val = val
+        cmp.err_ret_val = False
+        return cmp
+
+    if test_str in ("in", "!in") and isinstance(val, list):
+        in_cmp = MembershipCMPFunctionHandler.__new__(MembershipCMPFunctionHandler)
+        in_cmp.key = key
+        in_cmp.val = val
+        in_cmp.negate = in_cmp.err_ret_val = (test_str == "!in")
+        in_cmp.test = _not_in if in_cmp.negate else _in
+        in_cmp.members = frozenset(in_cmp.val)
+        in_cmp.coerced_members = {}
+        in_cmp.val_is_str = isinstance(in_cmp.val[0], str)
+        return in_cmp
+
+    if test_str not in ("in", "!in") and type(val) in (str, int, float, bool):
+        typed_cmp = TypedCMPFunctionHandler.__new__(TypedCMPFunctionHandler)
+        typed_cmp.val_type = type(val)
+        typed_cmp.val_is_str = isinstance(val, str)
+        typed_cmp.coerced_vals = {}
+        typed_cmp.coerced_dps = {}
+        cmp = typed_cmp
+    else:
+        cmp = CMPFunctionHandler.__new__(CMPFunctionHandler)
+
+    cmp.key = key
+    cmp.val = val
+    cmp.err_ret_val = False
+
+    if test_str == '=':
+        cmp.test = _eq
+    elif test_str == '!=':
+        cmp.test = _ne
+        cmp.err_ret_val = True
+    elif test_str == '<':
+        cmp.test = _lt
+    elif test_str == '<=':
+        cmp.test = _le
+    elif test_str == '>':
+        cmp.test = _gt
+    elif test_str == '>=':
+        cmp.test = _ge
+    elif test_str == 'in':
+        cmp.test = _in
+    elif test_str == '!in':
+        cmp.test = _not_in
+        cmp.err_ret_val = True
+    else:
+        raise ValueError('"{}" is not a valid operator')
+
+    return cmp
+
+
+############################################################
+# Shared conditions
+############################################################
+
+cdef object _condition_value_key(object val):
+    # 1, 1.0 and True compare equal but build different handlers
+    if isinstance(val, list):
+        return (list, tuple([_condition_value_key(v) for v in val]))
+    return (type(val), val)
+
+
+cdef class SharedCMPFunctionHandler(CMPFunctionHandler):
+    """
+    The one handler for a (key, operator, value) condition in a
+    ConditionPool. While the pool has an evaluation context open for a data
+    point, the condition is evaluated at most once for it.
+    """
+    cdef CMPFunctionHandler handler
+    cdef ConditionPool pool
+    cdef Py_ssize_t generation
+    cdef bint result
+    cdef object __weakref__
+
+    cdef bint _call(self, object data_point):
+        cdef ConditionPool pool = self.pool
+
+        if not pool.active or pool.record is not data_point:
+            return self.handler._call(data_point)
+
+        if self.generation == pool.generation:
+            pool.cache_hits += 1
+            return self.result
+
+        self.result = self.handler._call(data_point)
+        self.generation = pool.generation
+        pool.evaluations += 1
+        return self.result
+
+
+class _PoolContext(object):
+    def __init__(self, pool, data_point):
+        self.pool = pool
+        self.data_point = data_point
+
+    def __enter__(self):
+        self.pool.begin(self.data_point)
+        return self.pool
+
+    def __exit__(self, *exc_info):
+        self.pool.end()
+
+
+cdef class ConditionPool:
+    """
+    Interns identical conditions across every filter built with
+    ``DictionaryPredicateDelegate(pool=...)`` so they share one handler,
+    and caches each condition's result per data point.
+
+        pool = ConditionPool()
+        delegate = DictionaryPredicateDelegate(pool=pool)
+        filters = [Daffodil(src, delegate) for src in sources]
+
+        with pool.context(record):
+            matches = [f for f in filters if f.predicate(record)]
+
+    Outside of a context (or for another data point) conditions are
+    evaluated as usual. A pool isn't safe to evaluate from several threads
+    at once.
+    """
+    cdef object handlers
+    cdef bint active
+    cdef object record
+    cdef Py_ssize_t generation
+    cdef public Py_ssize_t requested
+    cdef public Py_ssize_t created
+    cdef public Py_ssize_t evaluations
+    cdef public Py_ssize_t cache_hits
+
+    def __cinit__(self):
+        self.handlers = weakref.WeakValueDictionary()
+
+    cdef CMPFunctionHandler intern(self, str key, str test_str, object val):
+        cdef SharedCMPFunctionHandler shared
+        ident = (key, test_str, _condition_value_key(val))
+
+        self.requested += 1
+        shared = self.handlers.get(ident)
+        if shared is None:
+            shared = SharedCMPFunctionHandler.__new__(SharedCMPFunctionHandler)
+            shared.handler = _mk_cmp_handler(key, test_str, val)
+            shared.pool = self
+            self.handlers[ident] = shared
+            self.created += 1
+        return shared
+
+    cpdef begin(self, object data_point):
+        self.generation += 1
+        self.record = data_point
+        self.active = True
+
+    cpdef end(self):
+        self.record = None
+        self.active = False
+
+    def context(self, data_point):
+        """
+        Context manager caching condition results for ``data_point``.
+        """
+        return _PoolContext(self, data_point)
+
+    def evaluate(self, data_point, predicates):
+        """
+        Results of each predicate for the data point, evaluating every
+        distinct condition at most once.
+        """
+        self.begin(data_point)
+        try:
+            return [bool(predicate(data_point)) for predicate in predicates]
+        finally:
+            self.end()
+
+    def stats(self):
+        return {
+            "conditions": self.requested,
+            "distinct": self.created,
+            "live": len(self.handlers),
+            "dedup_ratio": self.requested / self.created if self.created else None,
+            "evaluations": self.evaluations,
+            "cache_hits": self.cache_hits,
+        }
+
+    def __reduce__(self):
+        # handlers can't be pickled, the filters sharing a pool rebuild it
+        return (type(self), ())
+
+
+# items the async evaluation methods process between yields to the event loop
+ASYNC_YIELD_EVERY = 1000
+
+
 cdef class DictionaryPredicateDelegate(BaseDaffodilDelegate):
+    """
+    Builds predicates which take a dictionary and return True if it matches.
+
+    With ``adaptive=True`` groups reorder their children at runtime based on
+    sampled pass rates and evaluation times (see
+    ``AdaptiveGroupFunctionHandler``); ``predicate.stats()`` returns what
+    they've learned. Each Daffodil learns on its own: adaptive predicates
+    are never shared through the cache.
+
+    With a ``pool`` identical conditions are shared with every other filter
+    built on the same ConditionPool (see ``ConditionPool``).
+
+    With ``instrumented=True`` every condition and group counts its calls,
+    passes, swallowed coercion failures and time spent (see
+    ``InstrumentedFunctionHandler``), reported against the source by
+    ``Daffodil.report()``. Predicates built without it don't pay for any of
+    this. Instrumented predicates are never shared through the cache.
+    """
+    cdef public bint adaptive
+    cdef public ConditionPool pool
+    cdef public bint instrumented
+
+    def __cinit__(self, adaptive=False, ConditionPool pool=None, instrumented=False):
+        self.adaptive = adaptive
+        self.pool = pool
+        self.instrumented = instrumented
+
+    cdef _group(self, children, bint is_all, bint negate):
+        group = _mk_group(children, is_all, negate, self.adaptive)
+        if self.instrumented:
+            return _instrument(group, children)
+        return group
+
     def mk_any(self, children):
-        return _mk_any_all(children, any)
+        return self._group(children, False, False)
 
     def mk_all(self, children):
-        return _mk_any_all(children, all)
+        return self._group(children, True, False)
 
     def mk_not_any(self, children):
-        return lambda data_point: not self.mk_any(children)(data_point)
+        return self._group(children, False, True)
 
     def mk_not_all(self, children):
-        return lambda data_point: not self.mk_all(children)(data_point)
+        return self._group(children, True, True)
 
     def mk_comment(self, str comment, bint is_inline):
         return _do_nothing_predicate
 
     cdef mk_cmp(self, Token key, Token test, Token val):
-        cdef CMPFunctionHandler cmp
-        cdef str test_str = test.content
-
-        if test_str == "?=":
-            cmp = DPCMPFunctionHandler.__new__(DPCMPFunctionHandler)
-            cmp.key = key.content
-            cmp.val = val.content
-            cmp.err_ret_val = False
-            return cmp
-
-        cmp = CMPFunctionHandler.__new__(CMPFunctionHandler)
-
-        cmp.key = key.content
-        cmp.val = val.content
-        cmp.err_ret_val = False
-
-        if test_str == '=':
-            cmp.test = _eq
-        elif test_str == '!=':
-            cmp.test = _ne
-            cmp.err_ret_val = True
-        elif test_str == '<':
-            cmp.test = _lt
-        elif test_str == '<=':
-            cmp.test = _le
-        elif test_str == '>':
-            cmp.test = _gt
-        elif test_str == '>=':
-            cmp.test = _ge
-        elif test_str == 'in':
-            cmp.test = _in
-        elif test_str == '!in':
-            cmp.test = _not_in
-            cmp.err_ret_val = True
+        if self.pool is not None:
+            cmp = self.pool.intern(key.content, test.content, val.content)
         else:
-            raise ValueError('"{}" is not a valid operator')
+            cmp = _mk_cmp_handler(key.content, test.content, val.content)
 
+        if self.instrumented:
+            return _instrument(cmp)
         return cmp
 
     cpdef call(self, predicate, iterable):
-        return [item for item in iterable if predicate(item)]
\ No newline at end of file
+        return [item for item in iterable if predicate(item)]
+
+    def report(self, predicate, Group root, str source):
+        """
+        The statistics of an instrumented predicate, one dict per condition
+        and group of the AST it was built from (``root``), in source order:
+        the node kind, its text and position in ``source`` (offsets, and
+        1-based line and column), its depth, and its calls, passed and
+        failed counts, swallowed coercion errors and cumulative time in
+        nanoseconds. A group's errors and time include its children's.
+
+        Nodes the optimizer made up have no position, build with
+        ``optimize=False`` to map every statistic onto the source as written.
+        """
+        if not isinstance(predicate, InstrumentedFunctionHandler):
+            raise ValueError("report() needs a predicate built with instrumented=True")
+
+        rows = []
+        _report(predicate, root, source, 0, rows)
+        return rows
+
+    ############################################################
+    # Streaming evaluation
+    ############################################################
+    def stream(self, predicate, iterable):
+        """
+        Generator over the matching items, consuming the iterable lazily.
+        """
+        for item in iterable:
+            if predicate(item):
+                yield item
+
+    def count(self, predicate, iterable):
+        cdef Py_ssize_t matches = 0
+        for item in iterable:
+            if predicate(item):
+                matches += 1
+        return matches
+
+    def any_match(self, predicate, iterable):
+        for item in iterable:
+            if predicate(item):
+                return True
+        return False
+
+    def first(self, predicate, iterable, Py_ssize_t n=1):
+        """
+        Up to the first ``n`` matching items, stopping as soon as they're found.
+        """
+        matches = []
+        if n <= 0:
+            return matches
+
+        for item in iterable:
+            if predicate(item):
+                matches.append(item)
+                if len(matches) >= n:
+                    break
+        return matches
+
+    def partition(self, predicate, iterable):
+        """
+        (matching, not matching) lists from a single pass over the iterable.
+        """
+        matching, not_matching = [], []
+        for item in iterable:
+            if predicate(item):
+                matching.append(item)
+            else:
+                not_matching.append(item)
+        return matching, not_matching
+
+    # The async variants take an async iterable and hand control back to the
+    # event loop every ``yield_every`` items so that filtering a long stream
+    # doesn't starve other tasks.
+    async def astream(self, predicate, iterable, Py_ssize_t yield_every=ASYNC_YIELD_EVERY):
+        cdef Py_ssize_t seen = 0
+        async for item in iterable:
+            seen += 1
+            if seen % yield_every == 0:
+                await asyncio.sleep(0)
+            if predicate(item):
+                yield item
+
+    async def acount(self, predicate, iterable, Py_ssize_t yield_every=ASYNC_YIELD_EVERY):
+        cdef Py_ssize_t seen = 0, matches = 0
+        async for item in iterable:
+            seen += 1
+            if seen % yield_every == 0:
+                await asyncio.sleep(0)
+            if predicate(item):
+                matches += 1
+        return matches
+
+    async def aany_match(self, predicate, iterable, Py_ssize_t yield_every=ASYNC_YIELD_EVERY):
+        cdef Py_ssize_t seen = 0
+        async for item in iterable:
+            if predicate(item):
+                return True
+            seen += 1
+            if seen % yield_every == 0:
+                await asyncio.sleep(0)
+        return False
+
+    async def afirst(self, predicate, iterable, Py_ssize_t n=1, Py_ssize_t yield_every=ASYNC_YIELD_EVERY):
+        cdef Py_ssize_t seen = 0
+        matches = []
+        if n <= 0:
+            return matches
+
+        async for item in iterable:
+            if predicate(item):
+                matches.append(item)
+                if len(matches) >= n:
+                    break
+            seen += 1
+            if seen % yield_every == 0:
+                await asyncio.sleep(0)
+        return matches
+
+    async def apartition(self, predicate, iterable, Py_ssize_t yield_every=ASYNC_YIELD_EVERY):
+        cdef Py_ssize_t seen = 0
+        matching, not_matching = [], []
+        async for item in iterable:
+            seen += 1
+            if seen % yield_every == 0:
+                await asyncio.sleep(0)
+            if predicate(item):
+                matching.append(item)
+            else:
+                not_matching.append(item)
+        return matching, not_matching
+
+    def optimizable(self):
+        return True
+
+    def cache_key(self):
+        # adaptive and instrumented predicates keep state of their own
+        if self.pool is not None or self.instrumented or self.adaptive:
+            return None
+        return (type(self),)
+
+    def __reduce__(self):
+        return (type(self), (self.adaptive, self.pool, self.instrumented))
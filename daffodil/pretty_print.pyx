@@ -208,3 +208,10 @@ cdef class PrettyPrintDelegate(BaseDaffodilDelegate):
 
     def call(self, predicate):
         return str(predicate)
+
+    def cache_key(self):
+        return (type(self), self.dense)
+
+    def __reduce__(self):
+        return (type(self), (self.dense,))
+
@@ -0,0 +1,189 @@
+from collections import Counter
+
+from .parser cimport Node, Group, Condition
+from .parser import Daffodil
+from .hstore_predicate import HStoreQueryDelegate, extract_params
+
+
+CTE_NAME = "daffodil_conditions"
+CONDITION_COLUMN = "daffodil_c{}"
+SEGMENT_COLUMN = "segment_{}"
+
+
+def _hashable(val):
+    return tuple(val) if isinstance(val, list) else val
+
+
+def condition_signature(key, test_str, val):
+    # type(val) keeps eg. 1 and 1.0 or true apart, their SQL differs
+    return (key, test_str, type(val), _hashable(val))
+
+
+def _signatures(Node node):
+    if isinstance(node, Condition):
+        condition = <Condition>node
+        yield condition_signature(condition.key.content, condition.test.content, condition.val.content)
+    elif isinstance(node, Group):
+        for child in (<Group>node).children:
+            yield from _signatures(child)
+
+
+class _HoistingDelegate(HStoreQueryDelegate):
+    """
+    Builds a segment's SQL referring to the CTE's column for the hoisted
+    conditions, keeping the SQL of those in ``conditions``. Column
+    references aren't ExpressionStr, so the optimizers of the groups
+    holding them step aside.
+    """
+    def __init__(self, hstore_field_name, parameterized=False):
+        # signature to column name
+        self.hoisted = {}
+        self.conditions = {}
+
+    def _mk_cmp(self, key, val, test):
+        column = self.hoisted.get(condition_signature(key, test.test_str, val.content))
+        if column is None:
+            return HStoreQueryDelegate._mk_cmp(self, key, val, test)
+
+        if column not in self.conditions:
+            self.conditions[column] = str(HStoreQueryDelegate._mk_cmp(self, key, val, test))
+        return column
+
+    def finalize(self, predicate):
+        # parameters are extracted once for the whole statement
+        return str(predicate)
+
+    def cache_key(self):
+        return None
+
+
+class HStoreSegments(object):
+    """
+    Evaluates many Daffodils ("segments") over an hstore column in a
+    single scan of ``table``, instead of one query per segment.
+
+    ``segments`` maps segment ids to Daffodils or their sources (a list is
+    numbered). Conditions found in ``min_segments`` segments or more are
+    evaluated once per row, in a CTE, and the segments' SQL refers to
+    their result.
+
+    The ``*_sql()`` methods return the statement, or a ``(sql, params)``
+    pair when ``parameterized``. ``counts()`` and ``rows()`` run it with a
+    DB-API cursor.
+
+        segments = HStoreSegments({"teens": "age < 20", ...}, "app_profile", "data")
+        segments.counts(connection.cursor())  # {"teens": 1234, ...}
+    """
+    def __init__(self, segments, table, field, pk="id", parameterized=False, min_segments=2):
+        if not isinstance(segments, dict):
+            segments = dict(enumerate(segments))
+
+        self.table = table
+        self.field = field
+        self.pk = pk
+        self.parameterized = parameterized
+        self.ids = list(segments)
+
+        delegate = HStoreQueryDelegate(hstore_field_name=field, parameterized=parameterized)
+        optimize = delegate.optimizable()
+        daffodils = [
+            daffodil if isinstance(daffodil, Daffodil) else Daffodil(daffodil, delegate)
+            for daffodil in segments.values()
+        ]
+
+        in_segments = Counter()
+        first_seen = {}
+        for daffodil in daffodils:
+            root = daffodil.parse_result.optimized_ast() if optimize else daffodil.parse_result.ast
+            for signature in _signatures(root):
+                first_seen.setdefault(signature, len(first_seen))
+            for signature in set(_signatures(root)):
+                in_segments[signature] += 1
+
+        hoisted = sorted(
+            (signature for signature, n in in_segments.items() if n >= min_segments),
+            key=first_seen.get,
+        )
+        hoisting = _HoistingDelegate(field, parameterized)
+        hoisting.hoisted = {signature: CONDITION_COLUMN.format(i) for i, signature in enumerate(hoisted)}
+        self.segments = [str(daffodil.lower(hoisting, optimize)) for daffodil in daffodils]
+        self.conditions = [
+            (column, hoisting.conditions[column])
+            for column in hoisting.hoisted.values() if column in hoisting.conditions
+        ]
+
+    def _from(self):
+        # the CTE holding the hoisted conditions, when there are some
+        return CTE_NAME if self.conditions else self.table
+
+    def _statement(self, select):
+        sql = select
+        if self.conditions:
+            # OFFSET 0 keeps the CTE from being inlined into the outer
+            # query, where every reference to a column would evaluate its
+            # condition again
+            sql = "WITH {} AS (SELECT {}, {}, {} FROM {} OFFSET 0) {}".format(
+                CTE_NAME, self.pk, self.field,
+                ", ".join("({}) AS {}".format(sql, column) for column, sql in self.conditions),
+                self.table, select,
+            )
+        return extract_params(sql) if self.parameterized else sql
+
+    def counts_sql(self):
+        """
+        One row with the number of rows matching each segment, in columns
+        "segment_0", "segment_1", ... following the order of ``ids``.
+        """
+        counts = ", ".join(
+            "count(*) FILTER (WHERE {}) AS {}".format(sql, SEGMENT_COLUMN.format(i))
+            for i, sql in enumerate(self.segments)
+        )
+        return self._statement("SELECT {} FROM {}".format(counts, self._from()))
+
+    def rows_sql(self, bitmask=False):
+        """
+        The primary key of each row matching any segment and the segments
+        it matches: an array of their positions in ``ids``, or when
+        ``bitmask`` a bit string whose n-th bit is set for the n-th segment.
+        """
+        if bitmask:
+            matches = " || ".join(
+                "CASE WHEN {} THEN B'1' ELSE B'0' END".format(sql) for sql in self.segments
+            )
+            any_match = "position(B'1' IN segments) > 0"
+        else:
+            matches = "array_remove(ARRAY[{}], NULL)".format(", ".join(
+                "CASE WHEN {} THEN {} END".format(sql, i) for i, sql in enumerate(self.segments)
+            ))
+            any_match = "cardinality(segments) > 0"
+
+        return self._statement(
+            "SELECT {0}, segments FROM (SELECT {0}, ({1}) AS segments FROM {2}) AS matches WHERE {3}".format(
+                self.pk, matches, self._from(), any_match
+            )
+        )
+
+    def _execute(self, cursor, statement):
+        if self.parameterized:
+            cursor.execute(*statement)
+        else:
+            cursor.execute(statement)
+
+    def counts(self, cursor):
+        """
+        Maps each segment id to its number of matching rows.
+        """
+        self._execute(cursor, self.counts_sql())
+        return dict(zip(self.ids, cursor.fetchone()))
+
+    def rows(self, cursor, bitmask=False):
+        """
+        Iterates over ``(pk, segment_ids)`` for the rows matching any
+        segment. ``bitmask`` only changes how the matches are transferred.
+        """
+        self._execute(cursor, self.rows_sql(bitmask))
+        for pk, matches in cursor:
+            if bitmask:
+                yield pk, [self.ids[i] for i, bit in enumerate(matches) if bit == "1"]
+            else:
+                yield pk, [self.ids[i] for i in matches]
@@ -52,6 +52,9 @@ cdef class SimulationMatchingDelegate(BaseDaffodilDelegate):
     def mk_test(self, test_str):
         return test_str
 
+    def cache_key(self):
+        return (type(self),)
+
     def mk_all(self, children):
         def pred(poss):
             child_vals = [child(poss) for child in children if child is not COMMENT]
@@ -0,0 +1,226 @@
+import json
+from .parser cimport Token, BaseDaffodilDelegate
+from .hstore_predicate import param_marker, PARAM_MARKER_RE
+
+
+SQL_OPERATORS = {
+    "=": "=", "!=": "=", "<": "<", "<=": "<=", ">": ">", ">=": ">=", "in": "IN", "!in": "IN",
+}
+NEGATED_TESTS = ("!=", "!in")
+
+# SQLite's typeof() of the values compared as numbers, json_type() also
+# tells booleans apart which compare as numbers too (like python's)
+COLUMN_NUMERIC_TYPES = "('integer', 'real')"
+JSON_NUMERIC_TYPES = "('integer', 'real', 'true', 'false')"
+
+# A string which SQLite's numeric affinity turns into a number compares
+# equal to its CAST, and only those are numbers stored as strings
+NUMERIC_TEXT_CHECK = "{0} = CAST({0} AS NUMERIC)"
+
+
+def sql_identifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def json_path(key):
+    if '"' in key:
+        raise ValueError("SQLite's JSON paths can't hold the key {!r}".format(key))
+    return "'$.\"{}\"'".format(key.replace("'", "''"))
+
+
+def qmark_params(sql):
+    """
+    Replaces the parameter markers in ``sql`` by "?" placeholders, returning
+    the SQL and its parameters.
+    """
+    params = []
+    chunks = PARAM_MARKER_RE.split(sql)
+    for i in range(1, len(chunks), 2):
+        params.append(json.loads(chunks[i]))
+        chunks[i] = "?"
+    return "".join(chunks), params
+
+
+def coerced_values(values, fallback=None):
+    """
+    ``values`` (strings) coerced to numbers as predicate.pyx's coerce() does:
+    float() first then ``fallback``, None when one of them can't be. NaN
+    never compares equal, nor less or greater, and is left out.
+    """
+    coerced = []
+    for val in values:
+        try:
+            number = float(val)
+        except ValueError:
+            if fallback is None:
+                return None
+            number = fallback(val)
+        if number == number:
+            coerced.append(number)
+    return coerced
+
+
+def _as_bool(val):
+    return int(bool(val))
+
+
+cdef class SQLiteQueryDelegate(BaseDaffodilDelegate):
+    """
+    Builds a parameterized SQLite ``WHERE`` clause matching a Daffodil,
+    returned as a ``(sql, params)`` pair for the ``sqlite3`` module.
+
+    Keys are the table's columns, or with ``json_column`` keys of the JSON
+    documents in that column (read with the JSON1 functions). In column
+    mode ``columns`` lists the table's columns when given, keys which aren't
+    one of them are missing from every row.
+
+    Comparisons behave as with dicts: strings holding numbers are coerced
+    when compared to numbers (and numbers to numeric strings), a failed
+    coercion fails the comparison and missing keys only pass the negated
+    tests (!=, !in). SQL NULLs are missing values, except that a JSON null
+    is present for ``?=``. Strings are recognized as numbers by SQLite's
+    rules, which unlike python's float() reject eg. "nan", "inf" or "1_000".
+    SQLite has no booleans, columns hold them as 1 and 0.
+
+    Numeric comparisons are ``expr op ?`` so an index on a column, or on
+    ``json_extract(column, '$."key"')`` for a JSON key, serves them. Keys
+    in ``numeric_keys`` skip the extra branch reading numbers stored as
+    strings, which would prevent that. Those are eg. columns with INTEGER,
+    REAL or NUMERIC affinity, which store such strings as numbers.
+
+        delegate = SQLiteQueryDelegate(json_column="data")
+        sql, params = Daffodil("age >= 18", delegate).predicate
+        rows = Daffodil("age >= 18", delegate)(connection, "profiles", ["id", "name"])
+    """
+    cdef public str json_column
+    cdef public frozenset columns
+    cdef public frozenset numeric_keys
+
+    def __cinit__(self, json_column=None, columns=None, numeric_keys=()):
+        self.json_column = json_column
+        self.columns = frozenset(columns) if columns is not None else None
+        self.numeric_keys = frozenset(numeric_keys)
+
+    def mk_any(self, children):
+        if not children or not any(children):
+            return "false"
+
+        children = [c for c in children if c]
+        return " OR ".join(f"({child_exp})" for child_exp in children)
+
+    def mk_all(self, children):
+        if not children or not any(children):
+            return "true"
+
+        children = [c for c in children if c]
+        return " AND ".join(f"({child_exp})" for child_exp in children)
+
+    def mk_not_any(self, children):
+        return " NOT ({0})".format(self.mk_any(children))
+
+    def mk_not_all(self, children):
+        return " NOT ({0})".format(self.mk_all(children))
+
+    def mk_comment(self, comment, is_inline):
+        return ""
+
+    cdef mk_cmp(self, Token key, Token test, Token val):
+        return self._mk_cmp(key.content, test.content, val.content)
+
+    def value_expr(self, key):
+        if self.json_column is not None:
+            return "json_extract({}, {})".format(sql_identifier(self.json_column), json_path(key))
+        if self.columns is not None and key not in self.columns:
+            return "NULL"
+        return sql_identifier(key)
+
+    def type_expr(self, key):
+        # never NULL, the conditions are negated
+        if self.json_column is not None:
+            return "coalesce(json_type({}, {}), '')".format(sql_identifier(self.json_column), json_path(key))
+        return "typeof({})".format(self.value_expr(key))
+
+    def _mk_cmp(self, key, test, val):
+        if test == "?=":
+            if self.json_column is not None:
+                expr = "json_type({}, {})".format(sql_identifier(self.json_column), json_path(key))
+            else:
+                expr = self.value_expr(key)
+            return "{} {}".format(expr, "IS NOT NULL" if val else "IS NULL")
+
+        if test in ("in", "!in"):
+            values = val if isinstance(val, list) else [val]
+        else:
+            values = [val]
+
+        branches = self.branches(key, SQL_OPERATORS[test], values)
+        if not branches:
+            return "true" if test in NEGATED_TESTS else "false"
+
+        sql = branches[0] if len(branches) == 1 else " OR ".join(f"({branch})" for branch in branches)
+        return "NOT ({})".format(sql) if test in NEGATED_TESTS else sql
+
+    def branches(self, key, operator, values):
+        """
+        The comparisons of ``key`` with ``values``, one per type of the
+        data they apply to, each guarded by a check of that type.
+        """
+        value_expr = self.value_expr(key)
+        type_expr = self.type_expr(key)
+        numeric_types = COLUMN_NUMERIC_TYPES if self.json_column is None else JSON_NUMERIC_TYPES
+
+        def compare(expr, vals):
+            if operator == "IN":
+                return "{} IN ({})".format(expr, ", ".join(param_marker(v) for v in vals))
+            return "{} {} {}".format(expr, operator, param_marker(vals[0]))
+
+        branches = []
+        if isinstance(values[0], str):
+            branches.append("{} = 'text' AND {}".format(type_expr, compare(value_expr, values)))
+
+            numbers = coerced_values(values)
+            if numbers:
+                branches.append("{} IN {} AND {}".format(type_expr, numeric_types, compare(value_expr, numbers)))
+            elif numbers is None and self.json_column is not None:
+                # any string coerces to a bool
+                branches.append("{} IN ('true', 'false') AND {}".format(
+                    type_expr, compare(value_expr, coerced_values(values, _as_bool))
+                ))
+            return branches
+
+        branches.append("{} IN {} AND {}".format(type_expr, numeric_types, compare(value_expr, values)))
+        if key in self.numeric_keys:
+            return branches
+
+        text_number = "CAST({} AS REAL)".format(value_expr)
+        text_check = NUMERIC_TEXT_CHECK.format(value_expr)
+        if operator != "IN" and isinstance(values[0], bool):
+            # other strings coerce to a bool
+            text_number = "(CASE WHEN {} THEN {} ELSE {} <> '' END)".format(text_check, text_number, value_expr)
+        else:
+            text_number = "{} AND {}".format(text_check, text_number)
+        branches.append("{} = 'text' AND {}".format(type_expr, compare(text_number, values)))
+        return branches
+
+    def finalize(self, predicate):
+        return qmark_params(str(predicate))
+
+    def call(self, predicate, connection, table, columns=None):
+        """
+        Runs ``SELECT columns FROM table`` for the matching rows with a
+        ``sqlite3`` connection (or cursor), returning the cursor. ``columns``
+        is a list of column names, every column by default. Names are quoted.
+        """
+        sql, params = predicate
+        select = "*" if columns is None else ", ".join(sql_identifier(column) for column in columns)
+        return connection.execute("SELECT {} FROM {} WHERE {}".format(select, sql_identifier(table), sql), params)
+
+    def optimizable(self):
+        # off like the other SQL delegates, see HStoreQueryDelegate
+        return False
+
+    def cache_key(self):
+        return (type(self), self.json_column, self.columns, self.numeric_keys)
+
+    def __reduce__(self):
+        return (type(self), (self.json_column, self.columns, self.numeric_keys))
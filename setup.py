@@ -1,3 +1,4 @@
+import os
 from distutils.core import setup
 from Cython.Build import cythonize
 import Cython.Compiler.Options
@@ -13,8 +14,9 @@ extra_kwargs = {
             'language_level': "3",
 
             # controls extensions which allow cprofile to see cython functions but
-            # has a small performance penalty
-            'profile': False,
+            # has a small performance penalty, build with DAFFODIL_PROFILE=1 to
+            # turn it on
+            'profile': os.environ.get("DAFFODIL_PROFILE") == "1",
         }
     )
 }
@@ -29,6 +31,10 @@ setup(
     url='https://github.com/mediapredict/daffodil',
     packages=['daffodil'],
     install_requires=['cython'],
+    extras_require={
+        # ColumnarPredicateDelegate
+        'columnar': ['numpy'],
+    },
     long_description='A Super-simple DSL for filtering datasets',
     classifiers=[
         'License :: OSI Approved :: MIT License',
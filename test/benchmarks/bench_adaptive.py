@@ -0,0 +1,77 @@
+"""
+Per-record evaluation time with and without adaptive reordering, on a
+filter written in a poor order (expensive, rarely deciding conditions
+first) and on the same filter written in a good order.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_adaptive.py [n_records]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate
+
+
+POOR_ORDER = """
+    [a = 1, b = 2, c = 3, d = 4, e = 5, f = 6]
+    name !in ("x", "y", "z")
+    score > "100"
+    rare = 1
+"""
+
+GOOD_ORDER = """
+    rare = 1
+    score > "100"
+    name !in ("x", "y", "z")
+    [f = 6, e = 5, b = 2, c = 3, d = 4, a = 1]
+"""
+
+
+def make_records(n):
+    rnd = random.Random(42)
+    return [
+        {
+            "a": rnd.randint(0, 9), "b": "2", "c": 3.0, "d": rnd.randint(0, 9), "e": 5, "f": 6,
+            "name": rnd.choice(["p", "q", "x"]),
+            "score": rnd.randint(0, 300),
+            "rare": int(rnd.random() < 0.02),
+        }
+        for _ in range(n)
+    ]
+
+
+def time_per_record(daff, records, repeat=5):
+    predicate = daff.predicate
+    # let adaptive groups settle before timing
+    for record in records[:5000]:
+        predicate(record)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in records:
+            predicate(record)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / len(records)
+
+
+if __name__ == "__main__":
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    records = make_records(n_records)
+
+    print("{:>6}  {:>10}  {:>12}".format("order", "tree us", "adaptive us"))
+    for name, src in (("poor", POOR_ORDER), ("good", GOOD_ORDER)):
+        tree = Daffodil(src, DictionaryPredicateDelegate(), cache=None)
+        adaptive = Daffodil(src, DictionaryPredicateDelegate(adaptive=True), cache=None)
+        assert tree(records) == adaptive(records)
+
+        print("{:>6}  {:>10.3f}  {:>12.3f}".format(
+            name,
+            time_per_record(tree, records) * 1e6,
+            time_per_record(adaptive, records) * 1e6,
+        ))
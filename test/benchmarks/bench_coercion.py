@@ -0,0 +1,71 @@
+"""
+Per-record evaluation time of numeric comparisons over datasets storing
+numbers as ints, floats, numeric strings or a mix of all three.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_coercion.py [n_records]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate
+
+
+SRC = """
+    age >= 18
+    age < 65
+    score > 2.5
+    [
+        income > "50000"
+        state = "NY"
+    ]
+"""
+
+
+def make_records(n, kind):
+    rnd = random.Random(42)
+
+    def number(value):
+        style = kind if kind != "mixed" else rnd.choice(["int", "float", "str"])
+        if style == "int":
+            return int(value)
+        if style == "float":
+            return float(value)
+        return str(value)
+
+    return [
+        {
+            "age": number(rnd.randint(0, 99)),
+            "score": number(rnd.choice([1, 2, 2.5, 3, 3.5, 4, 4.5])),
+            "income": number(rnd.randrange(0, 200000, 1000)),
+            "state": rnd.choice(["NY", "NJ", "CA"]),
+        }
+        for _ in range(n)
+    ]
+
+
+def time_per_record(daff, records, repeat=5):
+    predicate = daff.predicate
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in records:
+            predicate(record)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / len(records)
+
+
+if __name__ == "__main__":
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print("{:>8}  {:>10}".format("data", "tree us"))
+    for kind in ("int", "float", "str", "mixed"):
+        records = make_records(n_records, kind)
+        tree = Daffodil(SRC, DictionaryPredicateDelegate(), cache=None)
+
+        print("{:>8}  {:>10.3f}".format(kind, time_per_record(tree, records) * 1e6))
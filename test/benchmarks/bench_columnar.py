@@ -0,0 +1,95 @@
+"""
+Filtering whole numpy columns with ColumnarPredicateDelegate versus
+DictionaryPredicateDelegate over the equivalent list of dicts.
+
+The row-wise comparison only runs at the sizes listed in ROW_WISE_SIZES,
+building ten million dicts takes longer than the rest of the run.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_columnar.py [n_rows ...]
+"""
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate
+from daffodil.columnar_delegate import ColumnarPredicateDelegate
+
+
+ROW_WISE_SIZES = (1000000,)
+
+FILTERS = {
+    "numeric range": "score >= 400, score < 600",
+    "membership": 'borough in ("K", "Q", "X")',
+    "missing keys": "[rating > 3.5, rating ?= false]",
+    "mixed": """
+        {
+            score > 500
+            borough !in ("M")
+            [rating >= 4, name = "school 7"]
+        }
+    """,
+}
+
+
+def make_columns(n):
+    rnd = np.random.default_rng(42)
+    rating = rnd.uniform(0, 5, n)
+    rating[rnd.random(n) < 0.2] = np.nan
+    return {
+        "score": rnd.integers(200, 800, n),
+        "borough": rnd.choice(np.array(["M", "K", "Q", "X", "R"]), n),
+        "rating": rating,
+        "name": np.char.add("school ", rnd.integers(0, 1000, n).astype(str)),
+    }
+
+
+def columns_to_records(columns):
+    keys = list(columns)
+    records = []
+    for row in zip(*(columns[k].tolist() for k in keys)):
+        records.append({k: v for k, v in zip(keys, row) if v == v})
+    return records
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [1000000, 10000000]
+
+    print("{:>10}  {:>14}  {:>12}  {:>12}  {:>8}".format(
+        "rows", "filter", "columnar s", "row-wise s", "speedup"
+    ))
+    for n in sizes:
+        columns = make_columns(n)
+        records = columns_to_records(columns) if n in ROW_WISE_SIZES else None
+
+        for name, src in FILTERS.items():
+            columnar = Daffodil(src, ColumnarPredicateDelegate(), cache=None)
+            t_columnar, mask = best_of(lambda: columnar(columns))
+
+            if records is None:
+                print("{:>10}  {:>14}  {:>12.3f}  {:>12}  {:>8}".format(
+                    n, name, t_columnar, "-", "-"
+                ))
+                continue
+
+            predicate = Daffodil(src, DictionaryPredicateDelegate(), cache=None).predicate
+            t_rows, expected = best_of(lambda: [bool(predicate(r)) for r in records], repeat=1)
+            assert mask.tolist() == expected
+
+            print("{:>10}  {:>14}  {:>12.3f}  {:>12.3f}  {:>7.1f}x".format(
+                n, name, t_columnar, t_rows, t_rows / t_columnar
+            ))
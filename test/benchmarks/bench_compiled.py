@@ -0,0 +1,250 @@
+"""
+Per-record evaluation time of DictionaryPredicateDelegate's handler tree
+versus the declined compiled mode, on deep filters.
+
+The compiled mode is the prototype of the request for it, kept here so
+the decision can be checked: the filter is lowered to a single generated
+Python function (through ``compile()``) with inlined key lookups,
+short-circuiting and/or, and its constants bound as argument defaults.
+Each comparison gets an inline fast path for when the data point's value
+has the type of the filter's value; missing keys, coercion and data
+points which aren't dicts go through the regular handlers, so results
+are the same.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_compiled.py [n_records]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate
+from daffodil.parser import Group, Condition, Comment
+
+
+# Daffodil operators which map straight onto a python comparison once both
+# sides are known to have compatible types
+PY_OPERATORS = {
+    "=": "==",
+    "!=": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+}
+
+STR_TYPES = frozenset([str])
+NUMBER_TYPES = frozenset([int, float])
+
+_MISSING = object()
+
+
+class _Group(object):
+    __slots__ = ("is_all", "negate", "children")
+
+    def __init__(self, is_all, negate, children):
+        self.is_all = is_all
+        self.negate = negate
+        self.children = children
+
+
+class HandlerCollector(DictionaryPredicateDelegate):
+    """
+    Builds the regular comparison handlers, but keeps groups as plain
+    nodes so that the generated function can be laid over them.
+    """
+    def mk_any(self, children):
+        return _Group(False, False, children)
+
+    def mk_all(self, children):
+        return _Group(True, False, children)
+
+    def mk_not_any(self, children):
+        return _Group(False, True, children)
+
+    def mk_not_all(self, children):
+        return _Group(True, True, children)
+
+    def mk_comment(self, comment, is_inline):
+        return None
+
+    def finalize(self, predicate):
+        return predicate
+
+    def cache_key(self):
+        return None
+
+
+class PredicateSource(object):
+    """
+    Collects the expression of a generated predicate along with the
+    constants it refers to, which get bound as argument defaults.
+    """
+    def __init__(self):
+        self.names = ["_MISSING", "_STR_TYPES", "_NUMBER_TYPES"]
+        self.values = [_MISSING, STR_TYPES, NUMBER_TYPES]
+        self.n_locals = 0
+
+    def bind(self, value):
+        name = "_c{}".format(len(self.names))
+        self.names.append(name)
+        self.values.append(value)
+        return name
+
+    def local(self):
+        self.n_locals += 1
+        return "_v{}".format(self.n_locals)
+
+    def emit(self, node, built):
+        """
+        ``built`` is what HandlerCollector built for the AST node ``node``.
+        """
+        if isinstance(node, Condition):
+            return self.emit_cmp(node, built)
+
+        children = [
+            self.emit(child, built_child)
+            for child, built_child in zip(node.children, built.children)
+            if not isinstance(child, Comment)
+        ]
+        if node.is_all:
+            expr = "({})".format(" and ".join(children)) if children else "True"
+        else:
+            expr = "({})".format(" or ".join(children)) if children else "False"
+
+        if node.negate:
+            return "(not {})".format(expr)
+        return expr
+
+    def emit_cmp(self, cmp, handler):
+        handler = "{}(data_point)".format(self.bind(handler))
+        key = self.bind(cmp.key.content)
+        test = cmp.test.content
+        val = cmp.val.content
+
+        if test == "?=":
+            return "({} {} data_point)".format(key, "in" if val else "not in")
+
+        if test in ("in", "!in"):
+            if not isinstance(val, list) or not val:
+                return handler
+            types = fast_path_types(val[0])
+            expr = "{{}} {} {}".format("not in" if test == "!in" else "in", self.bind(frozenset(val)))
+        else:
+            types = fast_path_types(val)
+            expr = "{{}} {} {}".format(PY_OPERATORS[test], self.bind(val))
+
+        if types is None:
+            return handler
+
+        dp_val = self.local()
+        return "({} if ({} := _get({}, _MISSING)).__class__ in {} else {})".format(
+            expr.format(dp_val), dp_val, key, types, handler
+        )
+
+
+def fast_path_types(val):
+    if type(val) is str:
+        return "_STR_TYPES"
+    if type(val) in NUMBER_TYPES:
+        return "_NUMBER_TYPES"
+    return None
+
+
+def compile_predicate(src):
+    tree = Daffodil(src, cache=None, optimize=False)
+    built = tree.lower(HandlerCollector(), optimize=False)
+
+    source = PredicateSource()
+    expr = source.emit(tree.parse_result.ast, built)
+    fallback = source.bind(tree.predicate)
+
+    py_src = (
+        "def daffodil_predicate(data_point, {}):\n"
+        "    if data_point.__class__ is not dict:\n"
+        "        return {}(data_point)\n"
+        "    _get = data_point.get\n"
+        "    return {}\n"
+    ).format(", ".join("{0}={0}".format(name) for name in source.names), fallback, expr)
+
+    namespace = dict(zip(source.names, source.values))
+    exec(compile(py_src, "<daffodil>", "exec"), namespace)
+    return namespace["daffodil_predicate"]
+
+
+def make_filter(depth):
+    """
+    Alternating all/any groups, each holding three comparisons and one
+    nested group. Comparisons in "all" groups nearly always pass and those
+    in "any" groups nearly always fail, so evaluation reaches the innermost
+    group instead of short circuiting near the top.
+    """
+    if depth == 0:
+        return 'k0 = "v0"'
+
+    if depth % 2:
+        opener, closer = "[", "]"
+        conditions = [
+            'k{} = "never"'.format(depth),
+            'n{} < 0'.format(depth),
+            'm{} in (-1, -2, -3)'.format(depth),
+        ]
+    else:
+        opener, closer = "{", "}"
+        conditions = [
+            'k{} != "never"'.format(depth),
+            'n{} >= 0'.format(depth),
+            'm{} in (0, 1, 2, 3, 4, 5)'.format(depth),
+        ]
+
+    conditions.append(make_filter(depth - 1))
+    return "{}\n{}\n{}".format(opener, "\n".join(conditions), closer)
+
+
+def make_records(n, depth):
+    rnd = random.Random(42)
+    records = []
+    for _ in range(n):
+        record = {}
+        for d in range(depth + 1):
+            record["k{}".format(d)] = "v{}".format(rnd.randint(0, 2))
+            record["n{}".format(d)] = rnd.randint(0, 100)
+            record["m{}".format(d)] = rnd.randint(0, 5)
+        records.append(record)
+    return records
+
+
+def time_per_record(predicate, records, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in records:
+            predicate(record)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / len(records)
+
+
+if __name__ == "__main__":
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    print("{:>6}  {:>12}  {:>12}  {:>8}".format("depth", "tree us", "compiled us", "speedup"))
+    for depth in (2, 5, 10, 20):
+        src = make_filter(depth)
+        records = make_records(n_records, depth)
+
+        tree = Daffodil(src, DictionaryPredicateDelegate(), cache=None, optimize=False).predicate
+        compiled = compile_predicate(src)
+
+        assert [tree(r) for r in records] == [compiled(r) for r in records]
+        assert [tree(r) for r in [None, {}, {"k0": 1}]] == [compiled(r) for r in [None, {}, {"k0": 1}]]
+
+        t_tree = time_per_record(tree, records)
+        t_compiled = time_per_record(compiled, records)
+
+        print("{:>6}  {:>12.3f}  {:>12.3f}  {:>7.1f}x".format(
+            depth, t_tree * 1e6, t_compiled * 1e6, t_tree / t_compiled
+        ))
@@ -0,0 +1,97 @@
+"""
+Matching one record against many audience-segment filters with
+DaffodilSet versus evaluating every Daffodil in turn.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_daffodil_set.py [n_filters ...]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DaffodilSet
+
+
+COUNTRIES = ["c{}".format(i) for i in range(50)]
+INTERESTS = ["i{}".format(i) for i in range(200)]
+DEVICES = ["ios", "android", "web"]
+
+
+def make_filter(rnd):
+    shape = rnd.random()
+    if shape < 0.4:
+        lo = rnd.randint(18, 60)
+        return 'country = "{}", age >= {}, age < {}, device = "{}"'.format(
+            rnd.choice(COUNTRIES), lo, lo + rnd.randint(5, 20), rnd.choice(DEVICES)
+        )
+    if shape < 0.7:
+        return 'interest in ({}), income > "{}"'.format(
+            ", ".join('"{}"'.format(i) for i in rnd.sample(INTERESTS, 3)),
+            rnd.randrange(20000, 200000, 1000),
+        )
+    if shape < 0.9:
+        lo = rnd.randrange(0, 200000, 1000)
+        return "income >= {}, income <= {}, [premium ?= true, visits > {}]".format(
+            lo, lo + rnd.randrange(1000, 20000, 1000), rnd.randint(0, 50)
+        )
+    return '[country = "{}", country = "{}"], device != "web"'.format(
+        rnd.choice(COUNTRIES), rnd.choice(COUNTRIES)
+    )
+
+
+def make_record(rnd):
+    record = {
+        "country": rnd.choice(COUNTRIES),
+        "age": rnd.randint(13, 80),
+        "device": rnd.choice(DEVICES),
+        "interest": rnd.choice(INTERESTS),
+        "income": str(rnd.randrange(0, 250000, 500)),
+        "visits": rnd.randint(0, 100),
+    }
+    if rnd.random() < 0.2:
+        record["premium"] = True
+    for i in range(20):
+        record["extra{}".format(i)] = rnd.randint(0, 1000)
+    return record
+
+
+def per_record(func, records):
+    start = time.perf_counter()
+    results = [func(record) for record in records]
+    return (time.perf_counter() - start) / len(records), results
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000, 100000]
+    rnd = random.Random(42)
+    records = [make_record(rnd) for _ in range(1000)]
+
+    print("{:>8}  {:>10}  {:>14}  {:>16}  {:>8}".format(
+        "filters", "build s", "set us/record", "each us/record", "speedup"
+    ))
+    for n in sizes:
+        sources = {i: make_filter(rnd) for i in range(n)}
+
+        start = time.perf_counter()
+        daffodil_set = DaffodilSet(sources)
+        build = time.perf_counter() - start
+
+        daffodils = [(i, Daffodil(src).predicate) for i, src in sources.items()]
+
+        def match_each(record):
+            return {i for i, predicate in daffodils if predicate(record)}
+
+        t_set, matched = per_record(daffodil_set.match, records)
+
+        # evaluating every filter is slow at large sizes, a sample is enough
+        sample = records[:max(10, 100000 // n)]
+        t_each, expected = per_record(match_each, sample)
+        assert matched[:len(sample)] == expected
+
+        print("{:>8}  {:>10.2f}  {:>14.1f}  {:>16.1f}  {:>7.1f}x".format(
+            n, build, t_set * 1e6, t_each * 1e6, t_each / t_set
+        ))
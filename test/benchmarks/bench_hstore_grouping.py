@@ -0,0 +1,108 @@
+"""
+EXPLAIN ANALYZE execution times of the SQL built by HStoreQueryDelegate
+with and without group_by_key (a single existence test and type check
+regex per key, ranges fused into BETWEEN), on a generated hstore table.
+
+Needs a PostgreSQL database with the hstore extension available, and
+psycopg (or psycopg2). The table is (re)created when it doesn't hold
+``n_rows`` rows.
+
+Run from the repository root:
+
+    DAFFODIL_BENCH_DSN="dbname=... user=..." python test/benchmarks/bench_hstore_grouping.py [n_rows]
+
+No measurements back the grouping yet, which is why group_by_key is off
+by default: it was written without a PostgreSQL server at hand, and only
+the shape of its SQL is tested. Before turning it on by default, this
+should show a gain on a 1M-row table, and plans (index use, row
+estimates) shouldn't get worse. bench_hstore_postgres.py compares the
+full plans, its "group_by_key" setting being the grouped SQL:
+
+    DAFFODIL_BENCH_DB=daffodil_bench python test/benchmarks/bench_hstore_postgres.py --output report.json
+"""
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+try:
+    import psycopg
+except ImportError:
+    import psycopg2 as psycopg
+
+from daffodil import Daffodil, HStoreQueryDelegate
+
+
+DSN = os.environ.get(
+    "DAFFODIL_BENCH_DSN", "dbname=daffodil_hstore_test user=postgres password=postgres host=127.0.0.1"
+)
+TABLE = "daffodil_bench_hstore"
+
+FILTERS = {
+    "range": "age >= 18, age <= 35",
+    "ranges": "age >= 18, age <= 35, income > 1000, income < 50000",
+    "any": "[age < 16, age > 70, visits > 95]",
+    "mixed": 'age >= 21, age <= 65, country != "c1", country !in ("c2", "c3"), visits > 10',
+}
+
+# about 1 in 20 values is not numeric, so the type check has work to do
+POPULATE = """
+    INSERT INTO {table} (data)
+    SELECT hstore(
+        ARRAY['age', 'income', 'visits', 'country'],
+        ARRAY[
+            CASE WHEN random() < 0.05 THEN 'unknown' ELSE (13 + floor(random() * 68))::text END,
+            (floor(random() * 200) * 500)::text,
+            (floor(random() * 101))::text,
+            'c' || floor(random() * 50)::text
+        ]
+    )
+    FROM generate_series(1, %s)
+"""
+
+
+def prepare(cursor, n_rows):
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS hstore")
+    cursor.execute("CREATE TABLE IF NOT EXISTS {} (id serial PRIMARY KEY, data hstore)".format(TABLE))
+    cursor.execute("SELECT count(*) FROM {}".format(TABLE))
+    if cursor.fetchone()[0] != n_rows:
+        cursor.execute("TRUNCATE {}".format(TABLE))
+        cursor.execute(POPULATE.format(table=TABLE), (n_rows,))
+        cursor.execute("ANALYZE {}".format(TABLE))
+
+
+def build_sql(src, grouped):
+    return Daffodil(src, HStoreQueryDelegate(hstore_field_name="data", group_by_key=grouped)).predicate
+
+
+def explain_analyze(cursor, sql, repeat=3):
+    """
+    Returns the best execution time in ms and the number of rows matched.
+    """
+    timings = []
+    for _ in range(repeat):
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) SELECT id FROM {} WHERE {}".format(TABLE, sql))
+        plan = cursor.fetchone()[0][0]
+        timings.append(plan["Execution Time"])
+    return min(timings), plan["Plan"]["Actual Rows"]
+
+
+if __name__ == "__main__":
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    with psycopg.connect(DSN) as connection:
+        with connection.cursor() as cursor:
+            prepare(cursor, n_rows)
+            connection.commit()
+            # a sequential scan, so both plans evaluate every condition
+            cursor.execute("SET max_parallel_workers_per_gather = 0")
+
+            print("{:<10}  {:>10}  {:>10}  {:>8}  {:>8}".format("filter", "before ms", "after ms", "speedup", "rows"))
+            for name, src in FILTERS.items():
+                t_before, rows_before = explain_analyze(cursor, build_sql(src, grouped=False))
+                t_after, rows_after = explain_analyze(cursor, build_sql(src, grouped=True))
+                assert rows_before == rows_after, (name, rows_before, rows_after)
+
+                print("{:<10}  {:>10.1f}  {:>10.1f}  {:>7.2f}x  {:>8}".format(
+                    name, t_before, t_after, t_before / t_after, rows_after
+                ))
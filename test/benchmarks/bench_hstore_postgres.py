@@ -0,0 +1,446 @@
+"""
+EXPLAIN (ANALYZE, BUFFERS) of the SQL HStoreQueryDelegate builds for a
+fixed catalog of filters, under each setting of its SQL optimizers, on a
+generated table of the testapp's BasicHStoreData, writing JSON reports
+which can be compared between runs (and commits).
+
+The optimizers are switched off through the functions deciding whether
+they apply (``breaks_existence_optimizer`` and
+``should_optimize_any_existence`` for ``optimize_existence``,
+``breaks_equality_optimizer`` for ``optimize_equality_and``), and
+grouping conditions by key and the Daffodil optimizer (see
+daffodil.optimizer), which are off by default, are switched on through
+HStoreQueryDelegate's ``group_by_key`` and ``Daffodil(optimize=True)``,
+see SETTINGS. Settings giving the same SQL as an earlier one share its
+measurements.
+
+Each measurement records the execution and planning times (best and
+median of ``--repeat`` runs, after a warm up run), the planner's row
+estimate against the actual rows, the shared buffers hit and read, and
+the indexes and plan nodes used. Every setting must match the same rows.
+
+The generated rows are skewed like real profiles: a few keys in every
+row, a long tail of "tag_*" keys following a Zipf law, categorical
+values with Zipf frequencies, heavy tailed numbers and a few non numeric
+values where numbers are expected. They're loaded through the Django
+model when the table doesn't hold the same ``--rows`` and ``--seed``
+yet, the indexes of ``--indexes`` being rebuilt on every run:
+
+- none: only the primary key
+- gin: a GIN index on the hstore column
+- advisor: the indexes IndexAdvisor recommends for the catalog
+
+Needs a PostgreSQL database (created beforehand, eg. ``createdb
+daffodil_bench``: the table is truncated, so not the tests' database)
+with the hstore extension available, psycopg (or psycopg2) and Django.
+``--print-sql`` only prints the SQL of each filter and setting, without
+a database.
+
+Run from the repository root:
+
+    DAFFODIL_BENCH_DB=daffodil_bench python test/benchmarks/bench_hstore_postgres.py \\
+        [--rows 1000000] [--output report.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, HStoreQueryDelegate, IndexAdvisor
+from daffodil import hstore_predicate
+
+
+FIELD = "hsdata"
+
+# timestamps of the "signup" key, 2020-09-13 onwards
+SIGNUP_START = 1600000000
+SIGNUP_SPAN = 3 * 365 * 24 * 3600
+
+N_COUNTRIES = 60
+N_REFERRERS = 500
+N_TAGS = 200
+PLANS = {"free": 80, "basic": 15, "pro": 4, "enterprise": 1}
+DEVICES = {"ios": 45, "android": 35, "web": 20}
+
+CATALOG = {
+    "any_existence": "[beta ?= true, referrer ?= true, tag_150 ?= true]",
+    "all_existence": "tag_0 ?= true, tag_5 ?= true, referrer ?= true",
+    "equality_and": 'plan = "pro", device = "ios", country = "c0"',
+    "equality_and_range": 'plan = "basic", country = "c1", age >= 30, age <= 40',
+    "existence_and_range": "tag_0 ?= true, tag_3 ?= true, visits > 5",
+    "any_equalities": '[country = "c1", country = "c2", device = "web"]',
+    "wide_in": "country in ({})".format(", ".join('"c{}"'.format(i) for i in range(10, 40))),
+    "negated": 'plan != "free", country !in ("c0", "c1")',
+    "missing_key": "referrer ?= false, income > 50000",
+    "rare_range": "income >= 100000, age < 25",
+    # a month
+    "signup_range": "signup >= {}, signup < {}".format(
+        SIGNUP_START + SIGNUP_SPAN // 2, SIGNUP_START + SIGNUP_SPAN // 2 + 30 * 24 * 3600
+    ),
+    "nested": """
+        {
+            [plan = "pro", plan = "enterprise"]
+            [tag_1 ?= true, tag_2 ?= true]
+            !{device = "ios", age > 60}
+        }
+    """,
+}
+
+
+def _always(*args, **kwargs):
+    return True
+
+
+def _never(*args, **kwargs):
+    return False
+
+
+NO_EXISTENCE = {"breaks_existence_optimizer": _always, "should_optimize_any_existence": _never}
+NO_EQUALITY = {"breaks_equality_optimizer": _always}
+
+# hstore_predicate attributes patched, HStoreQueryDelegate options and
+# whether the Daffodil optimizer runs for each setting, the first one being
+# the SQL as shipped
+SETTINGS = {
+    "default": ({}, {}, False),
+    "group_by_key": ({}, {"group_by_key": True}, False),
+    "daffodil_optimizer": ({}, {}, True),
+    "no_existence": (NO_EXISTENCE, {}, False),
+    "no_equality": (NO_EQUALITY, {}, False),
+    "none": ({**NO_EXISTENCE, **NO_EQUALITY}, {}, False),
+}
+
+# set for every measurement, so that plans don't depend on the server's load
+SESSION_SETTINGS = {
+    "max_parallel_workers_per_gather": "0",
+    "jit": "off",
+}
+
+
+@contextlib.contextmanager
+def optimizer_setting(patches):
+    saved = {name: getattr(hstore_predicate, name) for name in patches}
+    for name, value in patches.items():
+        setattr(hstore_predicate, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(hstore_predicate, name, value)
+
+
+def build_sql(src, setting):
+    patches, options, optimize = SETTINGS[setting]
+    delegate = HStoreQueryDelegate(hstore_field_name=FIELD, **options)
+    # not cached, the cache doesn't know about the patches
+    with optimizer_setting(patches):
+        return Daffodil(src, delegate, cache=None, optimize=optimize).predicate
+
+
+def zipf_weights(n, s):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def make_records(seed, n_rows):
+    rnd = random.Random(seed)
+    countries = ["c{}".format(i) for i in range(N_COUNTRIES)]
+    country_weights = zipf_weights(N_COUNTRIES, 1.1)
+    referrers = ["site{}.example".format(i) for i in range(N_REFERRERS)]
+    referrer_weights = zipf_weights(N_REFERRERS, 1.0)
+    tags = ["tag_{}".format(i) for i in range(N_TAGS)]
+    tag_weights = zipf_weights(N_TAGS, 1.1)
+
+    for _ in range(n_rows):
+        record = {
+            "plan": rnd.choices(list(PLANS), list(PLANS.values()))[0],
+            "signup": str(SIGNUP_START + rnd.randrange(SIGNUP_SPAN)),
+        }
+        if rnd.random() < 0.99:
+            record["country"] = rnd.choices(countries, country_weights)[0]
+        if rnd.random() < 0.95:
+            record["age"] = "unknown" if rnd.random() < 0.02 else str(int(rnd.triangular(13, 90, 30)))
+        if rnd.random() < 0.9:
+            record["visits"] = str(min(int(rnd.paretovariate(1.5)) - 1, 10000))
+        if rnd.random() < 0.7:
+            record["device"] = rnd.choices(list(DEVICES), list(DEVICES.values()))[0]
+        if rnd.random() < 0.4:
+            record["income"] = str(int(rnd.lognormvariate(10, 1)))
+        if rnd.random() < 0.05:
+            record["referrer"] = rnd.choices(referrers, referrer_weights)[0]
+        if rnd.random() < 0.005:
+            record["beta"] = "true"
+        for tag in rnd.choices(tags, tag_weights, k=min(int(rnd.expovariate(0.5)), N_TAGS)):
+            record[tag] = "1"
+        yield record
+
+
+def setup_django():
+    from django.conf import settings
+    import django
+
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.postgresql",
+                "NAME": os.environ.get("DAFFODIL_BENCH_DB", "daffodil_bench"),
+                "USER": os.environ.get("DAFFODIL_BENCH_USER", "postgres"),
+                "PASSWORD": os.environ.get("DAFFODIL_BENCH_PASSWORD", "postgres"),
+                "HOST": os.environ.get("DAFFODIL_BENCH_HOST", "127.0.0.1"),
+                "PORT": int(os.environ.get("DAFFODIL_BENCH_PORT", 5432)),
+            }
+        },
+        INSTALLED_APPS=["django.contrib.postgres", "testapp"],
+    )
+    django.setup()
+
+    from django.core import management
+    management.call_command("migrate", verbosity=0)
+
+
+def dataset_fingerprint(n_rows, seed):
+    return "daffodil bench rows={} seed={}".format(n_rows, seed)
+
+
+def load(cursor, table, n_rows, seed, batch_size=10000):
+    from django.db import transaction
+    from testapp.models import BasicHStoreData
+
+    fingerprint = dataset_fingerprint(n_rows, seed)
+    cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')", [table])
+    if cursor.fetchone()[0] == fingerprint:
+        return False
+
+    cursor.execute("TRUNCATE {} RESTART IDENTITY".format(table))
+    batch = []
+    with transaction.atomic():
+        for record in make_records(seed, n_rows):
+            batch.append(BasicHStoreData(hsdata=record))
+            if len(batch) == batch_size:
+                BasicHStoreData.objects.bulk_create(batch)
+                batch = []
+        BasicHStoreData.objects.bulk_create(batch)
+        cursor.execute("COMMENT ON TABLE {} IS %s".format(table), [fingerprint])
+    return True
+
+
+def index_statements(table, kind):
+    if kind == "none":
+        return []
+    advisor = IndexAdvisor(table, FIELD)
+    if kind == "gin":
+        return [advisor.gin_sql()]
+    for src in CATALOG.values():
+        advisor.add(src)
+    return [recommendation.sql for recommendation in advisor.recommendations(min_share=0)]
+
+
+def build_indexes(cursor, table, kind):
+    cursor.execute(
+        "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname NOT IN ("
+        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+        [table, table],
+    )
+    for name, in cursor.fetchall():
+        cursor.execute('DROP INDEX "{}"'.format(name))
+
+    statements = index_statements(table, kind)
+    for sql in statements:
+        cursor.execute(sql)
+    cursor.execute("VACUUM ANALYZE {}".format(table))
+    return statements
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def explain(cursor, table, sql):
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT id FROM {} WHERE {}".format(table, sql))
+    result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]
+
+
+def measure(cursor, table, sql, repeat):
+    explain(cursor, table, sql)
+    runs = [explain(cursor, table, sql) for _ in range(repeat)]
+    execution = [run["Execution Time"] for run in runs]
+    planning = [run["Planning Time"] for run in runs]
+
+    plan = runs[-1]["Plan"]
+    nodes = list(plan_nodes(plan))
+    return {
+        "execution_ms": {"best": min(execution), "median": statistics.median(execution)},
+        "planning_ms": {"best": min(planning), "median": statistics.median(planning)},
+        "estimated_rows": plan["Plan Rows"],
+        "actual_rows": plan["Actual Rows"],
+        # 0 when exact, log(10) when ten times off either way
+        "estimate_error": abs(math.log((plan["Plan Rows"] + 1) / (plan["Actual Rows"] + 1))),
+        "shared_hit_blocks": plan.get("Shared Hit Blocks", 0),
+        "shared_read_blocks": plan.get("Shared Read Blocks", 0),
+        "indexes": sorted({node["Index Name"] for node in nodes if "Index Name" in node}),
+        "node_types": sorted({node["Node Type"] for node in nodes}),
+    }
+
+
+def run_catalog(cursor, table, repeat):
+    results = []
+    for name, src in CATALOG.items():
+        # SQL digest to the first setting giving it and its measurements
+        measured = {}
+        for setting in SETTINGS:
+            sql = build_sql(src, setting)
+            digest = hashlib.sha1(sql.encode("utf-8")).hexdigest()
+            if digest in measured:
+                same_as, metrics = measured[digest]
+            else:
+                same_as, metrics = None, measure(cursor, table, sql, repeat)
+                measured[digest] = (setting, metrics)
+            results.append({
+                "filter": name,
+                "setting": setting,
+                "sql": sql,
+                "sql_sha1": digest,
+                "same_sql_as": same_as,
+                "metrics": metrics,
+            })
+
+        rows = {r["metrics"]["actual_rows"] for r in results if r["filter"] == name}
+        assert len(rows) == 1, (name, rows)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(report):
+    """
+    Prints the median execution time of each filter under each setting,
+    and the rows matched and indexes used with the first setting.
+    """
+    settings = list(SETTINGS)
+    by_key = {(r["filter"], r["setting"]): r["metrics"] for r in report["results"]}
+    print("{:<20}  {}  {:>8}  {}".format(
+        "filter", "  ".join("{:>12}".format(s) for s in settings), "rows", "indexes"
+    ))
+    for name in CATALOG:
+        baseline = by_key[name, settings[0]]
+        print("{:<20}  {}  {:>8}  {}".format(
+            name,
+            "  ".join(
+                "{:>12}".format("{:.1f}ms".format(by_key[name, s]["execution_ms"]["median"])) for s in settings
+            ),
+            baseline["actual_rows"],
+            ",".join(baseline["indexes"]) or "-",
+        ))
+
+
+def compare(report, baseline):
+    """
+    Prints each measurement's median execution time as a ratio to the
+    baseline report's, > 1 being slower, and the plans which changed.
+    """
+    previous = {(r["filter"], r["setting"]): r for r in baseline["results"]}
+    print("compared to {} ({} rows)".format(baseline["meta"].get("commit"), baseline["meta"].get("rows")))
+    for result in report["results"]:
+        before = previous.get((result["filter"], result["setting"]))
+        if before is None:
+            continue
+        now, then = result["metrics"], before["metrics"]
+        changes = []
+        if result["sql_sha1"] != before["sql_sha1"]:
+            changes.append("sql")
+        if now["indexes"] != then["indexes"]:
+            changes.append("indexes {} -> {}".format(then["indexes"], now["indexes"]))
+        if now["estimated_rows"] != then["estimated_rows"]:
+            changes.append("estimate {} -> {}".format(then["estimated_rows"], now["estimated_rows"]))
+        print("{:<20}  {:<12}  {:.2f}  {}".format(
+            result["filter"], result["setting"],
+            now["execution_ms"]["median"] / then["execution_ms"]["median"], ", ".join(changes),
+        ))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--rows", type=int, default=1000000)
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--indexes", choices=("none", "gin", "advisor"), default="gin")
+    arg_parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    arg_parser.add_argument("--compare", help="JSON report of an earlier run to compare against")
+    arg_parser.add_argument("--print-sql", action="store_true", help="print the SQL of each filter and setting, and exit")
+    args = arg_parser.parse_args()
+
+    if args.print_sql:
+        for name, src in CATALOG.items():
+            for setting in SETTINGS:
+                print("{} / {}:\n    {}\n".format(name, setting, build_sql(src, setting)))
+        sys.exit()
+
+    setup_django()
+    from django.db import connection
+    from testapp.models import BasicHStoreData
+
+    table = BasicHStoreData._meta.db_table
+    with connection.cursor() as cursor:
+        loaded = load(cursor, table, args.rows, args.seed)
+        indexes = build_indexes(cursor, table, args.indexes)
+        for name, value in SESSION_SETTINGS.items():
+            cursor.execute("SET {} = {}".format(name, value))
+        cursor.execute("SHOW server_version")
+        server_version = cursor.fetchone()[0]
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "postgres": server_version,
+                "time": time.time(),
+                "rows": args.rows,
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "indexes": indexes,
+                "session_settings": SESSION_SETTINGS,
+                "reloaded": loaded,
+            },
+            "catalog": CATALOG,
+            "settings": {
+                name: {"patches": sorted(patches), "options": options, "optimize": optimize}
+                for name, (patches, options, optimize) in SETTINGS.items()
+            },
+            "results": run_catalog(cursor, table, args.repeat),
+        }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print_summary(report)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
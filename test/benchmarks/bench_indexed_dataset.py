@@ -0,0 +1,84 @@
+"""
+Query latency over an IndexedDataset versus scanning the same dicts with
+DictionaryPredicateDelegate.call, plus the cost of building the index and
+of incremental inserts and deletes.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_indexed_dataset.py [n_records]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate, IndexedDataset, IndexedDatasetDelegate
+
+
+QUERIES = [
+    'country = "c7"',
+    'device in ("ios", "android"), age >= 30, age < 35',
+    'income > "150000"',
+    "premium ?= true, visits <= 3",
+    '[country = "c1", country = "c2"], device != "web"',
+    "!{age > 20}",
+    "premium = true, country = \"c3\"",
+]
+
+
+def make_record(rnd):
+    record = {
+        "country": "c{}".format(rnd.randint(0, 49)),
+        "age": rnd.randint(13, 80),
+        "device": rnd.choice(["ios", "android", "web"]),
+        "income": str(rnd.randrange(0, 250000, 500)),
+        "visits": rnd.randint(0, 100),
+    }
+    if rnd.random() < 0.2:
+        record["premium"] = True
+    return record
+
+
+def best_of(func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rnd = random.Random(42)
+    records = [make_record(rnd) for _ in range(n_records)]
+
+    start = time.perf_counter()
+    dataset = IndexedDataset(records)
+    print("records: {}, build: {:.2f}s".format(n_records, time.perf_counter() - start))
+
+    delegate = DictionaryPredicateDelegate()
+    print("{:<52}  {:>8}  {:>10}  {:>10}  {:>8}".format("query", "matches", "scan ms", "index ms", "speedup"))
+    for src in QUERIES:
+        scan = Daffodil(src, delegate)
+        indexed = Daffodil(src, IndexedDatasetDelegate())
+
+        t_scan, expected = best_of(lambda: delegate.call(scan.predicate, records))
+        t_index, matched = best_of(lambda: indexed(dataset))
+        assert matched == expected
+
+        print("{:<52}  {:>8}  {:>10.1f}  {:>10.1f}  {:>7.1f}x".format(
+            src, len(expected), t_scan * 1e3, t_index * 1e3, t_scan / t_index
+        ))
+
+    new_records = [make_record(rnd) for _ in range(10000)]
+    start = time.perf_counter()
+    rows = [dataset.insert(record) for record in new_records]
+    t_insert = (time.perf_counter() - start) / len(rows)
+    start = time.perf_counter()
+    for row in rows:
+        dataset.delete(row)
+    t_delete = (time.perf_counter() - start) / len(rows)
+    print("insert: {:.1f} us/record, delete: {:.1f} us/record".format(t_insert * 1e6, t_delete * 1e6))
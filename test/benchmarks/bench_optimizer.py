@@ -0,0 +1,85 @@
+"""
+Filters as a query builder tends to write them (nested groups, one
+equality per selected value, overlapping ranges), built with and without
+the optimizer: per-record evaluation time, tree size and generated SQL
+size.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_optimizer.py [n_records]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate, HStoreQueryDelegate
+
+
+FILTERS = {
+    "equalities": "[{}]".format(", ".join('country = "c{}"'.format(i) for i in range(0, 40, 2))),
+    "ranges": "{age >= 18, [age >= 21, age > 25], age <= 65, age < 70, {income > 1000, income >= 5000}}",
+    "nested": """
+        {
+            [device = "ios", [device = "android", [device = "ios"]]]
+            {premium ?= true, {premium ?= true, visits > 2}}
+            ![country = "c1", country = "c2", country = "c3"]
+        }
+    """,
+    "contradiction": '[{country = "c1", country = "c2", age > 30}, {age > 50, age < 40}, visits > 90]',
+}
+
+
+def make_record(rnd):
+    record = {
+        "country": "c{}".format(rnd.randint(0, 49)),
+        "age": rnd.randint(13, 80),
+        "income": rnd.randrange(0, 100000, 500),
+        "device": rnd.choice(["ios", "android", "web"]),
+        "visits": rnd.randint(0, 100),
+    }
+    if rnd.random() < 0.3:
+        record["premium"] = True
+    return record
+
+
+def time_per_record(predicate, records, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for record in records:
+            predicate(record)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / len(records)
+
+
+def count_nodes(node):
+    return 1 + sum(count_nodes(child) for child in getattr(node, "children", ()))
+
+
+if __name__ == "__main__":
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rnd = random.Random(42)
+    records = [make_record(rnd) for _ in range(n_records)]
+
+    print("{:<14}  {:>14}  {:>9}  {:>9}  {:>8}  {:>8}".format(
+        "filter", "nodes", "plain us", "opt us", "speedup", "SQL"
+    ))
+    for name, src in FILTERS.items():
+        plain = Daffodil(src, DictionaryPredicateDelegate(), cache=None, optimize=False)
+        optimized = Daffodil(src, DictionaryPredicateDelegate(), cache=None)
+        assert plain(records) == optimized(records)
+
+        t_plain = time_per_record(plain.predicate, records)
+        t_opt = time_per_record(optimized.predicate, records)
+
+        ast = plain.parse_result
+        sql_plain = Daffodil(src, HStoreQueryDelegate(hstore_field_name="data"), cache=None, optimize=False).predicate
+        sql_opt = Daffodil(src, HStoreQueryDelegate(hstore_field_name="data"), cache=None, optimize=True).predicate
+
+        print("{:<14}  {:>6} -> {:<4}  {:>9.3f}  {:>9.3f}  {:>7.1f}x  {:>3.0f}%".format(
+            name, count_nodes(ast.ast), count_nodes(ast.optimized_ast()), t_plain * 1e6, t_opt * 1e6, t_plain / t_opt,
+            100.0 * len(sql_opt) / len(sql_plain),
+        ))
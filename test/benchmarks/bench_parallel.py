@@ -0,0 +1,59 @@
+"""
+Serial filtering versus Daffodil.filter_parallel on wide records, where
+stripping records down to the filter's keys keeps pickling cheap.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_parallel.py [n_records] [workers ...]
+"""
+import sys
+import os
+import pickle
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate
+from daffodil.parallel import strip_record
+
+
+SRC = """
+    k1 > 20
+    [
+        k2 = "v3"
+        k3 in (1, 2, 3, 4, 5)
+    ]
+    k4 ?= true
+"""
+
+
+def make_records(n, width=200):
+    rnd = random.Random(42)
+    return [
+        {"k{}".format(i): rnd.choice([rnd.randint(0, 100), "v{}".format(rnd.randint(0, 9))]) for i in range(width)}
+        for _ in range(n)
+    ]
+
+
+if __name__ == "__main__":
+    n_records = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    worker_counts = [int(w) for w in sys.argv[2:]] or [1, 2, 4]
+
+    records = make_records(n_records)
+    daff = Daffodil(SRC, DictionaryPredicateDelegate(), cache=None)
+
+    full = len(pickle.dumps(records[:1000]))
+    stripped = len(pickle.dumps([strip_record(r, tuple(daff.keys)) for r in records[:1000]]))
+    print("pickled size per 1000 records: {} bytes whole, {} bytes stripped".format(full, stripped))
+
+    start = time.perf_counter()
+    expected = daff(records)
+    print("{:>8}  {:>10.3f}s".format("serial", time.perf_counter() - start))
+
+    for workers in worker_counts:
+        start = time.perf_counter()
+        result = daff.filter_parallel(records, workers=workers, chunksize=5000)
+        elapsed = time.perf_counter() - start
+        assert result == expected
+        print("{:>8}  {:>10.3f}s".format("{} procs".format(workers), elapsed))
@@ -0,0 +1,78 @@
+"""
+Parse + predicate build time for growing filter sources.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_parser.py [max_size_in_bytes]
+
+Time per KB should stay roughly flat as the source grows; a growing
+ratio means a quadratic step crept back into the parser or tree builder.
+"""
+import sys
+import os
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil
+
+
+SIZES = (
+    1024,
+    10 * 1024,
+    100 * 1024,
+    1024 * 1024,
+    10 * 1024 * 1024,
+    50 * 1024 * 1024,
+)
+
+CONDITIONS = (
+    'gender = "female"\n'
+    '"home country" != \'United \\"States\\"\'  # trailing comment\n'
+    '[ age >= 18, age < 35, signed_up > timestamp(2017-10-31) ]\n'
+    '!{ zip_code in ("10019", "10004"), opted_out ?= true }\n'
+)
+
+
+def make_source(size):
+    """
+    Half of the source is a single `in (...)` list, the other half is a
+    repeated block of mixed conditions, comments and nested groups.
+    """
+    ids = []
+    ids_len = 0
+    i = 0
+    while ids_len < size // 2:
+        elem = str(2082237 + i)
+        ids.append(elem)
+        ids_len += len(elem) + 2
+        i += 1
+
+    conditions = CONDITIONS * max(1, (size // 2) // len(CONDITIONS))
+    return "{}user_id in ({})\n".format(conditions, ", ".join(ids))
+
+
+def bench(size):
+    src = make_source(size)
+
+    start = time.perf_counter()
+    Daffodil(src, cache=None)
+    elapsed = time.perf_counter() - start
+
+    return len(src), elapsed
+
+
+if __name__ == "__main__":
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZES[-1]
+
+    # warm up imports and caches before timing anything
+    bench(SIZES[0])
+
+    print("{:>12}  {:>10}  {:>10}".format("bytes", "seconds", "us / KB"))
+    for size in SIZES:
+        if size > max_size:
+            break
+        n_bytes, elapsed = bench(size)
+        print("{:>12}  {:>10.4f}  {:>10.2f}".format(
+            n_bytes, elapsed, elapsed * 1e6 / (n_bytes / 1024.0)
+        ))
@@ -0,0 +1,77 @@
+"""
+Evaluating a batch of filters which reuse the same conditions, with and
+without a ConditionPool sharing condition results per record.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_shared_conditions.py [n_filters]
+"""
+import sys
+import os
+import random
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from daffodil import Daffodil, DictionaryPredicateDelegate, ConditionPool
+
+
+CONDITIONS = (
+    ['country = "{}"'.format(c) for c in ("US", "CA", "GB", "DE", "FR")] +
+    ["age >= {}".format(a) for a in (18, 21, 25, 35, 50)] +
+    ['device in ("ios", "android")', 'device = "web"', "premium ?= true", 'income > "50000"'] +
+    ['interest = "i{}"'.format(i) for i in range(20)]
+)
+
+
+def make_filter(rnd):
+    conditions = rnd.sample(CONDITIONS, rnd.randint(2, 5))
+    if rnd.random() < 0.5:
+        return ", ".join(conditions)
+    return "{}, [{}]".format(conditions[0], ", ".join(conditions[1:]))
+
+
+def make_record(rnd):
+    record = {
+        "country": rnd.choice(["US", "CA", "GB", "DE", "FR"]),
+        "age": rnd.randint(13, 80),
+        "device": rnd.choice(["ios", "android", "web"]),
+        "income": str(rnd.randrange(0, 200000, 1000)),
+        "interest": "i{}".format(rnd.randint(0, 19)),
+    }
+    if rnd.random() < 0.3:
+        record["premium"] = True
+    return record
+
+
+if __name__ == "__main__":
+    n_filters = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rnd = random.Random(42)
+    sources = [make_filter(rnd) for _ in range(n_filters)]
+    records = [make_record(rnd) for _ in range(200)]
+
+    plain = [Daffodil(src, cache=None).predicate for src in sources]
+
+    pool = ConditionPool()
+    delegate = DictionaryPredicateDelegate(pool=pool)
+    shared = [Daffodil(src, delegate).predicate for src in sources]
+
+    start = time.perf_counter()
+    expected = [[bool(p(record)) for p in plain] for record in records]
+    t_plain = (time.perf_counter() - start) / len(records)
+
+    start = time.perf_counter()
+    results = [pool.evaluate(record, shared) for record in records]
+    t_shared = (time.perf_counter() - start) / len(records)
+
+    assert results == expected
+
+    stats = pool.stats()
+    print("filters: {}, conditions: {}, distinct: {}, dedup ratio: {:.1f}".format(
+        n_filters, stats["conditions"], stats["distinct"], stats["dedup_ratio"]
+    ))
+    print("evaluations per record: {:.1f}, cache hits per record: {:.1f}".format(
+        stats["evaluations"] / len(records), stats["cache_hits"] / len(records)
+    ))
+    print("plain:  {:10.1f} us/record".format(t_plain * 1e6))
+    print("shared: {:10.1f} us/record".format(t_shared * 1e6))
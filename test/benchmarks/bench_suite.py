@@ -0,0 +1,212 @@
+"""
+Seeded benchmark suite over synthetic filters and records (see
+test/data/test_data_generation.py), writing machine-readable JSON so
+results can be compared between commits.
+
+Starting from a base scenario, one dimension at a time is varied: filter
+size, nesting depth, array length, record width and value-type mix. Each
+scenario measures:
+
+- parsing the source
+- the optimizer pass
+- building the predicate with DictionaryPredicateDelegate, the SQL with
+  HStoreQueryDelegate, and the SimulationMatchingDelegate and
+  PrettyPrintDelegate predicates
+- evaluation per record for the dict (with and without the optimizer)
+  and simulation predicates, and rendering the pretty printed source
+- the peak memory allocated while parsing and building all of the above
+
+Predicates are built from the tree as parsed, the optimizer folds random
+filters too well for them to say much about the delegates. Times are the
+best of ``--repeat`` runs, in seconds.
+
+Run from the repository root:
+
+    python test/benchmarks/bench_suite.py [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from data.test_data_generation import make_schema, make_record, make_filter
+
+from daffodil import (
+    Daffodil, DictionaryPredicateDelegate, HStoreQueryDelegate,
+    SimulationMatchingDelegate, PrettyPrintDelegate,
+)
+from daffodil.parser import DaffodilParser
+from daffodil.optimizer import optimize
+
+
+BASE_SCENARIO = {
+    "conditions": 50,
+    "depth": 3,
+    "array_length": 5,
+    "width": 20,
+    "type_mix": "mixed",
+}
+
+VARIATIONS = {
+    "conditions": (5, 500, 5000),
+    "depth": (1, 6),
+    "array_length": (2, 50, 500),
+    "width": (5, 200),
+    "type_mix": ("numeric", "string"),
+}
+
+DELEGATES = {
+    "dict": DictionaryPredicateDelegate,
+    "hstore": lambda: HStoreQueryDelegate(hstore_field_name="data"),
+    "simulation": SimulationMatchingDelegate,
+    "pretty_print": PrettyPrintDelegate,
+}
+
+
+def scenarios():
+    yield "base", dict(BASE_SCENARIO)
+    for dimension, values in VARIATIONS.items():
+        for value in values:
+            params = dict(BASE_SCENARIO)
+            params[dimension] = value
+            yield "{}={}".format(dimension, value), params
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_memory(src):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        parser = DaffodilParser(src)
+        built = [Daffodil(parser, delegate(), cache=None, optimize=False) for delegate in DELEGATES.values()]
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(params, seed, n_records, repeat):
+    rnd = random.Random(seed)
+    schema = make_schema(rnd, params["width"], params["type_mix"])
+    src = make_filter(rnd, schema, params["conditions"], params["depth"], params["array_length"])
+    records = [make_record(rnd, schema) for _ in range(n_records)]
+    possibilities = [{key: [value] for key, value in record.items()} for record in records]
+
+    parser = DaffodilParser(src)
+    results = {
+        "source_bytes": len(src),
+        "parse": best_of(repeat, lambda: DaffodilParser(src)),
+        "optimize": best_of(repeat, lambda: optimize(parser.ast)),
+    }
+
+    built = {}
+    for name, delegate in DELEGATES.items():
+        # the optimizer is timed on its own above
+        results["build_" + name] = best_of(
+            repeat, lambda: Daffodil(parser, delegate(), cache=None, optimize=False)
+        )
+        built[name] = Daffodil(parser, delegate(), cache=None, optimize=False)
+
+    dict_predicate = built["dict"].predicate
+    results["matches"] = sum(1 for record in records if dict_predicate(record))
+    results["eval_dict_per_record"] = best_of(
+        repeat, lambda: [dict_predicate(record) for record in records]
+    ) / n_records
+
+    optimized = Daffodil(parser, DictionaryPredicateDelegate(), cache=None, optimize=True).predicate
+    results["eval_dict_optimized_per_record"] = best_of(
+        repeat, lambda: [optimized(record) for record in records]
+    ) / n_records
+
+    simulation = built["simulation"].predicate
+    results["eval_simulation_per_record"] = best_of(
+        repeat, lambda: [simulation(poss) for poss in possibilities]
+    ) / n_records
+
+    results["render_pretty_print"] = best_of(repeat, built["pretty_print"])
+    results["sql_bytes"] = len(built["hstore"].predicate)
+    results["peak_memory_bytes"] = peak_memory(src)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints each measurement as a ratio to the baseline's, > 1 being slower
+    (or bigger).
+    """
+    previous = {scenario["name"]: scenario["results"] for scenario in baseline["scenarios"]}
+    print("compared to {}".format(baseline["meta"].get("commit")))
+    for scenario in results["scenarios"]:
+        before = previous.get(scenario["name"])
+        if before is None:
+            continue
+        ratios = [
+            "{} {:.2f}".format(metric, value / before[metric])
+            for metric, value in sorted(scenario["results"].items())
+            if before.get(metric)
+        ]
+        print("{:<22}  {}".format(scenario["name"], ", ".join(ratios)))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--records", type=int, default=2000)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    arg_parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = arg_parser.parse_args()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+            "seed": args.seed,
+            "records": args.records,
+            "repeat": args.repeat,
+        },
+        "scenarios": [
+            {"name": name, "params": params, "results": run_scenario(params, args.seed, args.records, args.repeat)}
+            for name, params in scenarios()
+        ],
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -31,3 +31,120 @@ months_ago_7 = offset_to_ts(months=7)
 
 years_ago_0 = random_until_now(day_start.replace(month=1, day=1))
 years_ago_2 = offset_to_ts(years=2)
+
+
+############################################################
+# Seeded synthetic filters and records
+############################################################
+
+# value types a key can hold, see make_schema()
+INT, FLOAT, STR, NUMERIC_STR, BOOL = "int", "float", "str", "numeric_str", "bool"
+
+TYPE_MIXES = {
+    "numeric": {INT: 3, FLOAT: 1},
+    "string": {STR: 3, NUMERIC_STR: 1},
+    "mixed": {INT: 2, FLOAT: 1, STR: 2, NUMERIC_STR: 1, BOOL: 1},
+}
+
+NUMERIC_OPERATORS = ("=", "!=", "<", "<=", ">", ">=")
+STRING_OPERATORS = ("=", "!=")
+
+
+def make_schema(rnd, width, type_mix="mixed"):
+    """
+    Maps ``width`` keys to value types drawn from one of TYPE_MIXES.
+    """
+    types, weights = zip(*TYPE_MIXES[type_mix].items())
+    return {
+        "k{}".format(i): rnd.choices(types, weights)[0]
+        for i in range(width)
+    }
+
+
+def make_value(rnd, value_type):
+    # small domains so that filters match a fair share of the records
+    if value_type == INT:
+        return rnd.randint(0, 99)
+    if value_type == FLOAT:
+        return rnd.randint(0, 990) / 10.0
+    if value_type == STR:
+        return "v{}".format(rnd.randint(0, 19))
+    if value_type == NUMERIC_STR:
+        return str(rnd.randint(0, 99))
+    return rnd.random() < 0.5
+
+
+def make_record(rnd, schema, missing=0.1):
+    """
+    A record with a value for most of the schema's keys. One value in fifty
+    has another type than its key's, to exercise coercion.
+    """
+    types = list(TYPE_MIXES["mixed"])
+    record = {}
+    for key, value_type in schema.items():
+        if rnd.random() < missing:
+            continue
+        if rnd.random() < 0.02:
+            value_type = rnd.choice(types)
+        record[key] = make_value(rnd, value_type)
+    return record
+
+
+def to_daffodil_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return '"{}"'.format(value)
+    return repr(value)
+
+
+def make_condition(rnd, schema, array_length=5):
+    key = rnd.choice(list(schema))
+    value_type = schema[key]
+
+    if value_type == BOOL or rnd.random() < 0.05:
+        return "{} ?= {}".format(key, to_daffodil_value(rnd.random() < 0.8))
+
+    if array_length > 1 and rnd.random() < 0.25:
+        values = {make_value(rnd, value_type) for _ in range(array_length)}
+        # a numeric array of one value doesn't parse, pad it with another
+        while len(values) < 2:
+            values.add(make_value(rnd, value_type))
+        return "{} {} ({})".format(
+            key, rnd.choice(("in", "!in")), ", ".join(to_daffodil_value(v) for v in sorted(values))
+        )
+
+    operators = STRING_OPERATORS if value_type == STR else NUMERIC_OPERATORS
+    return "{} {} {}".format(key, rnd.choice(operators), to_daffodil_value(make_value(rnd, value_type)))
+
+
+# group openers and how often they're picked, "any" groups most often so
+# that big random filters aren't all contradictions
+GROUP_OPENERS = {"[": 4, "{": 3, "![": 1, "!{": 2}
+CLOSERS = {"[": "]", "{": "}", "![": "]", "!{": "}"}
+
+
+def make_filter(rnd, schema, n_conditions=10, depth=2, array_length=5):
+    """
+    Daffodil source with ``n_conditions`` conditions spread over groups
+    nested ``depth`` levels deep, under a top level "any" group.
+    """
+    return "[{}]".format(_make_children(rnd, schema, n_conditions, depth, array_length))
+
+
+def _make_children(rnd, schema, n_conditions, depth, array_length):
+    if depth <= 1 or n_conditions < 2:
+        return ", ".join(make_condition(rnd, schema, array_length) for _ in range(n_conditions))
+
+    openers, weights = zip(*GROUP_OPENERS.items())
+    n_groups = min(n_conditions, rnd.randint(2, 3))
+    sizes = [n_conditions // n_groups] * n_groups
+    sizes[0] += n_conditions % n_groups
+
+    children = []
+    for size in sizes:
+        opener = rnd.choices(openers, weights)[0]
+        children.append("{}{}{}".format(
+            opener, _make_children(rnd, schema, size, depth - 1, array_length), CLOSERS[opener]
+        ))
+    return ", ".join(children)
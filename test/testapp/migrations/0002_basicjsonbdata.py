@@ -0,0 +1,22 @@
+from django.db import models, migrations
+from django.contrib.postgres.indexes import GinIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasicJSONBData',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('jsdata', models.JSONField()),
+            ],
+            options={
+                'indexes': [GinIndex(fields=['jsdata'], name='jsdata_path_ops', opclasses=['jsonb_path_ops'])],
+            },
+        ),
+    ]
@@ -1,6 +1,16 @@
 from django.db import models
 from django.contrib.postgres.fields import HStoreField
+from django.contrib.postgres.indexes import GinIndex
 
 
 class BasicHStoreData(models.Model):
     hsdata = HStoreField()
+
+
+class BasicJSONBData(models.Model):
+    jsdata = models.JSONField()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["jsdata"], name="jsdata_path_ops", opclasses=["jsonb_path_ops"]),
+        ]
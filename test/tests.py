@@ -2,21 +2,39 @@ import sys
 import os
 import unittest
 import re
+import asyncio
 import itertools
+import pickle
+import json
+import random
+import sqlite3
 from datetime import datetime
 
 from dateutil.relativedelta import relativedelta
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from data.nyc_sat_scores import NYC_SAT_SCORES
+from data.test_data_generation import make_schema, make_record, make_value, make_filter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 from daffodil import (
     Daffodil, TimeStamp,
     KeyExpectationDelegate, DictionaryPredicateDelegate,
-    HStoreQueryDelegate, PrettyPrintDelegate, SimulationMatchingDelegate
+    HStoreQueryDelegate, JSONBQueryDelegate, SQLiteQueryDelegate, PrettyPrintDelegate, SimulationMatchingDelegate,
+    DaffodilCache, DaffodilSet, ConditionPool, IndexAdvisor, HStoreSegments,
+    IndexedDataset, IndexedDatasetDelegate,
 )
 from daffodil.exceptions import ParseError
+from daffodil.parser import Group, Condition, Comment
+from daffodil.parallel import strip_record
+from daffodil.index_advisor import index_name
+from daffodil import predicate as predicate_module
+from daffodil import indexed_dataset as indexed_dataset_module
 
 
 class BaseTest(unittest.TestCase):
@@ -63,6 +81,15 @@ class ParserGrammarTypesTests(unittest.TestCase):
         ]:
             self.parse(f"whatever in {dirty_string}", delegate)
 
+    def test_large_array(self):
+        ids = range(50000)
+        daff = self.parse(
+            "id in ({})\nname = 'a \\'quoted\\' name' # comment".format(", ".join(map(str, ids))),
+            DictionaryPredicateDelegate()
+        )
+        self.assertTrue(daff.predicate({"id": 49999, "name": "a 'quoted' name"}))
+        self.assertFalse(daff.predicate({"id": 50000, "name": "a 'quoted' name"}))
+
 
 class SATDataTests(BaseTest):
     def assert_filter_has_n_results(self, n, daff_src):
@@ -995,6 +1022,304 @@ class SATDataTests(BaseTest):
         """)
 
 
+class SATDataTestsUnoptimized(SATDataTests):
+    def filter(self, daff_src):
+        return Daffodil(daff_src, optimize=False)(self.d)
+
+
+def records_to_columns(records):
+    """
+    Turns a list of dicts into numpy columns, with keys that are absent from
+    some records becoming masked arrays (or NaN for float columns).
+    """
+    columns = {}
+    keys = set(itertools.chain.from_iterable(records))
+    for key in keys:
+        values = [record.get(key) for record in records]
+        present = [key in record for record in records]
+        types = {type(v) for v, p in zip(values, present) if p}
+
+        if types == {int}:
+            dtype, fill = np.int64, 0
+        elif types <= {int, float}:
+            dtype, fill = np.float64, np.nan
+        elif types == {str}:
+            dtype, fill = str, ""
+        else:
+            dtype, fill = object, None
+
+        column = np.array([v if p else fill for v, p in zip(values, present)], dtype=dtype)
+        if not all(present) and dtype is not np.float64:
+            column = np.ma.MaskedArray(column, mask=[not p for p in present])
+        columns[key] = column
+    return columns
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class SATDataTestsColumnar(SATDataTests):
+    def setUp(self):
+        super().setUp()
+        self.columns = records_to_columns(self.d)
+
+    def filter(self, daff_src):
+        from daffodil.columnar_delegate import ColumnarPredicateDelegate
+
+        mask = Daffodil(daff_src, ColumnarPredicateDelegate())(self.columns)
+        return [record for record, matched in zip(self.d, mask) if matched]
+
+    def test_none(self):
+        pass
+
+    def test_matches_dictionary_delegate(self):
+        from daffodil.columnar_delegate import ColumnarPredicateDelegate
+
+        records = [
+            {"a": 1, "b": "x", "c": 1.5, "d": True},
+            {"a": 2, "b": "10", "c": 2},
+            {"a": 2**60, "b": "2.5", "d": "yes"},
+            {"b": "y"},
+            {"a": -3, "c": -1, "d": None},
+        ]
+        columns = records_to_columns(records)
+        for src in [
+            'a = 2', 'a != 2', 'a > "1"', 'a < "abc"', 'a = 1152921504606846976.0',
+            'b > 5', 'b = "x"', 'b in (10, 2.5)', 'b !in ("x", "y")', 'c >= 1.5',
+            'c ?= true', 'c ?= false', 'd = true', 'd != "yes"', 'e = 1', 'e != 1',
+            '[a in (1, 2), c < 0]', 'a !in (2, 3)', 'c in ("2", "1.5")', '!{b = "y"}', '![a > 0, b ?= true]',
+        ]:
+            expected = [bool(Daffodil(src).predicate(r)) for r in records]
+            mask = Daffodil(src, ColumnarPredicateDelegate())(columns)
+            self.assertEqual(mask.tolist(), expected, src)
+
+    def test_nan_is_missing(self):
+        from daffodil.columnar_delegate import ColumnarPredicateDelegate
+
+        columns = {"c": np.array([1.5, np.nan, 2.0])}
+        records = [{"c": 1.5}, {}, {"c": 2.0}]
+        for src in ['c ?= true', 'c ?= false', 'c != 1.5', 'c !in (1.5, 3)', 'c = 2', '!{c > 0}']:
+            expected = [bool(Daffodil(src).predicate(r)) for r in records]
+            mask = Daffodil(src, ColumnarPredicateDelegate())(columns)
+            self.assertEqual(mask.tolist(), expected, src)
+
+        # unlike float("nan") in a dict, which is a present value
+        self.assertEqual(Daffodil("c ?= true", ColumnarPredicateDelegate())(columns).tolist(), [True, False, True])
+        self.assertTrue(Daffodil("c ?= true").predicate({"c": float("nan")}))
+
+    def test_bools_mixed_with_numbers(self):
+        from daffodil.columnar_delegate import ColumnarPredicateDelegate
+
+        # equal to 1 and 0, but a string coerces to a bool and not to an int
+        values = [1, True, 0, False, 1.0]
+        columns = {"a": np.array(values, dtype=object)}
+        for src in ['a = "x"', 'a != "x"', 'a = ""', 'a = 1', 'a in ("x", "")', 'a > "0"']:
+            expected = [bool(Daffodil(src).predicate({"a": v})) for v in values]
+            mask = Daffodil(src, ColumnarPredicateDelegate())(columns)
+            self.assertEqual(mask.tolist(), expected, src)
+
+
+class SATDataTestsAdaptive(SATDataTests):
+    def setUp(self):
+        super().setUp()
+        # sample and reorder often enough to happen within the 421 records
+        self.sample_every = predicate_module.ADAPTIVE_SAMPLE_EVERY
+        self.reorder_every = predicate_module.ADAPTIVE_REORDER_EVERY
+        predicate_module.ADAPTIVE_SAMPLE_EVERY = 2
+        predicate_module.ADAPTIVE_REORDER_EVERY = 3
+
+    def tearDown(self):
+        predicate_module.ADAPTIVE_SAMPLE_EVERY = self.sample_every
+        predicate_module.ADAPTIVE_REORDER_EVERY = self.reorder_every
+
+    def filter(self, daff_src):
+        daff = Daffodil(daff_src, DictionaryPredicateDelegate(adaptive=True), cache=None)
+        # evaluate twice so the second pass runs in the learned order
+        daff(self.d)
+        return daff(self.d)
+
+    def test_reorders_by_selectivity(self):
+        daff = Daffodil("""
+            {
+                sat_math_avg_score ?= true
+                school_name != "nope"
+                dbn = "01M292"
+            }
+        """, DictionaryPredicateDelegate(adaptive=True), cache=None, optimize=False)
+        self.assertEqual(len(daff(self.d)), 1)
+
+        stats = daff.predicate.stats()["children"][0]["group"]
+        self.assertGreater(stats["reorders"], 0)
+        self.assertEqual(stats["order"][0], 2)
+        self.assertEqual(stats["children"][1]["pass_rate"], 1.0)
+        self.assertLess(stats["children"][2]["pass_rate"], 0.1)
+
+        stats = Daffodil(
+            "[x = 1, y = 1]", DictionaryPredicateDelegate(adaptive=True), cache=None, optimize=False
+        ).predicate.stats()
+        self.assertEqual(stats["samples"], 0)
+        self.assertEqual(stats["children"][0]["group"]["order"], [0, 1])
+
+
+class SATDataTestsSharedConditions(SATDataTests):
+    def setUp(self):
+        super().setUp()
+        self.pool = ConditionPool()
+
+    def filter(self, daff_src):
+        predicate = Daffodil(daff_src, DictionaryPredicateDelegate(pool=self.pool)).predicate
+        # evaluate twice per record, the second time entirely from the cache
+        matches = []
+        for record in self.d:
+            with self.pool.context(record):
+                if predicate(record) and predicate(record):
+                    matches.append(record)
+        return matches
+
+
+class SATDataTestsIndexed(SATDataTests):
+    def setUp(self):
+        super().setUp()
+        self.dataset = IndexedDataset(self.d)
+
+    def filter(self, daff_src):
+        return Daffodil(daff_src, IndexedDatasetDelegate())(self.dataset)
+
+    def test_none(self):
+        self.assertRaises(TypeError, self.dataset.insert, None)
+
+
+class SATDataTestsInstrumented(SATDataTests):
+    def filter(self, daff_src):
+        return Daffodil(daff_src, DictionaryPredicateDelegate(instrumented=True))(self.d)
+
+    def test_report(self):
+        src = """
+            # schools with scores
+            sat_math_avg_score ?= true
+            [
+                dbn = "01M292"
+                num_of_sat_test_takers > 100  # big ones
+            ]
+        """
+        daff = Daffodil(src, DictionaryPredicateDelegate(instrumented=True), optimize=False)
+        matches = daff(self.d)
+
+        root, present, any_group, dbn, takers = daff.report()
+        self.assertEqual(
+            [row["node"] for row in (root, present, any_group, dbn, takers)],
+            ["all", "condition", "any", "condition", "condition"]
+        )
+        self.assertEqual([row["depth"] for row in (root, present, any_group, dbn, takers)], [0, 1, 1, 2, 2])
+
+        self.assertEqual(takers["source"], "num_of_sat_test_takers > 100")
+        self.assertEqual((takers["line"], takers["column"]), (6, 17))
+        self.assertEqual(daff.source()[takers["start"]:takers["end"]], takers["source"])
+        self.assertEqual((root["start"], root["end"]), (0, len(daff.source())))
+
+        self.assertEqual(root["calls"], len(self.d))
+        self.assertEqual(root["passed"], len(matches))
+        self.assertEqual(present["calls"], len(self.d))
+        self.assertEqual(any_group["calls"], present["passed"])
+        self.assertEqual(any_group["passed"], len(matches))
+        # "any" short circuits on the first condition passing
+        self.assertEqual(dbn["calls"], any_group["calls"])
+        self.assertEqual(takers["calls"], dbn["failed"])
+        self.assertGreaterEqual(root["time_ns"], any_group["time_ns"])
+
+        self.assertEqual(root["errors"], 0)
+
+    def test_optimized_report(self):
+        daff = Daffodil("[x = 1, x = 2], y > 1", DictionaryPredicateDelegate(instrumented=True))
+        daff([{"x": 1, "y": 2}, {"x": 3}])
+        self.assertEqual(
+            [(row["node"], row["source"], row["calls"], row["passed"]) for row in daff.report()],
+            [("all", "[x = 1, x = 2], y > 1", 2, 1), ("condition", "x = 1", 2, 1), ("condition", "y > 1", 1, 1)]
+        )
+
+    def test_off_by_default(self):
+        daff = Daffodil("x = 1")
+        self.assertRaises(ValueError, daff.report)
+
+        # statistics aren't shared through the cache
+        delegate = DictionaryPredicateDelegate(instrumented=True)
+        self.assertIsNone(delegate.cache_key())
+        self.assertIsNot(Daffodil("x = 1", delegate).predicate, Daffodil("x = 1", delegate).predicate)
+        self.assertTrue(pickle.loads(pickle.dumps(delegate)).instrumented)
+
+    def test_combined_modes(self):
+        records = [{"x": v} for v in (1, 2, "a", None)]
+        for delegate in [
+            DictionaryPredicateDelegate(instrumented=True, adaptive=True),
+            DictionaryPredicateDelegate(instrumented=True, pool=ConditionPool()),
+        ]:
+            daff = Daffodil("[x = 1, x > 1]", delegate, optimize=False)
+            self.assertEqual(daff(records), records[:2])
+            self.assertEqual([row["calls"] for row in daff.report()], [4, 4, 4, 3])
+            # "a" can't be compared to a number
+            self.assertEqual([row["errors"] for row in daff.report()], [2, 2, 1, 1])
+
+
+class ConditionPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConditionPool()
+        self.delegate = DictionaryPredicateDelegate(pool=self.pool)
+
+    def test_identical_conditions_are_interned(self):
+        # unoptimized, the optimizer would fold the repeated conditions itself
+        filters = [
+            Daffodil(src, self.delegate, optimize=False) for src in [
+                'country = "US", age >= 18',
+                '[country = "US", age >= 21], age >= 18',
+                'age >= 18, x = 1, x = 1.0, x = true, x in (1, 2), x in (1, 2)',
+            ]
+        ]
+        stats = self.pool.stats()
+        self.assertEqual(stats["conditions"], 11)
+        self.assertEqual(stats["distinct"], 7)
+        self.assertAlmostEqual(stats["dedup_ratio"], 11 / 7)
+
+        record = {"country": "US", "age": 30, "x": 1}
+        self.assertEqual(self.pool.evaluate(record, [f.predicate for f in filters]), [True, True, True])
+        stats = self.pool.stats()
+        # "age >= 21" is short circuited, everything else is evaluated once
+        self.assertEqual(stats["evaluations"], 6)
+        self.assertEqual(stats["cache_hits"], 4)
+
+        # "x = 1.0" and "x = true" are distinct from "x = 1"
+        self.assertEqual(
+            self.pool.evaluate({"x": "1.0"}, [Daffodil(s, self.delegate).predicate for s in ["x = 1", "x = 1.0", "x = true"]]),
+            [True, True, True]
+        )
+        self.assertEqual(
+            self.pool.evaluate({"x": 2}, [Daffodil(s, self.delegate).predicate for s in ["x = 1", "x = 1.0", "x = true"]]),
+            [False, False, False]
+        )
+
+    def test_results_are_per_data_point(self):
+        predicate = Daffodil("age >= 18", self.delegate).predicate
+        with self.pool.context({"age": 30}):
+            self.assertFalse(predicate({"age": 10}))
+        with self.pool.context({"age": 10}) as pool:
+            self.assertIs(pool, self.pool)
+        self.assertTrue(predicate({"age": 30}))
+        self.assertEqual(self.pool.stats()["evaluations"], 0)
+
+        record = {"age": 30}
+        with self.pool.context(record):
+            self.assertTrue(predicate(record))
+            record["age"] = 10
+            # cached for the duration of the context
+            self.assertTrue(predicate(record))
+        with self.pool.context(record):
+            self.assertFalse(predicate(record))
+
+    def test_configuration(self):
+        self.assertIsNone(self.delegate.cache_key())
+
+        daff = pickle.loads(pickle.dumps(Daffodil("x = 1", self.delegate)))
+        self.assertIsInstance(daff.delegate.pool, ConditionPool)
+        self.assertTrue(daff.predicate({"x": 1}))
+
+
 class PredicateTests(unittest.TestCase):
     def setUp(self):
         self.data = {
@@ -1083,6 +1408,226 @@ class PredicateTests(unittest.TestCase):
 
         self.assertFalse(daff.predicate(self.data))
 
+    def test_match(self):
+        daff = Daffodil("""
+        # comments are dropped when the tree is built
+        ![
+            "MHQ9ProgsWatched - GoldRush" = "yes"  # trailing
+            "MHQ9ProgsWatched - TopGear" = "yes"
+        ]
+        {}
+        """)
+        self.assertTrue(daff.predicate.match(self.data))
+        self.assertFalse(daff.predicate.match({"MHQ9ProgsWatched - TopGear": "yes"}))
+        self.assertTrue(daff.predicate.match(None))
+
+    def test_in_coerces_array_once_per_type(self):
+        daff = Daffodil('x in ("1", "2", "3.5")')
+        not_in = Daffodil('x !in ("1", "2", "3.5")')
+
+        # repeat so the coerced lookup tables get reused
+        for _ in range(2):
+            for x, expected in ((2, True), (3.5, True), (4, False), ("2", True), ("2.0", False)):
+                self.assertEqual(daff.predicate({"x": x}), expected)
+                self.assertEqual(not_in.predicate({"x": x}), not expected)
+
+        self.assertTrue(Daffodil('x in (1, 2)').predicate({"x": "2.0"}))
+        self.assertFalse(Daffodil('x in (1, 2)').predicate({"x": "two"}))
+        self.assertTrue(Daffodil('x !in (1, 2)').predicate({"x": "two"}))
+        self.assertFalse(Daffodil('x in (1, 2)').predicate({"x": [1]}))
+        self.assertTrue(Daffodil('x !in (1, 2)').predicate({"x": {"unhashable": 1}}))
+
+
+class OptimizerTests(unittest.TestCase):
+    def optimized(self, src):
+        return Daffodil(src, PrettyPrintDelegate(dense=True), optimize=True)()
+
+    def test_rewrites(self):
+        for src, expected in [
+            # flattening, empty groups and duplicates
+            ('x = 1, {y = "a", {z ?= true}}', '{"x"=1,"y"="a","z"?=true}'),
+            ('[x = 1, [y = 2, [z = 3]]], {}', '["x"=1,"y"=2,"z"=3]'),
+            ('x = 1, x = 1, [y = 2, y = 2]', '{"x"=1,"y"=2}'),
+            ("# only a comment\n{}", "{}"),
+            ("!{[x = 1, y = 2]}", '!["x"=1,"y"=2]'),
+            # equalities fold into membership
+            ("[x = 1, x = 2, x in (2, 3)]", '{"x"in(1,2,3)}'),
+            ('[x = "a", x = "b"]', '{"x"in("a","b")}'),
+            ("x != 1, x != 2", '{"x"!in(1,2)}'),
+            # intervals
+            ("x >= 1, x <= 5, x > 2, x < 10", '{"x">2,"x"<=5}'),
+            ("x >= 3, x <= 3", '{"x"=3}'),
+            ("x > 1, x != 0, x != 5", '{"x">1,"x"!=5}'),
+            ("x in (1, 2, 3), x != 2, x > 1", '{"x"=3}'),
+            ("[x < 1, x < 5, x = 3, x = 7]", '["x"<5,"x"=7]'),
+            # contradictions and tautologies
+            ("x = 1, x = 2", "[]"),
+            ("x > 5, x < 3", "[]"),
+            ("x ?= false, x = 1", "[]"),
+            ("[x ?= true, x ?= false], y = 1", '{"y"=1}'),
+            ('[x = "a", x != "a"]', "{}"),
+            ("[x != 1, x != 2]", "{}"),
+            ("!{x = 1, x = 2}", "{}"),
+            # presence
+            ("x ?= true, x > 1", '{"x">1}'),
+            ("[x ?= true, x = 1]", '{"x"?=true}'),
+        ]:
+            self.assertEqual(self.optimized(src), expected, src)
+
+    def test_keeps_missing_key_and_coercion_semantics(self):
+        # each of these would change some record's result if folded
+        for src in [
+            '[x = "1", x = "a"]',
+            'x = "a", x = "b"',
+            '[x != "a", x != "b"]',
+            "[x = true, x = false]",
+            '[x > "10", x > "9"]',
+            "[x >= 1, x < 1]",
+            "[x ?= false, x = 1]",
+            'x in "abc", x in "bcd"',
+        ]:
+            self.assertEqual(
+                self.optimized(src),
+                Daffodil(src, PrettyPrintDelegate(dense=True))(),
+                src
+            )
+
+    def test_matches_unoptimized(self):
+        sources = [
+            "[x = 1, x = 2.5, x in (3, 4)]", 'x != "a", x != "b"', "x >= 1, x < 3, x != 2", "[x < 0, x > 10, x = 5]",
+            '[x = "1", x = "2.0"]', "[x != 1, x !in (1, 2)]", "x in (1, 2, 3), x !in (2, 3)", "[x ?= false, x != 1]",
+            '{x = true, x != "a"}', "!{x > 1, x < 5}", "![x = 1, [x = 2, y ?= true]]", "x = 1, x = 1.0",
+        ]
+        values = [1, 1.0, 2, 2.5, 3, 5, 11, -1, "1", "2.0", "a", "b", "", True, False, None, [1], "nan", float("nan")]
+        records = [None, {}] + [{"x": v} for v in values] + [{"x": v, "y": 1} for v in values]
+
+        for src in sources:
+            expected = [bool(Daffodil(src, optimize=False).predicate(r)) for r in records]
+            self.assertEqual([bool(Daffodil(src).predicate(r)) for r in records], expected, src)
+
+    def test_delegate_opt_in(self):
+        self.assertTrue(Daffodil("x = 1").optimized)
+        self.assertFalse(Daffodil("x = 1", HStoreQueryDelegate(hstore_field_name="h")).optimized)
+        self.assertFalse(Daffodil("x = 1", JSONBQueryDelegate("d")).optimized)
+        self.assertFalse(Daffodil("x = 1", SQLiteQueryDelegate()).optimized)
+        self.assertFalse(Daffodil("x = 1", PrettyPrintDelegate()).optimized)
+        self.assertFalse(Daffodil("x = 1", SimulationMatchingDelegate()).optimized)
+        self.assertFalse(Daffodil("x = 1", KeyExpectationDelegate()).optimized)
+        self.assertFalse(Daffodil("x = 1", optimize=False).optimized)
+
+        # keys come from the source even when conditions are folded away
+        self.assertEqual(Daffodil("x = 1, x = 2, y ?= true").keys, {"x", "y"})
+
+        daff = pickle.loads(pickle.dumps(Daffodil("[x = 1, x = 2]", optimize=False)))
+        self.assertFalse(daff.optimized)
+
+
+class AstLoweringTests(unittest.TestCase):
+    SRC = """
+        # adults in a few states
+        {
+            age >= 18  # adults only
+            state in ("NY", "NJ")
+            [premium ?= true, visits > 3]
+        }
+    """
+
+    def test_ast(self):
+        ast = Daffodil(self.SRC).parse_result.ast
+        self.assertIsInstance(ast, Group)
+        self.assertTrue(ast.is_all)
+        self.assertFalse(ast.negate)
+        self.assertIsInstance(ast.children, tuple)
+
+        comment, group = ast.children
+        self.assertIsInstance(comment, Comment)
+        self.assertEqual(comment.text, "# adults in a few states")
+        self.assertFalse(comment.is_inline)
+
+        age, inline, state, any_group = group.children
+        self.assertIsInstance(age, Condition)
+        self.assertEqual((age.key.content, age.test.content, age.val.content), ("age", ">=", 18))
+        self.assertEqual(state.val.content, ["NY", "NJ"])
+        self.assertFalse(any_group.is_all)
+        self.assertEqual(len(any_group.children), 2)
+        self.assertTrue(inline.is_inline)
+        self.assertEqual(inline.text, "# adults only")
+
+        for node, attr in [(ast, "children"), (ast, "is_all"), (age, "key"), (comment, "text")]:
+            with self.assertRaises(AttributeError):
+                setattr(node, attr, None)
+
+        self.assertEqual(Daffodil(self.SRC).parse_result.keys, frozenset(["age", "state", "premium", "visits"]))
+
+    def test_one_parse_lowers_to_every_delegate(self):
+        daff = Daffodil(self.SRC, cache=None)
+        tokens = daff.parse_result.tokens
+
+        records = [
+            {"age": 20, "state": "NY", "visits": 5},
+            {"age": 20, "state": "NJ"},
+            {"age": 20, "state": "NJ", "premium": True},
+            {"age": 17, "state": "NY", "premium": True},
+        ]
+        self.assertEqual(daff(records), [records[0], records[2]])
+
+        for delegate in [HStoreQueryDelegate(hstore_field_name="h"), KeyExpectationDelegate()]:
+            self.assertEqual(daff.lower(delegate), Daffodil(self.SRC, delegate, cache=None).predicate)
+
+        delegate = PrettyPrintDelegate()
+        self.assertEqual(delegate.call(daff.lower(delegate)), Daffodil(self.SRC, delegate, cache=None)())
+
+        # nothing was parsed again
+        self.assertIs(daff.parse_result.tokens, tokens)
+
+    def test_memoized_per_delegate(self):
+        daff = Daffodil(self.SRC, cache=None)
+        self.assertIs(daff.lower(DictionaryPredicateDelegate()), daff.predicate)
+
+        sql = daff.lower(HStoreQueryDelegate(hstore_field_name="h"))
+        self.assertIs(daff.lower(HStoreQueryDelegate(hstore_field_name="h")), sql)
+        self.assertIsNot(daff.lower(HStoreQueryDelegate(hstore_field_name="other")), sql)
+
+        # delegates without a cache key are memoized by identity
+        delegate = DictionaryPredicateDelegate(pool=ConditionPool())
+        predicate = daff.lower(delegate)
+        self.assertIs(daff.lower(delegate), predicate)
+        self.assertIsNot(daff.lower(DictionaryPredicateDelegate(pool=ConditionPool())), predicate)
+
+    def test_optimize(self):
+        daff = Daffodil("[x = 1, x = 2], {y > 1, y > 2}", cache=None)
+        ast = daff.parse_result.ast
+        self.assertIs(daff.parse_result.optimized_ast(), daff.parse_result.optimized_ast())
+        self.assertEqual(len(daff.parse_result.optimized_ast().children), 2)
+
+        # optimizing doesn't touch the parsed tree
+        self.assertIs(daff.parse_result.ast, ast)
+        self.assertEqual(len(ast.children), 2)
+        self.assertEqual(len(ast.children[0].children), 2)
+
+        delegate = PrettyPrintDelegate(dense=True)
+        self.assertEqual(delegate.call(daff.lower(delegate, optimize=True)), '{"x"in(1,2),"y">2}')
+        self.assertEqual(delegate.call(daff.lower(delegate)), '{["x"=1,"x"=2],{"y">1,"y">2}}')
+
+    def test_make_predicate(self):
+        source = Daffodil(self.SRC, cache=None)
+        tokens = source.parse_result.tokens
+        records = [{"age": 20, "state": "NY", "visits": 5}, {"age": 20, "state": "NJ"}]
+
+        daff = Daffodil("x = 1", cache=None)
+        predicate = daff.make_predicate(tokens)
+        self.assertEqual([r for r in records if predicate(r)], records[:1])
+        self.assertEqual(daff.keys, {"x", "age", "state", "premium", "visits"})
+        self.assertIs(source.parse_result.tokens, tokens)
+
+        # the deprecated parent argument takes the tokens following it,
+        # and consumes them
+        rest = tokens[1:] + ["after"]
+        with self.assertWarns(DeprecationWarning):
+            predicate = daff.make_predicate(rest, tokens[0])
+        self.assertEqual([r for r in records if predicate(r)], records[:1])
+        self.assertEqual(rest, ["after"])
+
 
 class KeyExpectationTests(unittest.TestCase):
 
@@ -1855,6 +2400,938 @@ class TimeStampOffsetTests(unittest.TestCase):
                 TimeStamp(wrong_format).content
 
 
+class DaffodilSetTests(unittest.TestCase):
+    FILTERS = [
+        "",
+        "[]",
+        "!{}",
+        "![]",
+        'dbn = "01M292"',
+        "sat_math_avg_score > 450",
+        "sat_math_avg_score >= 400, sat_math_avg_score < 420",
+        "sat_math_avg_score > 500, sat_math_avg_score < 450",
+        'num_of_sat_test_takers in (10, 11, 12)',
+        'num_of_sat_test_takers in ("10", "11")',
+        'num_of_sat_test_takers = "29"',
+        'school_name != "nope"',
+        'school_name !in ("a", "b")',
+        "[sat_math_avg_score > 600, sat_writing_avg_score > 600]",
+        "[sat_math_avg_score > 600, sat_math_avg_score < 350]",
+        '[dbn = "01M292", dbn = "01M448", zip_code = "10002"]',
+        "!{sat_math_avg_score > 450}",
+        "![dbn ?= true]",
+        "tag_with_null_value ?= true",
+        "tag_with_null_value = 5",
+        "missing_key ?= false, sat_math_avg_score < 400",
+        "_ack1 > 0.5",
+        'zip_code >= "10002", zip_code < "10010"',
+        "created > timestamp(2017-10-31)",
+        "{# only a comment\n}",
+        "[# only a comment\n]",
+    ]
+
+    def assert_same_matches(self, daffodil_set, filters, records):
+        daffodils = {i: Daffodil(src) for i, src in filters.items()}
+        for record in records:
+            self.assertEqual(
+                daffodil_set.match(record),
+                {i for i, daff in daffodils.items() if daff.predicate(record)},
+                record
+            )
+
+    def test_matches_every_filter_evaluated(self):
+        filters = dict(enumerate(self.FILTERS))
+        daffodil_set = DaffodilSet(filters)
+        self.assertEqual(len(daffodil_set), len(filters))
+        self.assert_same_matches(daffodil_set, filters, NYC_SAT_SCORES + [None, {}])
+
+    def test_coercion_and_other_types(self):
+        filters = dict(enumerate([
+            "x = 1", 'x = "1"', "x in (1, 2)", 'x in ("1", "a")', "x < 2", "x >= 1", "x > -1, x <= 1",
+            "x = true", '[x = 1, y = "a"]', "x ?= true",
+        ]))
+        daffodil_set = DaffodilSet(filters)
+        records = [{"x": v} for v in [1, 1.0, "1", "1.0", "a", True, False, None, [1], 2, "-1", "nan", "inf"]]
+        records += [{"y": "a"}, {"x": 5, "y": "a"}]
+        self.assert_same_matches(daffodil_set, filters, records)
+
+    def test_add_remove_and_replace(self):
+        daffodil_set = DaffodilSet()
+        daffodil_set.add("a", "x = 1")
+        daffodil_set.add("b", Daffodil("x > 0"))
+        daffodil_set.add("c", "y ?= true")
+        self.assertEqual(daffodil_set.match({"x": 1}), {"a", "b"})
+
+        daffodil_set.remove("a")
+        self.assertNotIn("a", daffodil_set)
+        self.assertEqual(daffodil_set.match({"x": 1}), {"b"})
+
+        daffodil_set.add("b", "x < 0")
+        self.assertEqual(daffodil_set.match({"x": 1, "y": 1}), {"c"})
+        self.assertEqual(daffodil_set.match({"x": -1}), {"b"})
+
+        self.assertRaises(TypeError, daffodil_set.add, "d", Daffodil("x = 1", PrettyPrintDelegate()))
+
+    def test_without_shared_conditions(self):
+        filters = dict(enumerate(self.FILTERS))
+        daffodil_set = DaffodilSet(filters, share_conditions=False)
+        self.assertIsNone(daffodil_set.stats()["conditions"])
+        self.assert_same_matches(daffodil_set, filters, NYC_SAT_SCORES)
+
+    def test_indexing(self):
+        daffodil_set = DaffodilSet({
+            "value": 'x = 1, y > 2',
+            "interval": "y > 2, y < 5",
+            "key": "x = true",
+            "always": "x != 1",
+            "never": "[]",
+        })
+        self.assertEqual(daffodil_set.stats(), {
+            "filters": 5, "keys": 2,
+            "by_value": 1, "by_interval": 1, "by_key": 1, "always": 1, "never": 1,
+            "conditions": daffodil_set.pool.stats(),
+        })
+        self.assertEqual(daffodil_set.candidates({"y": 7}), {"always"})
+        self.assertEqual(daffodil_set.candidates({"y": "3"}), {"always", "interval"})
+
+
+class IndexedDatasetTests(unittest.TestCase):
+    def assert_same_matches(self, dataset, records, sources):
+        for src in sources:
+            expected = [i for i, record in records.items() if Daffodil(src).predicate(record)]
+            self.assertEqual(dataset.row_ids(src), expected, src)
+            self.assertEqual(dataset.count(src), len(expected), src)
+
+    def test_coercion_and_other_types(self):
+        values = [
+            1, 1.0, 2.5, "1", "1.0", "a", "", "10", "9", True, False, None, [1], -1, "-1", "nan", float("nan"), "inf",
+        ]
+        records = dict(enumerate([{"x": v} for v in values] + [{"y": "a"}, {"x": 5, "y": "a"}]))
+        dataset = IndexedDataset(records.values())
+        self.assert_same_matches(dataset, records, [
+            "x = 1", 'x = "1"', "x != 1", 'x != "a"', "x in (1, 2)", 'x in ("1", "a")', 'x !in ("1", "9")',
+            "x !in (1, 2.5)", "x < 2", "x >= 1", 'x > "1"', 'x <= "9"', "x > -1, x <= 1", "x = true",
+            "x != false", 'x in "abc"', '[x = 1, y = "a"]', "x ?= true", "x ?= false", "z = 1", "z != 1",
+            "!{x < 2}", "![x = 1, x = 5]", "[]", "{}", "!{}", "![]", "x in (true, false)", 'x >= "a"',
+        ])
+
+    def test_wide_ranges(self):
+        max_range_value_bitmaps = indexed_dataset_module.MAX_RANGE_VALUE_BITMAPS
+        indexed_dataset_module.MAX_RANGE_VALUE_BITMAPS = 0
+        try:
+            records = dict(enumerate(NYC_SAT_SCORES))
+            self.assert_same_matches(IndexedDataset(NYC_SAT_SCORES), records, [
+                "sat_math_avg_score > 450", 'sat_math_avg_score <= "400"', 'zip_code >= "10002", zip_code < "10010"',
+                "!{sat_writing_avg_score >= 300, sat_writing_avg_score < 350}", "_ack1 > 0.5",
+            ])
+        finally:
+            indexed_dataset_module.MAX_RANGE_VALUE_BITMAPS = max_range_value_bitmaps
+
+    def test_insert_and_delete(self):
+        dataset = IndexedDataset()
+        records = {}
+        for i in range(20):
+            record = {"n": i, "parity": "odd" if i % 2 else "even"}
+            if i % 3 == 0:
+                record["three"] = True
+            records[dataset.insert(record)] = record
+
+        sources = ["n >= 5, n < 12", 'parity = "odd"', "three ?= true", 'n in (1, 2, 3), parity != "odd"']
+        self.assert_same_matches(dataset, records, sources)
+
+        for i in (0, 3, 4, 7, 11, 19):
+            self.assertIs(dataset.delete(i), records.pop(i))
+        record = {"n": 6, "parity": "even", "three": True}
+        records[dataset.insert(record)] = record
+        self.assertEqual(len(dataset), 15)
+        self.assert_same_matches(dataset, records, sources)
+
+        self.assertEqual(dataset.filter("n = 6"), [records[6], records[20]])
+        self.assertRaises(KeyError, dataset.delete, 0)
+        self.assertRaises(TypeError, dataset.filter, Daffodil("n = 6"))
+
+class StreamingEvaluationTests(unittest.TestCase):
+    SRC = "num_of_sat_test_takers < 50"
+
+    def setUp(self):
+        self.daff = Daffodil(self.SRC)
+        self.expected = self.daff(NYC_SAT_SCORES)
+        self.consumed = 0
+
+    def records(self):
+        for record in NYC_SAT_SCORES:
+            self.consumed += 1
+            yield record
+
+    async def arecords(self):
+        for record in self.records():
+            yield record
+
+    def test_stream(self):
+        stream = self.daff.stream(self.records())
+        self.assertEqual(self.consumed, 0)
+        self.assertEqual(next(stream), self.expected[0])
+        self.assertEqual(self.consumed, NYC_SAT_SCORES.index(self.expected[0]) + 1)
+        self.assertEqual([self.expected[0]] + list(stream), self.expected)
+
+    def test_count(self):
+        self.assertEqual(self.daff.count(self.records()), len(self.expected))
+        self.assertEqual(Daffodil("[]").count(NYC_SAT_SCORES), 0)
+
+    def test_any_match_short_circuits(self):
+        self.assertTrue(self.daff.any_match(self.records()))
+        self.assertEqual(self.consumed, NYC_SAT_SCORES.index(self.expected[0]) + 1)
+        self.assertFalse(Daffodil("[]").any_match(NYC_SAT_SCORES))
+
+    def test_first(self):
+        self.assertEqual(self.daff.first(self.records(), 3), self.expected[:3])
+        self.assertEqual(self.consumed, NYC_SAT_SCORES.index(self.expected[2]) + 1)
+        self.assertEqual(self.daff.first(NYC_SAT_SCORES), self.expected[:1])
+        self.assertEqual(self.daff.first(NYC_SAT_SCORES, 10000), self.expected)
+        self.assertEqual(self.daff.first(NYC_SAT_SCORES, 0), [])
+
+    def test_partition(self):
+        matching, not_matching = self.daff.partition(NYC_SAT_SCORES + [None])
+        self.assertEqual(matching, self.expected)
+        self.assertEqual(len(not_matching), len(NYC_SAT_SCORES) + 1 - len(self.expected))
+        self.assertEqual(not_matching[-1], None)
+
+    def test_async_variants(self):
+        async def collect():
+            return [record async for record in self.daff.astream(self.arecords(), yield_every=7)]
+
+        self.assertEqual(asyncio.run(collect()), self.expected)
+        self.assertEqual(asyncio.run(self.daff.acount(self.arecords())), len(self.expected))
+        self.assertEqual(
+            asyncio.run(self.daff.apartition(self.arecords())),
+            self.daff.partition(NYC_SAT_SCORES)
+        )
+
+        self.consumed = 0
+        self.assertEqual(asyncio.run(self.daff.afirst(self.arecords(), 2)), self.expected[:2])
+        self.assertEqual(self.consumed, NYC_SAT_SCORES.index(self.expected[1]) + 1)
+
+        self.consumed = 0
+        self.assertTrue(asyncio.run(self.daff.aany_match(self.arecords())))
+        self.assertEqual(self.consumed, NYC_SAT_SCORES.index(self.expected[0]) + 1)
+        self.assertFalse(asyncio.run(Daffodil("[]").aany_match(self.arecords())))
+
+    def test_async_yields_to_the_event_loop(self):
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+
+        async def plain_records():
+            for record in NYC_SAT_SCORES:
+                yield record
+
+        async def run():
+            task = asyncio.ensure_future(ticker())
+            await asyncio.sleep(0)
+            ticks.clear()
+            await self.daff.acount(plain_records(), yield_every=10)
+            task.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(len(ticks), len(NYC_SAT_SCORES) // 10)
+
+
+class HStoreParameterizedTests(unittest.TestCase):
+    def sql(self, src, **kwargs):
+        return Daffodil(src, HStoreQueryDelegate(hstore_field_name="h", parameterized=True), **kwargs).predicate
+
+    def test_values_become_params(self):
+        sql, params = self.sql('x = "a", y = "b", z > 3, w in (1, 2, 3), v !in ("c", "d")')
+        self.assertEqual(params, ["a", "b", 3, [1, 2, 3], ["c", "d"]])
+        self.assertEqual(sql.count("%s"), len(params))
+        self.assertNotIn("3", sql.replace("%s", ""))
+        self.assertIn("h @> hstore(ARRAY['x','y'], ARRAY[%s,%s])", sql)
+        self.assertIn("(h->'w')::numeric = ANY(%s::numeric[])", sql)
+        self.assertIn("(h->'v') <> ALL(%s::text[])", sql)
+
+        self.assertEqual(self.sql('x = "a"'), ("((h @> hstore('x', %s)))", ["a"]))
+        self.assertEqual(self.sql("x ?= true"), ("(h?'x')", []))
+
+    def test_same_shape_same_sql(self):
+        for sources in [
+            ['x = "a", y > 1, z ?= true', 'x = "other", y > 2.5, z ?= true'],
+            ["x in (1, 2)", "x in (1, 2, 3, 4, 5)"],
+            ['[x != "a", y < 10]', '[x != "b", y < 20]'],
+        ]:
+            sqls = {self.sql(src, optimize=False)[0] for src in sources}
+            self.assertEqual(len(sqls), 1, sources)
+
+    def test_escaping(self):
+        sql, params = self.sql(""""it's" = "it's", "100%" > 1, y = "50%" """)
+        # equalities are grouped into a single @> first
+        self.assertEqual(params, ["it's", "50%", 1])
+        self.assertIn("'it''s'", sql)
+        self.assertIn("'100%%'", sql)
+        self.assertNotIn("\x00", sql)
+
+    def test_call(self):
+        class QuerySet(object):
+            def extra(self, **kwargs):
+                self.kwargs = kwargs
+                return self
+
+        daff = Daffodil("x > 1, y = \"a\"", HStoreQueryDelegate(hstore_field_name="h", parameterized=True))
+        self.assertEqual(daff(QuerySet()).kwargs, {"where": [daff.predicate[0]], "params": [1, "a"]})
+
+    def test_delegate(self):
+        delegate = HStoreQueryDelegate(hstore_field_name="h", parameterized=True)
+        self.assertNotEqual(delegate.cache_key(), HStoreQueryDelegate(hstore_field_name="h").cache_key())
+        self.assertEqual(pickle.loads(pickle.dumps(delegate)).cache_key(), delegate.cache_key())
+        self.assertIsInstance(Daffodil("x = 1", HStoreQueryDelegate(hstore_field_name="h")).predicate, str)
+
+
+class HStoreSlicedTests(unittest.TestCase):
+    class QuerySet(object):
+        def __init__(self):
+            self.calls = []
+
+        def __getattr__(self, name):
+            def record(*args, **kwargs):
+                self.calls.append((name, args, kwargs))
+                return self
+            return record
+
+    def test_sliced(self):
+        daff = Daffodil('x > 1, y = "a"', HStoreQueryDelegate(hstore_field_name="h"))
+        queryset = daff.sliced(self.QuerySet(), extra_keys=["name", "x"], chunk_size=500)
+        self.assertEqual(queryset.calls, [
+            ("extra", (), {"where": [daff.predicate]}),
+            ("extra", (), {"select": {"daffodil_slice": "slice(h, %s)"}, "select_params": [["name", "x", "y"]]}),
+            ("values_list", ("pk", "daffodil_slice"), {}),
+            ("iterator", (), {"chunk_size": 500}),
+        ])
+
+    def test_parameterized(self):
+        daff = Daffodil("x > 1", HStoreQueryDelegate(hstore_field_name="h", parameterized=True))
+        queryset = daff.sliced(self.QuerySet())
+        self.assertEqual(queryset.calls[0], ("extra", (), {"where": [daff.predicate[0]], "params": [1]}))
+        self.assertEqual(queryset.calls[1][2]["select_params"], [["x"]])
+        self.assertEqual(queryset.calls[-1], ("iterator", (), {"chunk_size": 2000}))
+
+
+class HStoreGroupByKeyTests(unittest.TestCase):
+    NUMERIC_RE = "(h->'age') ~ E'"
+
+    def sql(self, src, parameterized=False, group_by_key=True, **kwargs):
+        return Daffodil(
+            src, HStoreQueryDelegate(hstore_field_name="h", parameterized=parameterized, group_by_key=group_by_key),
+            **kwargs
+        ).predicate
+
+    def test_between(self):
+        sql = self.sql("age >= 18, age <= 35")
+        self.assertEqual(sql.count(self.NUMERIC_RE), 1)
+        self.assertEqual(sql.count("(h?'age')"), 1)
+        self.assertIn("((h->'age')::numeric BETWEEN 18 AND 35)", sql)
+
+        sql, params = self.sql("age >= 18, age <= 35", parameterized=True)
+        self.assertIn("BETWEEN %s AND %s", sql)
+        self.assertEqual(params, [18, 35])
+
+    def test_any(self):
+        sql = self.sql("[age > 60, age < 10]")
+        self.assertEqual(sql.count(self.NUMERIC_RE), 1)
+        self.assertIn("((h->'age')::numeric > 60 OR (h->'age')::numeric < 10)", sql)
+        self.assertNotIn("BETWEEN", self.sql("[age >= 60, age <= 10]"))
+
+    def test_negative(self):
+        sql = self.sql('age != 3, age < 10, age != "x"')
+        self.assertEqual(sql.count("NOT (h?'age')"), 2)
+        self.assertEqual(sql.count("(h?'age')"), 3)
+
+        sql = self.sql('{age != 3, age !in (5, 6)}', optimize=True)
+        self.assertEqual(sql.count("NOT (h?'age')"), 1)
+        self.assertIn("NOT (h?'age') OR  NOT (h->'age') ~ E'", sql)
+
+    def test_keeps_types_and_keys_apart(self):
+        sql = self.sql('age > 1, age > "a", name < "z", x = "a", y = "b"')
+        self.assertEqual(sql.count(self.NUMERIC_RE), 1)
+        self.assertIn(" (h->'age') > 'a'", sql)
+        self.assertIn("(h?'name')", sql)
+        self.assertIn("h @> '\"x\"=>\"a\", \"y\"=>\"b\"'", sql)
+
+    def test_off_by_default(self):
+        src = "age >= 18, age <= 35, age > 20"
+        grouped = self.sql(src, optimize=False)
+        ungrouped = self.sql(src, group_by_key=False, optimize=False)
+        self.assertEqual(Daffodil(src, HStoreQueryDelegate(hstore_field_name="h"), optimize=False).predicate, ungrouped)
+        self.assertEqual(ungrouped.count(self.NUMERIC_RE), 3)
+        self.assertNotIn("BETWEEN", ungrouped)
+        self.assertEqual(grouped.count(self.NUMERIC_RE), 1)
+        self.assertIn(
+            "((h->'age')::numeric BETWEEN 18 AND 35 AND (h->'age')::numeric > 20)", grouped
+        )
+
+    def test_delegate(self):
+        delegate = HStoreQueryDelegate(hstore_field_name="h", group_by_key=True)
+        self.assertNotEqual(delegate.cache_key(), HStoreQueryDelegate(hstore_field_name="h").cache_key())
+        self.assertEqual(pickle.loads(pickle.dumps(delegate)).cache_key(), delegate.cache_key())
+
+
+class JSONBQueryDelegateTests(unittest.TestCase):
+    def sql(self, src, **kwargs):
+        return Daffodil(src, JSONBQueryDelegate("d"), cache=None, **kwargs).predicate
+
+    def test_comparisons(self):
+        self.assertEqual(self.sql('x = "a"'), """(d @> '{"x": "a"}')""")
+        self.assertEqual(self.sql("x != 1.5"), """(NOT (d @> '{"x": 1.5}'))""")
+        self.assertEqual(self.sql("x > 2"), """(d ? 'x' AND d @? 'strict $."x" ? (@ > 2)')""")
+        self.assertEqual(self.sql("x in (1, 2)"), """(d ? 'x' AND d @? 'strict $."x" ? (@ == 1 || @ == 2)')""")
+        self.assertEqual(self.sql('x !in ("a", "b")'), """(NOT (d ? 'x' AND d @? 'strict $."x" ? (@ == "a" || @ == "b")'))""")
+        self.assertEqual(self.sql("x ?= true"), "(d ? 'x')")
+        self.assertEqual(self.sql("x ?= false"), "(NOT (d ? 'x'))")
+        self.assertNotIn("~", self.sql("x > 1, y <= 2.5, z = 3"))
+
+    def test_escaping(self):
+        sql = self.sql(""""it's" = "o'k", "a \\"b\\"" < "c", "100%" ?= true""")
+        self.assertIn("""d @> '{"it''s": "o''k"}'""", sql)
+        self.assertIn("""d @? 'strict $."a \\"b\\"" ? (@ < "c")'""", sql)
+        self.assertIn("d ? '100%'", sql)
+
+    def test_equalities(self):
+        self.assertEqual(
+            self.sql('x = "a", y = 1, z = true'), """(d @> '{"x": "a", "y": 1, "z": true}')"""
+        )
+        self.assertEqual(self.sql('[x != "a", y != 1]'), """((NOT (d @> '{"x": "a", "y": 1}')))""")
+        self.assertEqual(
+            self.sql('[x = "a", y = 1]'), """((d @> '{"x": "a"}') OR (d @> '{"y": 1}'))"""
+        )
+
+    def test_existence(self):
+        self.assertEqual(
+            self.sql("a ?= true, b ?= true, c ?= false, d ?= false", optimize=False),
+            "(d ?& ARRAY['a','b']) AND (NOT (d ?| ARRAY['c','d']))",
+        )
+        self.assertEqual(
+            self.sql("[a ?= false, b ?= false, c ?= true, d ?= true]", optimize=False),
+            "((NOT (d ?& ARRAY['a','b'])) OR (d ?| ARRAY['c','d']))",
+        )
+
+    def test_ranges(self):
+        self.assertEqual(self.sql("age >= 18, age <= 35"), """(d ? 'age' AND d @? 'strict $."age" ? ((@ >= 18) && (@ <= 35))')""")
+        self.assertEqual(
+            self.sql("[age < 18, age > 65]", optimize=False), """((d ? 'age' AND d @? 'strict $."age" ? ((@ < 18) || (@ > 65))'))"""
+        )
+        self.assertEqual(
+            self.sql("x !in (1, 2), x !in (5, 6)", optimize=False),
+            """(NOT (d ? 'x' AND d @? 'strict $."x" ? ((@ == 1 || @ == 2) || (@ == 5 || @ == 6))'))""",
+        )
+
+    def test_optimized_equalities(self):
+        # the optimizer turns them into an "in" test, which must not look
+        # into arrays either
+        self.assertEqual(self.sql("[x = 1, x = 2]", optimize=False), """((d @> '{"x": 1}') OR (d @> '{"x": 2}'))""")
+        self.assertEqual(
+            self.sql("[x = 1, x = 2]", optimize=True), """(d ? 'x' AND d @? 'strict $."x" ? (@ == 1 || @ == 2)')"""
+        )
+
+    def test_groups(self):
+        self.assertEqual(self.sql("{}"), "(true)")
+        self.assertEqual(self.sql("[]"), "(false)")
+        self.assertEqual(self.sql("![x > 1, y < 2]"), """( NOT ((d ? 'x' AND d @? 'strict $."x" ? (@ > 1)') OR (d ? 'y' AND d @? 'strict $."y" ? (@ < 2)')))""")
+
+    def test_delegate(self):
+        class QuerySet(object):
+            def extra(self, **kwargs):
+                self.kwargs = kwargs
+                return self
+
+        daff = Daffodil('x = "50%"', JSONBQueryDelegate("d"))
+        self.assertEqual(daff(QuerySet()).kwargs, {"where": ["""(d @> '{"x": "50%%"}')"""]})
+        delegate = JSONBQueryDelegate("d")
+        self.assertEqual(pickle.loads(pickle.dumps(delegate)).cache_key(), delegate.cache_key())
+        self.assertNotEqual(delegate.cache_key(), JSONBQueryDelegate("e").cache_key())
+
+
+def sqlite_connection(records, json_column=None, columns=None):
+    """
+    An in-memory table "t" holding ``records``, either as JSON documents in
+    ``json_column`` or in ``columns`` (name to declared type, keys of the
+    records without a column are dropped).
+    """
+    connection = sqlite3.connect(":memory:")
+    if json_column is not None:
+        connection.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, "{}")'.format(json_column))
+        connection.executemany(
+            "INSERT INTO t VALUES (?, ?)", [(i, json.dumps(record)) for i, record in enumerate(records)]
+        )
+    else:
+        connection.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, {})".format(
+            ", ".join('"{}" {}'.format(column, column_type) for column, column_type in columns.items())
+        ))
+        connection.executemany(
+            "INSERT INTO t VALUES (?, {})".format(", ".join("?" * len(columns))),
+            [[i] + [(record or {}).get(column) for column in columns] for i, record in enumerate(records)],
+        )
+    return connection
+
+
+class SQLiteQueryDelegateTests(unittest.TestCase):
+    def sql(self, src, delegate=None, **kwargs):
+        return Daffodil(src, delegate or SQLiteQueryDelegate(), cache=None, **kwargs).predicate
+
+    def test_comparisons(self):
+        self.assertEqual(self.sql("x > 2", SQLiteQueryDelegate(numeric_keys=["x"])), (
+            """(typeof("x") IN ('integer', 'real') AND "x" > ?)""", [2]
+        ))
+        self.assertEqual(self.sql("x > 2"), (
+            """((typeof("x") IN ('integer', 'real') AND "x" > ?) OR """
+            """(typeof("x") = 'text' AND "x" = CAST("x" AS NUMERIC) AND CAST("x" AS REAL) > ?))""",
+            [2, 2],
+        ))
+        self.assertEqual(self.sql('x = "a"'), ("""(typeof("x") = 'text' AND "x" = ?)""", ["a"]))
+        self.assertEqual(self.sql('x != "1.5"'), (
+            """(NOT ((typeof("x") = 'text' AND "x" = ?) OR (typeof("x") IN ('integer', 'real') AND "x" = ?)))""",
+            ["1.5", 1.5],
+        ))
+        self.assertEqual(self.sql('x in ("a", "b")')[1], ["a", "b"])
+        self.assertEqual(self.sql("x ?= true"), ('("x" IS NOT NULL)', []))
+        self.assertEqual(self.sql("x ?= false"), ('("x" IS NULL)', []))
+
+    def test_json(self):
+        delegate = SQLiteQueryDelegate(json_column="d")
+        self.assertEqual(self.sql("x ?= true", delegate), ("""(json_type("d", '$."x"') IS NOT NULL)""", []))
+        self.assertEqual(self.sql("x < 2", SQLiteQueryDelegate("d", numeric_keys=["x"])), (
+            """(coalesce(json_type("d", '$."x"'), '') IN ('integer', 'real', 'true', 'false') """
+            """AND json_extract("d", '$."x"') < ?)""",
+            [2],
+        ))
+        # a JSON true matches any string, as python's bool() of it
+        self.assertEqual(self.sql('x = "a"', delegate)[1], ["a", 1])
+        self.assertIn("""'$."it''s"'""", self.sql('''"it's" = 1''', delegate)[0])
+        with self.assertRaises(ValueError):
+            self.sql('"a \\"b\\"" = 1', delegate)
+
+    def test_missing_columns(self):
+        delegate = SQLiteQueryDelegate(columns=["x"])
+        self.assertEqual(self.sql("y ?= true", delegate), ("(NULL IS NOT NULL)", []))
+        connection = sqlite_connection([{"x": 1}], columns={"x": ""})
+        for src, n in [("x = 1", 1), ("y = 1", 0), ("y != 1", 1), ("y !in (1, 2)", 1), ("y ?= false", 1)]:
+            self.assertEqual(len(Daffodil(src, delegate)(connection, "t").fetchall()), n, src)
+
+    def test_groups(self):
+        self.assertEqual(self.sql(""), ("true", []))
+        self.assertEqual(self.sql("[]"), ("(false)", []))
+        self.assertEqual(self.sql("[x ?= true, y ?= true]"), ('(("x" IS NOT NULL) OR ("y" IS NOT NULL))', []))
+        self.assertEqual(self.sql("!{x ?= true, y ?= true}"), ('( NOT (("x" IS NOT NULL) AND ("y" IS NOT NULL)))', []))
+        # NaN matches nothing
+        self.assertEqual(self.sql('x = 1, y != "nan"', optimize=False), (
+            """((typeof("x") IN ('integer', 'real') AND "x" = ?) OR """
+            """(typeof("x") = 'text' AND "x" = CAST("x" AS NUMERIC) AND CAST("x" AS REAL) = ?)) """
+            """AND (NOT (typeof("y") = 'text' AND "y" = ?))""",
+            [1, 1, "nan"],
+        ))
+
+    def test_indexes(self):
+        connection = sqlite_connection([{"x": i, "y": str(i)} for i in range(100)], columns={"x": "INTEGER", "y": ""})
+        connection.execute('CREATE INDEX t_x ON t ("x")')
+        for delegate, uses_index in [(SQLiteQueryDelegate(), False), (SQLiteQueryDelegate(numeric_keys=["x"]), True)]:
+            sql, params = Daffodil("x >= 10, x < 20", delegate).predicate
+            plan = connection.execute("EXPLAIN QUERY PLAN SELECT * FROM t WHERE " + sql, params).fetchall()
+            self.assertEqual("USING INDEX t_x" in str(plan), uses_index)
+
+        connection = sqlite_connection([{"x": i} for i in range(100)], json_column="d")
+        connection.execute("""CREATE INDEX t_d_x ON t (json_extract(d, '$."x"'))""")
+        for src in ["x >= 10, x < 20", 'x = "10"', 'x in ("a", "b")']:
+            sql, params = Daffodil(src, SQLiteQueryDelegate("d", numeric_keys=["x"])).predicate
+            plan = connection.execute("EXPLAIN QUERY PLAN SELECT * FROM t WHERE " + sql, params).fetchall()
+            self.assertIn("USING INDEX t_d_x", str(plan), src)
+
+    def test_delegate(self):
+        connection = sqlite_connection([{"x": 1}, {"x": "2"}, {"x": "a"}, {}], json_column="d")
+        daff = Daffodil("x >= 1", SQLiteQueryDelegate("d"))
+        self.assertEqual(daff(connection, "t", ["id"]).fetchall(), [(0,), (1,)])
+        connection.execute('CREATE TABLE "my ""t""" ("it\'s" INTEGER, "a b" TEXT)')
+        connection.execute('INSERT INTO "my ""t""" VALUES (1, \'x\'), (2, \'y\')')
+        daff = Daffodil('"it\'s" > 1', SQLiteQueryDelegate(columns=["it's", "a b"]))
+        self.assertEqual(daff(connection, 'my "t"', ["a b", "it's"]).fetchall(), [("y", 2)])
+        delegate = SQLiteQueryDelegate("d", numeric_keys=["x"])
+        self.assertEqual(pickle.loads(pickle.dumps(delegate)).cache_key(), delegate.cache_key())
+        self.assertNotEqual(delegate.cache_key(), SQLiteQueryDelegate("d").cache_key())
+
+
+class SATDataTestsWithSQLite(SATDataTests):
+    """
+    Records stored as JSON documents.
+    """
+    def filter(self, daff_src):
+        connection = sqlite_connection(self.d, json_column="data")
+        rows = Daffodil(daff_src, SQLiteQueryDelegate(json_column="data"))(connection, "t", ["data"])
+        return [json.loads(data) for data, in rows]
+
+
+class SATDataTestsWithSQLiteColumns(SATDataTests):
+    """
+    Records stored in untyped columns, which keep the values' types.
+    """
+    def filter(self, daff_src):
+        columns = {key: "" for record in NYC_SAT_SCORES for key in record}
+        connection = sqlite_connection(self.d, columns=columns)
+        rows = Daffodil(daff_src, SQLiteQueryDelegate(columns=columns))(connection, "t", ["id"])
+        return [self.d[pk] for pk, in rows]
+
+
+class GeneratedDataTestsWithSQLite(unittest.TestCase):
+    """
+    Matches SQLiteQueryDelegate's SQL against DictionaryPredicateDelegate
+    on generated records, as read back from the table: typed columns store
+    numeric strings as numbers and SQLite has no booleans.
+    """
+    def setUp(self):
+        rnd = random.Random(5)
+        self.schema = make_schema(rnd, 8)
+        self.records = [make_record(rnd, self.schema) for _ in range(300)] + [None, {}]
+        self.filters = [make_filter(rnd, self.schema, rnd.randint(1, 12), rnd.randint(1, 3), 3) for _ in range(150)]
+
+    def assert_same_matches(self, connection, delegate, records):
+        for src in self.filters:
+            expected = Daffodil(src)
+            self.assertEqual(
+                {pk for pk, in Daffodil(src, delegate)(connection, "t", ["id"])},
+                {pk for pk, record in records.items() if expected.predicate(record)},
+                src,
+            )
+
+    def test_json(self):
+        connection = sqlite_connection(self.records, json_column="data")
+        records = {pk: json.loads(data) for pk, data in connection.execute("SELECT id, data FROM t")}
+        self.assert_same_matches(connection, SQLiteQueryDelegate("data"), records)
+
+    def test_columns(self):
+        numeric_keys = [key for key, value_type in self.schema.items() if value_type in ("int", "float")]
+        columns = {key: "REAL" if key in numeric_keys else "" for key in self.schema}
+        connection = sqlite_connection(self.records, columns=columns)
+        cursor = connection.execute("SELECT * FROM t")
+        names = [description[0] for description in cursor.description]
+        records = {
+            row[0]: {key: val for key, val in zip(names[1:], row[1:]) if val is not None}
+            for row in cursor
+        }
+        for delegate in [
+            SQLiteQueryDelegate(columns=columns),
+            SQLiteQueryDelegate(columns=columns, numeric_keys=numeric_keys),
+        ]:
+            self.assert_same_matches(connection, delegate, records)
+
+
+class IndexAdvisorTests(unittest.TestCase):
+    CORPUS = [
+        ("age >= 18, age <= 35, premium ?= true", 1),
+        ("age > 60", 2),
+        ("[age > 60, visits > 3]", 3),
+        ('country = "us", premium ?= true', 4),
+        ("premium ?= true, vip ?= true", 5),
+        ('name != "x"', 6),
+        ("[age > 60, age < 10]", 7),
+    ]
+
+    def setUp(self):
+        self.advisor = IndexAdvisor("app_profile", "data")
+        for src, weight in self.CORPUS:
+            self.advisor.add(src, weight=weight)
+
+    def test_recommendations(self):
+        recommendations = self.advisor.recommendations()
+        self.assertEqual(
+            [(r.kind, r.key, r.filters) for r in recommendations],
+            [("gin", None, 22), ("numeric", "age", 10), ("exists", "premium", 10), ("exists", "vip", 5)],
+        )
+        self.assertEqual(recommendations[0].sql, "CREATE INDEX IF NOT EXISTS app_profile_data_gin ON app_profile USING GIN (data)")
+        self.assertEqual(recommendations[0].operators, {"?&": 10, "?": 24, "?|": 3, "@>": 4})
+
+        numeric = recommendations[1]
+        self.assertAlmostEqual(numeric.share, 10 / 28.0)
+        self.assertEqual(numeric.conditions, 21)
+        self.assertEqual(numeric.operators, {">=": 1, "<=": 1, ">": 12, "<": 7})
+        self.assertEqual(numeric.value_types, {"numeric": 21})
+        self.assertTrue(numeric.sql.startswith(
+            "CREATE INDEX IF NOT EXISTS app_profile_data_age_numeric ON app_profile (((data->'age')::numeric)) "
+            "WHERE (data->'age') ~ E'"
+        ))
+        # the partial index predicate is the type check of the delegate's SQL
+        self.assertIn(numeric.sql.split(" WHERE ")[1], Daffodil("age > 60", self.advisor.sql_delegate).predicate)
+
+        self.assertEqual(
+            recommendations[2].sql,
+            "CREATE INDEX IF NOT EXISTS app_profile_data_premium_exists ON app_profile (id) WHERE data ? 'premium'",
+        )
+        self.assertEqual(
+            [r.key for r in self.advisor.recommendations(min_share=0.3)], [None, "age", "premium"]
+        )
+        self.assertEqual(IndexAdvisor("t", "h").recommendations(), [])
+
+    def test_names(self):
+        advisor = IndexAdvisor("t", "h")
+        advisor.add('"it\'s a very long key, longer than postgres identifiers can be" ?= true')
+        recommendation = advisor.recommendations()[1]
+        name = recommendation.sql.split()[5]
+        self.assertEqual(len(name), 63)
+        self.assertRegex(name, r"^t_h_it_s_a_very_long_key_\w+_[0-9a-f]{8}$")
+        self.assertTrue(recommendation.sql.endswith("WHERE h ? 'it''s a very long key, longer than postgres identifiers can be'"))
+
+        # keys only told apart by what's sanitized don't share an index
+        names = {index_name("t", "h", key, "exists") for key in ["a-b", "a b", "A_B", "a_b"]}
+        self.assertEqual(len(names), 4)
+        self.assertIn("t_h_a_b_exists", names)
+
+    def test_rewrite(self):
+        src = "premium ?= true, vip ?= true, age > 3"
+        self.assertIn("data ?& ARRAY['age','premium','vip']", Daffodil(src, self.advisor.sql_delegate).predicate)
+
+        delegate = self.advisor.delegate(self.advisor.recommendations())
+        self.assertEqual(delegate.indexed_keys, frozenset(["premium", "vip"]))
+        sql = Daffodil(src, delegate).predicate
+        self.assertNotIn("?&", sql)
+        self.assertIn("(data?'premium') AND (data?'vip')", sql)
+        self.assertIn("(data->'age')::numeric > 3", sql)
+        self.assertEqual(pickle.loads(pickle.dumps(delegate)).cache_key(), delegate.cache_key())
+        self.assertTrue(self.advisor.delegate([], parameterized=True).parameterized)
+
+
+class HStoreSegmentsTests(unittest.TestCase):
+    SEGMENTS = {
+        "teens": "age < 20, premium ?= true",
+        "adults": "age >= 20, premium ?= true",
+        "us_teens": 'country = "us", age < 20',
+    }
+
+    class Cursor(object):
+        def __init__(self, rows):
+            self.rows = rows
+
+        def execute(self, *args):
+            self.executed = args
+
+        def fetchone(self):
+            return self.rows[0]
+
+        def __iter__(self):
+            return iter(self.rows)
+
+    def test_hoisting(self):
+        segments = HStoreSegments(self.SEGMENTS, "t", "h")
+        self.assertEqual([column for column, _ in segments.conditions], ["daffodil_c0", "daffodil_c1"])
+        self.assertIn("(h->'age')::numeric < 20", segments.conditions[0][1])
+        self.assertEqual(segments.conditions[1][1], "h?'premium'")
+        self.assertEqual(segments.segments[0], "(daffodil_c0) AND (daffodil_c1)")
+        self.assertIn("(h->'age')::numeric >= 20", segments.segments[1])
+        self.assertEqual(segments.segments[2], "((h @> hstore('country', 'us'))) AND (daffodil_c0)")
+
+        self.assertEqual(HStoreSegments(self.SEGMENTS, "t", "h", min_segments=3).conditions, [])
+
+    def test_counts_sql(self):
+        sql = HStoreSegments(self.SEGMENTS, "t", "h").counts_sql()
+        self.assertTrue(sql.startswith("WITH daffodil_conditions AS (SELECT id, h, ((h?'age') AND "))
+        self.assertIn(" AS daffodil_c0, (h?'premium') AS daffodil_c1 FROM t OFFSET 0) SELECT ", sql)
+        self.assertIn("count(*) FILTER (WHERE (daffodil_c0) AND (daffodil_c1)) AS segment_0, ", sql)
+        self.assertTrue(sql.endswith(" AS segment_2 FROM daffodil_conditions"))
+        self.assertEqual(sql.count("numeric < 20"), 1)
+
+        self.assertEqual(
+            HStoreSegments(["x ?= true", "y ?= true"], "t", "h").counts_sql(),
+            "SELECT count(*) FILTER (WHERE (h?'x')) AS segment_0, count(*) FILTER (WHERE (h?'y')) AS segment_1 FROM t",
+        )
+
+    def test_rows_sql(self):
+        segments = HStoreSegments(["x ?= true", "y ?= true"], "t", "h", pk="pk")
+        self.assertEqual(
+            segments.rows_sql(),
+            "SELECT pk, segments FROM (SELECT pk, (array_remove(ARRAY[CASE WHEN (h?'x') THEN 0 END, "
+            "CASE WHEN (h?'y') THEN 1 END], NULL)) AS segments FROM t) AS matches WHERE cardinality(segments) > 0",
+        )
+        self.assertEqual(
+            segments.rows_sql(bitmask=True),
+            "SELECT pk, segments FROM (SELECT pk, (CASE WHEN (h?'x') THEN B'1' ELSE B'0' END || "
+            "CASE WHEN (h?'y') THEN B'1' ELSE B'0' END) AS segments FROM t) AS matches "
+            "WHERE position(B'1' IN segments) > 0",
+        )
+
+    def test_parameterized(self):
+        sql, params = HStoreSegments(
+            ["x = 1, y > 2", 'x = 1, z in (1, 2), w = "50%"'], "t", "h", parameterized=True
+        ).counts_sql()
+        # hoisted conditions come first
+        self.assertEqual(params, [1, 2, [1, 2], "50%"])
+        self.assertEqual(sql.count("%s"), 4)
+        self.assertIn("(h->'x')::numeric = %s) AS daffodil_c0", sql)
+
+    def test_run(self):
+        segments = HStoreSegments(self.SEGMENTS, "t", "h")
+        cursor = self.Cursor([(3, 5, 0)])
+        self.assertEqual(segments.counts(cursor), {"teens": 3, "adults": 5, "us_teens": 0})
+        self.assertEqual(cursor.executed, (segments.counts_sql(),))
+
+        self.assertEqual(
+            list(segments.rows(self.Cursor([(1, [0, 2]), (4, [1])]))),
+            [(1, ["teens", "us_teens"]), (4, ["adults"])],
+        )
+        self.assertEqual(
+            list(segments.rows(self.Cursor([(1, "101"), (4, "010")]), bitmask=True)),
+            [(1, ["teens", "us_teens"]), (4, ["adults"])],
+        )
+
+        segments = HStoreSegments(["x > 1"], "t", "h", parameterized=True)
+        cursor = self.Cursor([(2,)])
+        self.assertEqual(segments.counts(cursor), {0: 2})
+        self.assertEqual(cursor.executed, segments.counts_sql())
+
+
+class ParallelFilterTests(unittest.TestCase):
+    SRC = """
+        sat_math_avg_score > 450
+        [
+            dbn ?= false
+            school_name != "nope"
+        ]
+    """
+
+    def test_pickle_round_trip(self):
+        for delegate in [
+            DictionaryPredicateDelegate(),
+            DictionaryPredicateDelegate(adaptive=True),
+            HStoreQueryDelegate(hstore_field_name="hsdata"),
+            PrettyPrintDelegate(dense=False),
+            KeyExpectationDelegate(),
+        ]:
+            daff = Daffodil(self.SRC, delegate)
+            unpickled = pickle.loads(pickle.dumps(daff))
+            self.assertEqual(type(unpickled.delegate), type(delegate))
+            self.assertEqual(unpickled.keys, daff.keys)
+            self.assertEqual(unpickled.delegate.cache_key(), delegate.cache_key())
+
+        daff = Daffodil(self.SRC, DictionaryPredicateDelegate(adaptive=True))
+        unpickled = pickle.loads(pickle.dumps(daff))
+        self.assertEqual(unpickled(NYC_SAT_SCORES), daff(NYC_SAT_SCORES))
+
+    def test_filter_parallel_matches_serial_filter(self):
+        records = NYC_SAT_SCORES + [None, {}]
+        for adaptive in (False, True):
+            daff = Daffodil(self.SRC, DictionaryPredicateDelegate(adaptive=adaptive))
+            for chunksize in (1, 37, 1000):
+                result = daff.filter_parallel(records, workers=2, chunksize=chunksize)
+                self.assertEqual(result, daff(records))
+
+        # matching records come back whole, not stripped
+        self.assertIs(result[0], daff(records)[0])
+
+    def test_filter_parallel_generator_input(self):
+        daff = Daffodil("num_of_sat_test_takers < 50")
+        result = daff.filter_parallel((r for r in NYC_SAT_SCORES), workers=2, chunksize=10)
+        self.assertEqual(result, daff(NYC_SAT_SCORES))
+
+    def test_filter_parallel_requires_record_predicates(self):
+        daff = Daffodil("x = 1", PrettyPrintDelegate())
+        self.assertRaises(TypeError, daff.filter_parallel, [{"x": 1}])
+
+    def test_strip_record(self):
+        self.assertEqual(strip_record({"a": 1, "b": 2, "c": 3}, ("a", "c", "d")), {"a": 1, "c": 3})
+        self.assertIsNone(strip_record(None, ("a",)))
+
+
+class DaffodilCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = DaffodilCache(max_entries=3, clock=lambda: self.now)
+
+    def daff(self, src, delegate=DictionaryPredicateDelegate()):
+        return Daffodil(src, delegate=delegate, cache=self.cache)
+
+    def test_hits_and_misses(self):
+        d1 = self.daff("x = 1")
+        d2 = self.daff("x = 1")
+
+        self.assertIs(d1.predicate, d2.predicate)
+        self.assertEqual(d2.keys, {"x"})
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_keyed_on_the_cleaned_source(self):
+        d1 = self.daff("x = 1")
+        d2 = self.daff("x = 1\u200b")
+
+        self.assertIs(d1.predicate, d2.predicate)
+        self.assertEqual(len(self.cache), 1)
+
+    def test_delegate_configuration_is_part_of_the_key(self):
+        self.assertEqual(
+            self.daff('x = "y"', HStoreQueryDelegate(hstore_field_name="a")).predicate,
+            "((a @> hstore('x', 'y')))"
+        )
+        self.assertEqual(
+            self.daff('x = "y"', HStoreQueryDelegate(hstore_field_name="b")).predicate,
+            "((b @> hstore('x', 'y')))"
+        )
+        self.assertEqual(self.daff("x=1", PrettyPrintDelegate(dense=True))(), '{"x"=1}')
+        self.assertEqual(self.daff("x=1", PrettyPrintDelegate(dense=False))(), '{\n  "x" = 1\n}')
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_stateful_predicates_are_not_shared(self):
+        for delegate in (
+            DictionaryPredicateDelegate(adaptive=True),
+            DictionaryPredicateDelegate(instrumented=True),
+            DictionaryPredicateDelegate(pool=ConditionPool()),
+        ):
+            self.assertIsNot(self.daff("x = 1", delegate).predicate, self.daff("x = 1", delegate).predicate)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_eviction(self):
+        for src in ("a = 1", "b = 1", "c = 1", "a = 1", "d = 1"):
+            self.daff(src)
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.evictions, 1)
+
+        # "b = 1" was the least recently used entry
+        self.daff("b = 1")
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 5)
+
+    def test_source_length_limit(self):
+        cache = DaffodilCache(max_source_chars=10)
+        Daffodil("a = 1", cache=cache)
+        Daffodil("bb = 1", cache=cache)
+        Daffodil("too_long_to_cache = 1", cache=cache)
+
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.stats()["source_chars"], 6)
+
+    def test_current_timestamps_expire(self):
+        d1 = self.daff("x > timestamp(CURRENT_DAY)")
+        self.assertIsNotNone(d1.expires())
+        self.assertIsNone(self.daff("x > timestamp(2017-10-31)").expires())
+
+        self.now = d1.expires() - 1
+        self.assertIs(self.daff("x > timestamp(CURRENT_DAY)").predicate, d1.predicate)
+
+        self.now = d1.expires()
+        self.assertIsNot(self.daff("x > timestamp(CURRENT_DAY)").predicate, d1.predicate)
+        self.assertEqual(self.cache.expirations, 1)
+
+    def test_timestamp_expiry_boundaries(self):
+        for expression, period in (
+            ("CURRENT_DAY - 3", relativedelta(days=1)),
+            ("CURRENT_WEEK", relativedelta(weeks=1)),
+            ("CURRENT_MONTH - 2", relativedelta(months=1)),
+            ("CURRENT_YEAR", relativedelta(years=1)),
+        ):
+            ts = TimeStamp(expression)
+            period_start = datetime.fromtimestamp(TimeStamp(expression.split("-")[0]).content)
+            self.assertEqual(datetime.fromtimestamp(ts.expires), period_start + period)
+
+    def test_uncached(self):
+        Daffodil("x = 1", cache=None)
+        Daffodil("x = 1", cache=None)
+        self.assertEqual(self.cache.stats()["misses"], 0)
+
+
 # Borrowed gratuitously from https://gist.github.com/k4ml/2219751
 from os import path as osp
 
@@ -1915,6 +3392,117 @@ class SATDataTestsWithHStore(SATDataTests):
         pass
 
 
+class SATDataTestsWithHStoreParameterized(SATDataTestsWithHStore):
+    def filter(self, daff_src):
+        delegate = HStoreQueryDelegate(hstore_field_name="hsdata", parameterized=True)
+        return Daffodil(daff_src, delegate=delegate)(self.d)
+
+
+class SATDataTestsWithHStoreGrouped(SATDataTestsWithHStore):
+    def filter(self, daff_src):
+        delegate = HStoreQueryDelegate(hstore_field_name="hsdata", group_by_key=True)
+        return Daffodil(daff_src, delegate=delegate)(self.d)
+
+
+class SATDataTestsWithHStoreOptimized(SATDataTestsWithHStore):
+    def filter(self, daff_src):
+        delegate = HStoreQueryDelegate(hstore_field_name="hsdata")
+        return Daffodil(daff_src, delegate=delegate, optimize=True)(self.d)
+
+
+class SlicedTestsWithHStore(unittest.TestCase):
+    def test_sliced(self):
+        queryset = BasicHStoreData.objects.all()
+        for src, extra_keys in [
+            ("sat_math_avg_score > 450", ["dbn"]),
+            ('[zip_code ?= true, school_name = "EAST SIDE COMMUNITY SCHOOL"]', []),
+            ("missing_key ?= false", ["dbn", "no_such_key"]),
+        ]:
+            daff = Daffodil(src, HStoreQueryDelegate(hstore_field_name="hsdata"))
+            keys = daff.keys | set(extra_keys)
+            expected = {
+                obj.pk: {key: val for key, val in obj.hsdata.items() if key in keys}
+                for obj in daff(queryset)
+            }
+            self.assertEqual(dict(daff.sliced(queryset, extra_keys, chunk_size=10)), expected)
+
+
+class SegmentsTestsWithHStore(unittest.TestCase):
+    def test_matches_separate_queries(self):
+        from django.db import connection
+
+        sources = [
+            "sat_math_avg_score > 450",
+            "sat_math_avg_score > 450, num_of_sat_test_takers > 50",
+            '[num_of_sat_test_takers > 50, school_name != "EAST SIDE COMMUNITY SCHOOL"]',
+            "!{sat_math_avg_score > 450, zip_code ?= true}",
+        ]
+        queryset = BasicHStoreData.objects.all()
+        for parameterized in (False, True):
+            segments = HStoreSegments(
+                sources, BasicHStoreData._meta.db_table, "hsdata", parameterized=parameterized
+            )
+            expected = [
+                set(Daffodil(src, HStoreQueryDelegate(hstore_field_name="hsdata"))(queryset).values_list("pk", flat=True))
+                for src in sources
+            ]
+            with connection.cursor() as cursor:
+                self.assertEqual(segments.counts(cursor), {i: len(pks) for i, pks in enumerate(expected)})
+                for bitmask in (False, True):
+                    rows = dict(segments.rows(cursor, bitmask))
+                    self.assertEqual(
+                        rows, {pk: [i for i, pks in enumerate(expected) if pk in pks] for pk in set().union(*expected)}
+                    )
+
+
+from testapp.models import BasicJSONBData
+
+
+class GeneratedDataTestsWithJSONB(unittest.TestCase):
+    """
+    Matches JSONBQueryDelegate's SQL against DictionaryPredicateDelegate
+    on generated records. Values keep their key's type, JSONB comparisons
+    being typed.
+    """
+    @classmethod
+    def setUpClass(cls):
+        rnd = random.Random(7)
+        cls.schema = make_schema(rnd, 8)
+        BasicJSONBData.objects.all().delete()
+        cls.records = {}
+        for _ in range(500):
+            record = {
+                key: make_value(rnd, value_type)
+                for key, value_type in cls.schema.items() if rnd.random() > 0.1
+            }
+            cls.records[BasicJSONBData.objects.create(jsdata=record).pk] = record
+
+    def test_matches_dictionary_delegate(self):
+        rnd = random.Random(11)
+        for _ in range(200):
+            src = make_filter(rnd, self.schema, rnd.randint(1, 12), rnd.randint(1, 3), 3)
+            expected = Daffodil(src)
+            daff = Daffodil(src, JSONBQueryDelegate("jsdata"))
+            self.assertEqual(
+                set(daff(BasicJSONBData.objects.all()).values_list("pk", flat=True)),
+                {pk for pk, record in self.records.items() if expected.predicate(record)},
+                src,
+            )
+
+    def test_array_values(self):
+        # containment doesn't look into arrays, nor do strict jsonpath filters
+        records = [{"x": [1]}, {"x": [1, 2]}, {"x": 1}, {"x": [[1]]}, {}]
+        objects = [BasicJSONBData.objects.create(jsdata=record) for record in records]
+        self.addCleanup(BasicJSONBData.objects.filter(pk__in=[obj.pk for obj in objects]).delete)
+        queryset = BasicJSONBData.objects.filter(pk__in=[obj.pk for obj in objects])
+
+        for src in ["[x = 1, x = 2]", "x != 1, x != 2", "x in (1, 2)", "x !in (1, 2)", "x > 0, x = 1", "x >= 1"]:
+            expected = {obj.pk for obj, record in zip(objects, records) if Daffodil(src).predicate(record)}
+            for optimize in (False, True):
+                daff = Daffodil(src, JSONBQueryDelegate("jsdata"), optimize=optimize)
+                self.assertEqual(set(daff(queryset).values_list("pk", flat=True)), expected, (src, optimize))
+
+
 from django.core import management
 
 if __name__ == "__main__":